@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, make_response
+from flask import Flask, jsonify, request, make_response, g, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 from flask_cors import CORS
@@ -12,16 +12,43 @@ from quarks3 import (
     get_user_portfolios, get_user_watchlists,
     get_portfolio_details, get_watchlist_details,
     get_portfolio_images, StrategyManager,
-    get_stock_price, get_historical_price,
-    generate_advice_sheet
+    get_stock_price, get_historical_price, get_historical_prices,
+    generate_advice_sheet, METRICS,
+    should_profile, profile_call, PortfolioEncoder,
+    walk_forward_backtest, monte_carlo_backtest, live_indicators,
+    INTRADAY_BARS, execute_orders, update_portfolio, update_watchlist, VersionConflict,
+    add_watchlist_item, remove_watchlist_item, PRICE_ALERTS, MARKET_SNAPSHOT,
+    run_screen, start_calendar_refresh
 )
 import json
+import os
+import queue
+import time
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 CORS(app) 
 
+METRICS.describe('quarks_http_request_seconds', 'Request latency by route, method and status')
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Label by URL rule (not the concrete path) to keep cardinality bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        METRICS.observe('quarks_http_request_seconds', time.perf_counter() - started,
+                        route=route, method=request.method, status=response.status_code)
+    return response
+
+
 # Helper Functions
 def token_required(f):
     @wraps(f)
@@ -115,7 +142,8 @@ def get_user(current_user, user_id):
 @token_required
 def portfolios(current_user):
     if request.method == 'GET':
-        portfolios_data = get_user_portfolios(current_user)
+        valuate = request.args.get('valuation', '').lower() in ('1', 'true', 'yes')
+        portfolios_data = get_user_portfolios(current_user, valuate=valuate)
         return jsonify(portfolios_data)
 
     elif request.method == 'POST':
@@ -143,14 +171,20 @@ def portfolio(current_user, portfolio_id):
 
     elif request.method == 'PUT':
         data = request.get_json()
-        # Update portfolio name if provided
-        if 'name' in data:
-            portfolio.name = data['name']
-        # You could add more update logic here
-        success = save_portfolio(current_user, portfolio)
-        if success:
+
+        def rename(portfolio):
+            # Update portfolio name if provided
+            if 'name' in data:
+                portfolio.name = data['name']
+            # You could add more update logic here
+
+        try:
+            update_portfolio(current_user, portfolio_id, rename)
             return jsonify({'message': 'Portfolio updated'})
-        return jsonify({'message': 'Error updating portfolio'}), 500
+        except VersionConflict as e:
+            return jsonify({'message': str(e)}), 409
+        except Exception:
+            return jsonify({'message': 'Error updating portfolio'}), 500
 
     elif request.method == 'DELETE':
         # Delete logic would need to be implemented in quarks3
@@ -161,20 +195,21 @@ def portfolio(current_user, portfolio_id):
 @app.route('/api/portfolios/<int:portfolio_id>/buy', methods=['POST'])
 @token_required
 def buy_stock(current_user, portfolio_id):
-    portfolio = load_portfolio(current_user, portfolio_id)
-    if not portfolio:
-        return jsonify({'message': 'Portfolio not found'}), 404
-
     data = request.get_json()
     try:
-        portfolio.buy_stock(
+        portfolio, filled = update_portfolio(current_user, portfolio_id, lambda portfolio: portfolio.buy_stock(
             data['symbol'],
             int(data['quantity']),
             price=float(data.get('price')) if data.get('price') else None,
             live=data.get('live', True)
-        )
-        save_portfolio(current_user, portfolio)
+        ))
+        if portfolio is None:
+            return jsonify({'message': 'Portfolio not found'}), 404
+        if not filled:
+            return jsonify({'message': portfolio.logs[-1] if portfolio.logs else 'Buy order failed'}), 400
         return jsonify({'message': 'Buy order executed'})
+    except VersionConflict as e:
+        return jsonify({'message': str(e)}), 409
     except Exception as e:
         return jsonify({'message': str(e)}), 400
 
@@ -182,24 +217,42 @@ def buy_stock(current_user, portfolio_id):
 @app.route('/api/portfolios/<int:portfolio_id>/sell', methods=['POST'])
 @token_required
 def sell_stock(current_user, portfolio_id):
-    portfolio = load_portfolio(current_user, portfolio_id)
-    if not portfolio:
-        return jsonify({'message': 'Portfolio not found'}), 404
-
     data = request.get_json()
     try:
-        portfolio.sell_stock(
+        portfolio, filled = update_portfolio(current_user, portfolio_id, lambda portfolio: portfolio.sell_stock(
             data['symbol'],
             int(data['quantity']),
             price=float(data.get('price')) if data.get('price') else None,
             live=data.get('live', True)
-        )
-        save_portfolio(current_user, portfolio)
+        ))
+        if portfolio is None:
+            return jsonify({'message': 'Portfolio not found'}), 404
+        if not filled:
+            return jsonify({'message': portfolio.logs[-1] if portfolio.logs else 'Sell order failed'}), 400
         return jsonify({'message': 'Sell order executed'})
+    except VersionConflict as e:
+        return jsonify({'message': str(e)}), 409
     except Exception as e:
         return jsonify({'message': str(e)}), 400
 
 
+@app.route('/api/portfolios/<int:portfolio_id>/orders', methods=['POST'])
+@token_required
+def batch_orders(current_user, portfolio_id):
+    data = request.get_json()
+    try:
+        outcome = execute_orders(current_user, portfolio_id, data['orders'], live=data.get('live', True))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'message': str(e)}), 400
+    except VersionConflict as e:
+        return jsonify({'message': str(e)}), 409
+    if outcome is None:
+        return jsonify({'message': 'Portfolio not found'}), 404
+    if not outcome['executed']:
+        return jsonify(dict(outcome, message='Batch not executed')), 400
+    return jsonify(dict(outcome, message='Batch executed'))
+
+
 # Portfolio Views
 @app.route('/api/portfolios/<int:portfolio_id>/view', methods=['GET'])
 @token_required
@@ -208,9 +261,9 @@ def view_portfolio(current_user, portfolio_id):
     if not portfolio:
         return jsonify({'message': 'Portfolio not found'}), 404
 
-    portfolio.view_portfolio()
-    # Since view_portfolio() prints to console, we'll return the portfolio data
+    valuation = portfolio.view_portfolio()
     details = get_portfolio_details(portfolio_id)
+    details['valuation'] = valuation
     return jsonify(details)
 
 
@@ -246,13 +299,19 @@ def watchlist(current_user, watchlist_id):
 
     elif request.method == 'PUT':
         data = request.get_json()
-        if 'name' in data:
-            watchlist.name = data['name']
-        # Add/remove symbols as needed
-        success = save_watchlist(current_user, watchlist)
-        if success:
+
+        def rename(watchlist):
+            if 'name' in data:
+                watchlist.name = data['name']
+            # Add/remove symbols as needed
+
+        try:
+            update_watchlist(current_user, watchlist_id, rename)
             return jsonify({'message': 'Watchlist updated'})
-        return jsonify({'message': 'Error updating watchlist'}), 500
+        except VersionConflict as e:
+            return jsonify({'message': str(e)}), 409
+        except Exception:
+            return jsonify({'message': 'Error updating watchlist'}), 500
 
     elif request.method == 'DELETE':
         # Delete logic would need to be implemented in quarks3
@@ -263,31 +322,78 @@ def watchlist(current_user, watchlist_id):
 @app.route('/api/watchlists/<int:watchlist_id>/add', methods=['POST'])
 @token_required
 def add_to_watchlist(current_user, watchlist_id):
-    watchlist = load_watchlist(current_user, watchlist_id)
-    if not watchlist:
-        return jsonify({'message': 'Watchlist not found'}), 404
-
     data = request.get_json()
-    watchlist.add_to_watchlist(data['symbol'], data.get('notes', ''))
-    success = save_watchlist(current_user, watchlist)
-    if success:
-        return jsonify({'message': 'Symbol added to watchlist'})
-    return jsonify({'message': 'Error updating watchlist'}), 500
+    try:
+        changed = add_watchlist_item(current_user, watchlist_id, data['symbol'], data.get('notes', ''))
+    except Exception:
+        return jsonify({'message': 'Error updating watchlist'}), 500
+    if changed is None:
+        return jsonify({'message': 'Watchlist not found'}), 404
+    return jsonify({'message': 'Symbol added to watchlist'})
 
 
 @app.route('/api/watchlists/<int:watchlist_id>/remove', methods=['POST'])
 @token_required
 def remove_from_watchlist(current_user, watchlist_id):
-    watchlist = load_watchlist(current_user, watchlist_id)
-    if not watchlist:
+    data = request.get_json()
+    try:
+        changed = remove_watchlist_item(current_user, watchlist_id, data['symbol'])
+    except Exception:
+        return jsonify({'message': 'Error updating watchlist'}), 500
+    if changed is None:
         return jsonify({'message': 'Watchlist not found'}), 404
+    return jsonify({'message': 'Symbol removed from watchlist'})
+
+
+# Price Alerts
+ALERT_HEARTBEAT_SECONDS = 15
+
+
+@app.route('/api/watchlists/<int:watchlist_id>/alerts', methods=['GET', 'POST'])
+@token_required
+def watchlist_alerts(current_user, watchlist_id):
+    if request.method == 'GET':
+        return jsonify({'alerts': PRICE_ALERTS.list_alerts(current_user, watchlist_id)})
 
     data = request.get_json()
-    watchlist.remove_from_watchlist(data['symbol'])
-    success = save_watchlist(current_user, watchlist)
-    if success:
-        return jsonify({'message': 'Symbol removed from watchlist'})
-    return jsonify({'message': 'Error updating watchlist'}), 500
+    try:
+        alert = PRICE_ALERTS.add_alert(current_user, watchlist_id, data['symbol'], data['kind'], data['value'])
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'message': str(e)}), 400
+    if alert is None:
+        return jsonify({'message': 'Symbol not in watchlist'}), 404
+    return jsonify({'message': 'Alert created', 'alert': alert}), 201
+
+
+@app.route('/api/alerts/<int:alert_id>', methods=['DELETE'])
+@token_required
+def delete_alert(current_user, alert_id):
+    if PRICE_ALERTS.remove_alert(current_user, alert_id):
+        return jsonify({'message': 'Alert deleted'})
+    return jsonify({'message': 'Alert not found'}), 404
+
+
+@app.route('/api/alerts/stream', methods=['GET'])
+@token_required
+def alert_stream(current_user):
+    """Server-sent events: one 'alert' event per triggered alert, comments as keep-alives"""
+    subscription = PRICE_ALERTS.subscribe(current_user)
+
+    def events():
+        try:
+            yield ': connected\n\n'
+            while True:
+                try:
+                    event = subscription.get(timeout=ALERT_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: alert\ndata: {json.dumps(event)}\n\n"
+        finally:
+            PRICE_ALERTS.unsubscribe(current_user, subscription)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 # Strategy Routes
@@ -365,11 +471,106 @@ def get_historical_price_route(symbol, date):
     return jsonify({'symbol': symbol, 'date': date, 'price': price})
 
 
+MAX_HISTORICAL_BATCH = 500
+
+
+@app.route('/api/market/historical/batch', methods=['POST'])
+def get_historical_prices_route():
+    data = request.get_json(silent=True) or {}
+    items = data.get('requests', []) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'message': 'requests must be a non-empty list of {symbol, date}'}), 400
+    if len(items) > MAX_HISTORICAL_BATCH:
+        return jsonify({'message': f'At most {MAX_HISTORICAL_BATCH} requests per batch'}), 400
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('symbol'), str) \
+                or not isinstance(item.get('date'), str):
+            return jsonify({'message': f'requests[{i}] must be an object with string symbol and date'}), 400
+
+    pairs = [(item.get('symbol'), item.get('date')) for item in items]
+    prices = get_historical_prices(pairs)
+    return jsonify({
+        'prices': [{'symbol': symbol, 'date': date_str, 'price': price}
+                   for (symbol, date_str), price in zip(pairs, prices)]
+    })
+
+
+def profile_requested(data=None):
+    """Honour ?profile=1 or {"profile": true}; otherwise fall back to env/sampling"""
+    flag = request.args.get('profile')
+    if flag is None and isinstance(data, dict):
+        flag = data.get('profile')
+    if flag is None:
+        return should_profile()
+    return should_profile(str(flag).lower() in ('1', 'true', 'yes'))
+
+
+@app.route('/api/market/indicators/<symbol>', methods=['GET'])
+def get_live_indicators(symbol):
+    try:
+        return json.dumps(live_indicators(symbol.upper()), cls=PortfolioEncoder), 200, \
+            {'Content-Type': 'application/json'}
+    except Exception as e:
+        return jsonify({'message': str(e)}), 400
+
+
+@app.route('/api/market/intraday/<symbol>', methods=['GET'])
+def get_intraday(symbol):
+    try:
+        limit = request.args.get('limit', type=int)
+        bars = INTRADAY_BARS.bars(symbol.upper(), request.args.get('interval', '5m'), limit)
+        return json.dumps(bars, cls=PortfolioEncoder), 200, {'Content-Type': 'application/json'}
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+
+@app.route('/api/market/sector-performance', methods=['GET'])
+def get_sector_performance():
+    try:
+        return jsonify(MARKET_SNAPSHOT.sector_performance())
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/forecast-trends', methods=['GET'])
+def get_forecast_trends():
+    try:
+        return jsonify(MARKET_SNAPSHOT.forecast_trends())
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+
+MAX_SCREEN_RESULTS = 500
+
+
+@app.route('/api/screener', methods=['POST'])
+def screener():
+    data = request.get_json() or {}
+    try:
+        symbols = data.get('symbols')
+        if symbols is not None and not isinstance(symbols, list):
+            raise ValueError("symbols must be a list")
+        return jsonify(run_screen(
+            data['filter'],
+            symbols=symbols,
+            rank_by=data.get('rank_by'),
+            ascending=bool(data.get('ascending', False)),
+            limit=max(1, min(int(data.get('limit', 50)), MAX_SCREEN_RESULTS)),
+            as_of=data.get('as_of')
+        ))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'message': str(e)}), 400
+
+
 # Advice Routes
 @app.route('/api/advice/<symbol>', methods=['GET'])
 def get_advice(symbol):
     try:
-        advice_data = generate_advice_sheet(symbol)
+        if profile_requested():
+            advice_data, report = profile_call(generate_advice_sheet, symbol)
+            advice_data['profile'] = report
+        else:
+            advice_data = generate_advice_sheet(symbol)
         if 'error' in advice_data:
             return jsonify(advice_data), 404
         return jsonify(advice_data)
@@ -386,40 +587,132 @@ def run_backtest():
     try:
         strategy_type = data['strategy_type']
         if strategy_type == 'MOMENTUM':
-            results = portfolio.run_backtest(
-                strategy=portfolio.momentum_strategy,
-                symbol=data['symbol'],
-                start_date=data['start_date'],
-                end_date=data['end_date']
-            )
+            strategy = portfolio.momentum_strategy
         elif strategy_type == 'BOLLINGER':
-            results = portfolio.run_backtest(
-                strategy=portfolio.bollinger_bands_strategy,
-                symbol=data['symbol'],
-                start_date=data['start_date'],
-                end_date=data['end_date']
-            )
+            strategy = portfolio.bollinger_bands_strategy
         elif strategy_type == 'MACROSS':
-            results = portfolio.run_backtest(
-                strategy=portfolio.moving_average_crossover,
-                symbol=data['symbol'],
-                start_date=data['start_date'],
-                end_date=data['end_date']
-            )
+            strategy = portfolio.moving_average_crossover
         elif strategy_type == 'QUARKS':
-            results = portfolio.run_backtest(
-                strategy=portfolio.adaptive_multi_strategy,  # Using the renamed adaptive_multi_strategy
-                symbol=data['symbol'],
-                start_date=data['start_date'],
-                end_date=data['end_date']
-            )
+            strategy = portfolio.adaptive_multi_strategy  # Using the renamed adaptive_multi_strategy
+        else:
+            return jsonify({'message': 'Invalid strategy type'}), 400
+
+        backtest_args = {
+            'strategy': strategy,
+            'symbol': data['symbol'],
+            'start_date': data['start_date'],
+            'end_date': data['end_date']
+        }
+        if profile_requested(data):
+            results, report = profile_call(portfolio.run_backtest, **backtest_args)
+            results['profile'] = report
         else:
+            results = portfolio.run_backtest(**backtest_args)
+
+        return jsonify(results)
+    except Exception as e:
+        return jsonify({'message': str(e)}), 400
+
+
+MAX_PORTFOLIO_SYMBOLS = 200
+PORTFOLIO_STRATEGIES = {
+    'EQUAL_WEIGHT': 'equal_weight_strategy',
+    'ROTATION': 'momentum_rotation_strategy'
+}
+
+
+@app.route('/api/backtest/portfolio', methods=['POST'])
+def run_portfolio_backtest():
+    data = request.get_json()
+    portfolio = Simulation(data.get('name', 'Portfolio Backtest'), data.get('initial_cash', 100000))
+
+    try:
+        strategy_name = PORTFOLIO_STRATEGIES.get(data['strategy_type'])
+        if strategy_name is None:
             return jsonify({'message': 'Invalid strategy type'}), 400
+        strategy = getattr(portfolio, strategy_name)
+
+        symbols = data['symbols']
+        if not symbols or len(symbols) > MAX_PORTFOLIO_SYMBOLS:
+            return jsonify({'message': f'Provide 1-{MAX_PORTFOLIO_SYMBOLS} symbols'}), 400
+
+        backtest_args = {
+            'strategy': strategy,
+            'symbols': symbols,
+            'start_date': data['start_date'],
+            'end_date': data['end_date']
+        }
+        if profile_requested(data):
+            results, report = profile_call(portfolio.run_portfolio_backtest, **backtest_args)
+            results['profile'] = report
+        else:
+            results = portfolio.run_portfolio_backtest(**backtest_args)
+
+        return json.dumps(results, cls=PortfolioEncoder), 200, {'Content-Type': 'application/json'}
+    except Exception as e:
+        return jsonify({'message': str(e)}), 400
 
+
+@app.route('/api/backtest/walk-forward', methods=['POST'])
+def run_walk_forward():
+    data = request.get_json()
+    try:
+        strategy_name = PORTFOLIO_STRATEGIES.get(data['strategy_type'])
+        if strategy_name is None:
+            return jsonify({'message': 'Invalid strategy type'}), 400
+        symbols = data.get('symbols') or [data['symbol']]
+        if len(symbols) > MAX_PORTFOLIO_SYMBOLS:
+            return jsonify({'message': f'Provide 1-{MAX_PORTFOLIO_SYMBOLS} symbols'}), 400
+
+        results = walk_forward_backtest(
+            strategy_name, symbols, data['start_date'], data['end_date'],
+            window_sessions=int(data.get('window', 252)),
+            step_sessions=int(data.get('step', 21)),
+            cash=data.get('initial_cash', 100000)
+        )
+        return json.dumps(results, cls=PortfolioEncoder), 200, {'Content-Type': 'application/json'}
+    except Exception as e:
+        return jsonify({'message': str(e)}), 400
+
+
+VECTOR_STRATEGIES = {
+    'BUY_HOLD': 'buy_and_hold',
+    'MOMENTUM': 'momentum',
+    'BOLLINGER': 'bollinger',
+    'MACROSS': 'ma_crossover'
+}
+
+
+@app.route('/api/backtest/monte-carlo', methods=['POST'])
+def run_monte_carlo():
+    data = request.get_json()
+    try:
+        strategy = VECTOR_STRATEGIES.get(data['strategy_type'])
+        if strategy is None:
+            return jsonify({'message': 'Invalid strategy type'}), 400
+
+        results = monte_carlo_backtest(
+            data['symbol'], strategy, data['start_date'], data['end_date'],
+            paths=int(data.get('paths', 1000)),
+            mode=data.get('mode', 'bootstrap'),
+            block_size=int(data.get('block_size', 20)),
+            slippage_bps=float(data.get('slippage_bps', 5.0)),
+            price_noise_bps=float(data.get('price_noise_bps', 25.0)),
+            seed=data.get('seed')
+        )
         return jsonify(results)
     except Exception as e:
         return jsonify({'message': str(e)}), 400
 
 
+# Metrics
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return METRICS.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
 if __name__ == '__main__':
+    # The debug reloader re-runs this file in a child; only the child serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_calendar_refresh()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,358 @@
+"""
+Offline benchmark suite for quarks3.
+
+Installs a market data provider that replays recorded NSE responses
+(bench_fixtures/, the RecordReplayProvider layout), so runs are reproducible
+and never touch the network. A run refuses to start without a recording of
+the backtest symbol unless --synthetic is given; synthetic runs replace every
+unrecorded symbol with a seeded random walk and are labelled as such in the
+report, and --compare refuses to mix recorded and synthetic reports.
+
+    python bench_quarks.py --record                 # capture TCS from live NSE (needs network)
+    python bench_quarks.py --record TCS INFY        # ... or any list of symbols
+    python bench_quarks.py                          # run, write bench_report.json
+    python bench_quarks.py --quick                  # fewer repeats / sizes
+    python bench_quarks.py --synthetic              # run without recordings (not comparable)
+    python bench_quarks.py --compare old.json       # print ratios against a previous report
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+import zlib
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = os.path.join(REPO_DIR, 'bench_fixtures')
+
+BACKTEST_SYMBOL = 'TCS'
+BACKTEST_START = '2023-01-01'
+BACKTEST_END = '2023-12-31'
+STRATEGIES = ['momentum_strategy', 'bollinger_bands_strategy',
+              'moving_average_crossover', 'adaptive_multi_strategy']
+HISTORY_SIZES = [0, 252, 1260, 2520]
+WATCHLIST_SIZES = [5, 25, 100]
+
+
+########## Fixture replay ###################
+
+class FixtureProvider:
+    """
+    Market data provider (quarks3.MarketDataProvider interface) over recorded
+    bars/quotes, with a seeded synthetic fallback for unrecorded symbols
+    """
+    name = 'fixtures'
+
+    def __init__(self, fixtures_dir):
+        self.fixtures_dir = fixtures_dir
+        self.frames = {}
+        self.sources = {}
+        quotes_path = os.path.join(fixtures_dir, 'quotes.json')
+        self.quotes = {}
+        if os.path.exists(quotes_path):
+            with open(quotes_path) as f:
+                self.quotes = json.load(f)
+
+    def _synthetic(self, symbol):
+        # Geometric random walk over every weekday since 2000, seeded by symbol
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        days = pd.bdate_range('2000-01-03', date.today() + timedelta(days=1))
+        close = (50 + rng.random() * 1500) * np.exp(np.cumsum(rng.normal(0.0003, 0.016, len(days))))
+        spread = np.abs(rng.normal(0, 0.01, len(days)))
+        prev = np.concatenate([[close[0]], close[:-1]])
+        return pd.DataFrame({
+            'DATE': days, 'SERIES': 'EQ',
+            'OPEN': prev * (1 + rng.normal(0, 0.004, len(days))),
+            'HIGH': close * (1 + spread), 'LOW': close * (1 - spread),
+            'PREV. CLOSE': prev, 'LTP': close, 'CLOSE': close, 'VWAP': close,
+            '52W H': close, '52W L': close,
+            'VOLUME': rng.integers(50_000, 5_000_000, len(days)),
+            'VALUE': close * 1e6, 'NO OF TRADES': rng.integers(1_000, 50_000, len(days)),
+            'SYMBOL': symbol
+        })
+
+    def frame(self, symbol):
+        if symbol not in self.frames:
+            path = os.path.join(self.fixtures_dir, 'bars', f'{symbol}.csv')
+            if os.path.exists(path):
+                df = pd.read_csv(path, parse_dates=['DATE'])
+                self.sources[symbol] = 'recorded'
+            else:
+                df = self._synthetic(symbol)
+                self.sources[symbol] = 'synthetic'
+            self.frames[symbol] = df.sort_values('DATE').reset_index(drop=True)
+        return self.frames[symbol]
+
+    def has_recording(self, symbol):
+        return os.path.exists(os.path.join(self.fixtures_dir, 'bars', f'{symbol}.csv'))
+
+    def history(self, symbol, from_date, to_date, series="EQ"):
+        df = self.frame(symbol)
+        mask = (df['DATE'] >= pd.Timestamp(from_date)) & (df['DATE'] <= pd.Timestamp(to_date))
+        # NSE returns newest first
+        return df[mask].iloc[::-1].reset_index(drop=True)
+
+    def quote(self, symbol):
+        if symbol in self.quotes:
+            return self.quotes[symbol]
+        df = self.frame(symbol)
+        last = df.iloc[-1]
+        return {'info': {'symbol': symbol},
+                'priceInfo': {'lastPrice': float(last['CLOSE']),
+                              'previousClose': float(last['PREV. CLOSE'])}}
+
+
+    def holidays(self):
+        path = os.path.join(self.fixtures_dir, 'holidays.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {}
+
+
+def record_fixtures(q, fixtures_dir, symbols, years=10):
+    """Capture real NSE bars and quotes to disk for later replay"""
+    recorder = q.RecordReplayProvider(fixtures_dir, upstream=q.NSEProvider(), mode='record')
+    to_date = date.today()
+    from_date = to_date - timedelta(days=365 * years)
+    for symbol in symbols:
+        df = recorder.history(symbol, from_date, to_date)
+        recorder.quote(symbol)
+        print(f"recorded {symbol}: {len(df)} bars")
+    recorder.holidays()
+
+
+########## Benchmarks ###################
+
+def timed_runs(func, repeat):
+    """Run func `repeat` times; the first run is reported separately as the cold run"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {
+        'cold': runs[0],
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.fmean(runs),
+        'max': max(runs),
+        'runs': len(runs)
+    }
+
+
+def bench_backtests(q, repeat):
+    results = {}
+    for name in STRATEGIES:
+        def run():
+            sim = q.Simulation(f'bench-{name}', 100000)
+            sim.run_backtest(getattr(sim, name), BACKTEST_SYMBOL, BACKTEST_START, BACKTEST_END)
+        results[f'backtest/{name}'] = timed_runs(run, repeat)
+    return results
+
+
+def bench_advice(q, repeat):
+    return {'advice/generate_advice_sheet': timed_runs(
+        lambda: q.generate_advice_sheet(BACKTEST_SYMBOL), repeat)}
+
+
+def build_portfolio(q, history_size):
+    sim = q.Simulation(f'bench-history-{history_size}', 1_000_000)
+    rng = np.random.default_rng(history_size)
+    for i in range(10):
+        sim.portfolio['holdings'][f'SYM{i:03d}'] = {'quantity': int(rng.integers(1, 500)),
+                                                    'avg_price': float(rng.uniform(50, 3000))}
+    for i in range(history_size):
+        sim.portfolio['transactions'].append({
+            'type': 'BUY' if i % 2 == 0 else 'SELL', 'symbol': f'SYM{i % 10:03d}',
+            'quantity': 10, 'price': float(rng.uniform(50, 3000)),
+            'timestamp': (datetime(2015, 1, 1) + timedelta(days=i)).strftime('%Y-%m-%d %H:%M:%S')
+        })
+    first_day = (date(2015, 1, 1) - date(1970, 1, 1)).days
+    sim.portfolio['price_history'] = {
+        'days': np.arange(first_day, first_day + history_size, dtype=np.int32),
+        'close': rng.uniform(50, 3000, history_size)
+    }
+    for i in range(min(history_size, q.SIMULATION_LOG_LIMIT)):
+        sim.logs.append(f"Bought 10 shares of SYM{i % 10:03d}")
+    return sim
+
+
+def bench_persistence(q, repeat, sizes):
+    results = {}
+    user_id = 1
+    for size in sizes:
+        sim = build_portfolio(q, size)
+        q.save_portfolio(user_id, sim)  # insert once so the timed runs measure updates
+        results[f'persistence/save_portfolio/{size}'] = timed_runs(
+            lambda: q.save_portfolio(user_id, sim), repeat)
+        results[f'persistence/load_portfolio/{size}'] = timed_runs(
+            lambda: q.load_portfolio(user_id, sim.db_id), repeat)
+    return results
+
+
+def bench_watchlists(q, api, repeat, sizes):
+    import jwt
+    client = api.app.test_client()
+    user_id = 1
+    token = jwt.encode({'user_id': user_id, 'exp': datetime.utcnow() + timedelta(hours=1)},
+                       api.app.config['SECRET_KEY'])
+    headers = {'x-access-token': token}
+    results = {}
+    for size in sizes:
+        symbols = [f'WL{size:03d}S{i:03d}' for i in range(size)]
+        name = f'bench-watchlist-{size}'
+
+        def create():
+            resp = client.post('/api/watchlists', json={'name': name, 'symbols': symbols}, headers=headers)
+            assert resp.status_code == 201, resp.get_json()
+        results[f'watchlist/create/{size}'] = timed_runs(create, repeat)
+
+        listing = client.get('/api/watchlists', headers=headers).get_json()
+        watchlist_id = max(w['id'] for w in listing['watchlists'] if w['name'] == name)
+
+        results[f'watchlist/list/{size}'] = timed_runs(
+            lambda: client.get('/api/watchlists', headers=headers), repeat)
+        results[f'watchlist/detail/{size}'] = timed_runs(
+            lambda: client.get(f'/api/watchlists/{watchlist_id}', headers=headers), repeat)
+
+        def add_remove():
+            client.post(f'/api/watchlists/{watchlist_id}/add', json={'symbol': 'BENCHADD'}, headers=headers)
+            client.post(f'/api/watchlists/{watchlist_id}/remove', json={'symbol': 'BENCHADD'}, headers=headers)
+        results[f'watchlist/add_remove/{size}'] = timed_runs(add_remove, repeat)
+    return results
+
+
+########## Reporting ###################
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(old_path, new_report):
+    with open(old_path) as f:
+        old_report = json.load(f)
+    old_data = old_report['meta'].get('data', 'unknown')
+    new_data = new_report['meta']['data']
+    if old_data != new_data:
+        print(f"error: cannot compare a {new_data} run with a {old_data} report ({old_path})", file=sys.stderr)
+        return 2
+    old = old_report['results']
+    print(f"{'case':55s} {'old':>10s} {'new':>10s} {'ratio':>7s}")
+    for case, stats in sorted(new_report['results'].items()):
+        if case not in old:
+            continue
+        before, after = old[case]['median'], stats['median']
+        ratio = after / before if before else float('nan')
+        print(f"{case:55s} {before * 1000:9.2f}ms {after * 1000:9.2f}ms {ratio:6.2f}x")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help='recorded fixture directory')
+    parser.add_argument('--output', default='bench_report.json', help='JSON report path')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case')
+    parser.add_argument('--quick', action='store_true', help='2 repeats, smallest sizes only')
+    parser.add_argument('--only', nargs='*', choices=['backtest', 'advice', 'persistence', 'watchlist'],
+                        help='run a subset of groups')
+    parser.add_argument('--compare', help='previous report to compare medians against')
+    parser.add_argument('--record', nargs='*', metavar='SYMBOL',
+                        help=f'record fixtures from live NSE and exit (default: {BACKTEST_SYMBOL})')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='run without recorded fixtures; the report is marked synthetic')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    fixtures_dir = os.path.abspath(args.fixtures)
+    provider = FixtureProvider(fixtures_dir)
+    if args.record is None and not args.synthetic and not provider.has_recording(BACKTEST_SYMBOL):
+        print(f"error: no recorded fixture for {BACKTEST_SYMBOL} in {fixtures_dir}; "
+              f"run --record (needs network) or pass --synthetic", file=sys.stderr)
+        return 2
+
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    os.environ.setdefault('QUARKS_LOG_LEVEL', 'WARNING')
+    warnings.filterwarnings('ignore', module='jwt')
+
+    # quarks3 creates trading_system.db and graph images relative to the cwd
+    workdir = tempfile.mkdtemp(prefix='quarks-bench-')
+    # Registered before quarks3 is imported so it runs after quarks3's own exit
+    # handlers (atexit is last-in, first-out) and background writers are done
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    os.chdir(workdir)
+    return run(args, provider, output)
+
+
+def run(args, provider, output):
+    repeat = 2 if args.quick else args.repeat
+    history_sizes = HISTORY_SIZES[:2] if args.quick else HISTORY_SIZES
+    watchlist_sizes = WATCHLIST_SIZES[:1] if args.quick else WATCHLIST_SIZES
+    groups = set(args.only or ['backtest', 'advice', 'persistence', 'watchlist'])
+
+    sys.path.insert(0, REPO_DIR)
+    import quarks3
+    import api1
+
+    if args.record is not None:
+        record_fixtures(quarks3, provider.fixtures_dir, args.record or [BACKTEST_SYMBOL])
+        return 0
+    quarks3.set_market_data_provider(provider)
+
+    results = {}
+    started = time.perf_counter()
+    if 'backtest' in groups:
+        results.update(bench_backtests(quarks3, repeat))
+    if 'advice' in groups:
+        results.update(bench_advice(quarks3, repeat))
+    if 'persistence' in groups:
+        results.update(bench_persistence(quarks3, repeat, history_sizes))
+    if 'watchlist' in groups:
+        results.update(bench_watchlists(quarks3, api1, repeat, watchlist_sizes))
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'repeat': repeat,
+            'total_seconds': time.perf_counter() - started,
+            # Only reports with the same data kind are comparable
+            'data': 'recorded' if provider.has_recording(BACKTEST_SYMBOL) else 'synthetic',
+            'fixtures': dict(sorted(provider.sources.items()))
+        },
+        'results': results
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for case, stats in sorted(results.items()):
+        print(f"{case:55s} median {stats['median'] * 1000:9.2f}ms  cold {stats['cold'] * 1000:9.2f}ms")
+    print(f"report written to {output}")
+    if report['meta']['data'] == 'synthetic':
+        print("warning: synthetic data; this report is not comparable with recorded runs", file=sys.stderr)
+    if args.compare:
+        return compare_reports(os.path.abspath(args.compare), report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
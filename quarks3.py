@@ -10,562 +10,2787 @@ import os
 import base64
 from typing import List, Dict
 from matplotlib import pyplot as plt
+import atexit
+import bisect
+import cProfile
+import functools
+import itertools
 import json
+import logging
+import math
+import multiprocessing
+import pstats
+import queue
+import random
+import re
+import requests
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+try:
+    import fcntl  # cross-process build lock for the columnar bar snapshot (POSIX only)
+except ImportError:
+    fcntl = None
 
 # Add this class just below your imports
 class PortfolioEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, (datetime, date)):
             return obj.isoformat()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
         return super().default(obj)
 
 
-# Initialize NSELive for live data
-nse = NSELive()
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per log record, for log shippers"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key in ('simulation', 'symbol'):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+# Module logger. Quiet (WARNING) by default so backtests don't pay for per-day
+# output; set QUARKS_LOG_LEVEL=INFO/DEBUG to see trades and strategy
+# diagnostics, and QUARKS_LOG_FORMAT=json for structured output.
+logger = logging.getLogger('quarks')
+logger.setLevel(os.environ.get('QUARKS_LOG_LEVEL', 'WARNING').upper())
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    if os.environ.get('QUARKS_LOG_FORMAT', '').lower() == 'json':
+        _log_handler.setFormatter(JsonLogFormatter())
+    else:
+        _log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+
+# Simulation.logs keeps only the most recent entries
+SIMULATION_LOG_LIMIT = 500
+
+
+# Latency histogram buckets (seconds) shared by every timer
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics: counters, gauges and latency histograms keyed
+    by (name, labels), rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = hist[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def timer(self, name, **labels):
+        """Context manager observing the elapsed wall time of its block"""
+        return _MetricsTimer(self, name, labels)
+
+    def timed(self, name, **labels):
+        """Decorator form of timer()"""
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def cache_lookup(self, cache, hit):
+        self.inc('quarks_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters), dict(self._gauges), \
+                {k: (list(v[0]), v[1], v[2]) for k, v in self._histograms.items()}
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in items)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+    def render_prometheus(self):
+        counters, gauges, histograms = self.snapshot()
+
+        # Derived cache hit ratios
+        caches = {}
+        for (name, labels), value in counters.items():
+            if name == 'quarks_cache_requests_total':
+                label_map = dict(labels)
+                hits, total = caches.get(label_map['cache'], (0, 0))
+                caches[label_map['cache']] = (hits + (value if label_map['result'] == 'hit' else 0),
+                                              total + value)
+        for cache, (hits, total) in caches.items():
+            gauges[self._key('quarks_cache_hit_ratio', {'cache': cache})] = hits / total if total else 0.0
+
+        lines = []
+        for kind, series in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({n for n, _ in series}):
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+                for (n, labels), value in sorted(series.items()):
+                    if n == name:
+                        lines.append(f'{name}{self._format_labels(labels)} {value}')
+
+        for name in sorted({n for n, _ in histograms}):
+            if name in self._help:
+                lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} histogram')
+            for (n, labels), (counts, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, c in zip(self.buckets, counts):
+                    cumulative += c
+                    lines.append(f'{name}_bucket{self._format_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_bucket{self._format_labels(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{self._format_labels(labels)} {total}')
+                lines.append(f'{name}_count{self._format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsTimer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        self.registry.observe(self.name, self.elapsed, **self.labels)
+        session = getattr(_profile_local, 'session', None)
+        if session is not None:
+            session.add_phase(self.name, self.labels, self.elapsed)
+        return False
+
+
+METRICS = MetricsRegistry()
+METRICS.describe('quarks_upstream_seconds', 'Latency of upstream NSE calls')
+METRICS.describe('quarks_upstream_errors_total', 'Failed upstream NSE calls')
+METRICS.describe('quarks_db_seconds', 'Latency of SQLite-backed storage functions')
+METRICS.describe('quarks_serialize_seconds', 'Time spent serializing simulations')
+METRICS.describe('quarks_strategy_seconds', 'Time per strategy evaluation (one symbol, one session)')
+METRICS.describe('quarks_plot_seconds', 'Time spent rendering backtest plots')
+METRICS.describe('quarks_model_fit_seconds', 'Time spent fitting forecast models')
+METRICS.describe('quarks_advice_seconds', 'Time to build an advice sheet')
+METRICS.describe('quarks_cache_requests_total', 'Cache lookups by cache and result')
+METRICS.describe('quarks_cache_hit_ratio', 'Cache hits / lookups since start')
+
+
+# Opt-in profiling for slow requests. QUARKS_PROFILE=1 profiles every wrapped
+# call, QUARKS_PROFILE_SAMPLE_RATE profiles a random fraction of them, and
+# QUARKS_PROFILE_MODE picks 'sampling' (low overhead, production-safe) or
+# 'deterministic' (cProfile, exact call counts but slower).
+PROFILE_TOP_N = 20
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+_profile_local = threading.local()
+
+
+def should_profile(requested=None):
+    """Decide whether to profile this call (explicit flag, env switch or sampling)"""
+    if requested is not None:
+        return bool(requested)
+    if os.environ.get('QUARKS_PROFILE', '').lower() in ('1', 'true', 'yes'):
+        return True
+    try:
+        rate = float(os.environ.get('QUARKS_PROFILE_SAMPLE_RATE', 0))
+    except ValueError:
+        rate = 0.0
+    return rate > 0 and random.random() < rate
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval"""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL, root_code=None):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.root_code = root_code  # stop walking here so callers' frames are excluded
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = {}
+        self.cumulative_counts = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            seen = set()
+            leaf = True
+            while frame is not None and frame.f_code is not self.root_code:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if leaf:
+                    self.self_counts[key] = self.self_counts.get(key, 0) + 1
+                    leaf = False
+                if key not in seen:
+                    self.cumulative_counts[key] = self.cumulative_counts.get(key, 0) + 1
+                    seen.add(key)
+                frame = frame.f_back
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def top(self, n):
+        ranked = sorted(self.cumulative_counts.items(), key=lambda kv: kv[1], reverse=True)[:n]
+        return [{
+            'function': f"{os.path.basename(f)}:{line}({name})",
+            'cumulative_seconds': count * self.interval,
+            'self_seconds': self.self_counts.get((f, line, name), 0) * self.interval,
+            'samples': count
+        } for (f, line, name), count in ranked]
+
+
+class ProfileSession:
+    """Collects per-phase timings (fed by METRICS timers) for the current thread"""
+
+    def __init__(self):
+        self.phases = {}
+
+    def add_phase(self, name, labels, elapsed):
+        phase = name.replace('quarks_', '').replace('_seconds', '')
+        if labels:
+            phase += ':' + ','.join(str(v) for v in labels.values())
+        entry = self.phases.setdefault(phase, {'seconds': 0.0, 'calls': 0})
+        entry['seconds'] += elapsed
+        entry['calls'] += 1
+
+
+def profile_call(func, *args, mode=None, top_n=PROFILE_TOP_N, **kwargs):
+    """
+    Run func under the profiler.
+
+    Returns:
+        tuple: (func's result, report dict with wall time, per-phase timings
+               and the top-N functions by cumulative time)
+    """
+    mode = mode or os.environ.get('QUARKS_PROFILE_MODE', 'sampling')
+    session = ProfileSession()
+    previous = getattr(_profile_local, 'session', None)
+    _profile_local.session = session
+
+    profiler = sampler = None
+    if mode == 'deterministic':
+        profiler = cProfile.Profile()
+    else:
+        sampler = _StackSampler(threading.get_ident(), root_code=profile_call.__code__)
+        sampler.start()
+
+    started = time.perf_counter()
+    try:
+        if profiler:
+            result = profiler.runcall(func, *args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+    finally:
+        wall = time.perf_counter() - started
+        _profile_local.session = previous
+        if sampler:
+            sampler.stop()
+
+    if profiler:
+        stats = pstats.Stats(profiler)
+        ranked = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:top_n]
+        top = [{
+            'function': f"{os.path.basename(f)}:{line}({name})",
+            'cumulative_seconds': ct,
+            'self_seconds': tt,
+            'calls': nc
+        } for (f, line, name), (cc, nc, tt, ct, callers) in ranked]
+    else:
+        top = sampler.top(top_n)
+
+    report = {
+        'mode': 'deterministic' if profiler else 'sampling',
+        'wall_seconds': wall,
+        'phases': dict(sorted(session.phases.items(), key=lambda kv: kv[1]['seconds'], reverse=True)),
+        'top_functions': top
+    }
+    logger.info(f"Profiled {getattr(func, '__name__', func)} in {wall:.3f}s")
+    return result, report
+
+
+########## Upstream rate limiting ###################
+# All NSE traffic passes through UPSTREAM: a token bucket caps the request
+# rate (and halves it whenever NSE throttles us, creeping back on success),
+# and a circuit breaker stops calling NSE after repeated failures. Shed calls
+# raise UpstreamUnavailable immediately, and callers fall back to stale data.
+UPSTREAM_RATE = float(os.environ.get('QUARKS_UPSTREAM_RATE', 5))      # requests/second
+UPSTREAM_BURST = float(os.environ.get('QUARKS_UPSTREAM_BURST', 10))
+UPSTREAM_MAX_WAIT = 0.5         # longest a caller queues for a token (seconds)
+UPSTREAM_MIN_RATE = 0.2
+# Per priority: (longest wait for a token in seconds, share of the burst left
+# untouched for higher priorities). Interactive calls fail fast; bulk fan-outs
+# (valuations, list pages) wait their turn; background pollers wait longest
+# and never dip into the last half of the bucket.
+UPSTREAM_PRIORITIES = {
+    'interactive': (UPSTREAM_MAX_WAIT, 0.0),
+    'bulk': (15.0, 0.2),
+    'background': (60.0, 0.5),
+}
+CIRCUIT_FAILURE_THRESHOLD = 5   # consecutive failures before the circuit opens
+CIRCUIT_BASE_COOLDOWN = 5.0     # first open period; doubles on every re-trip
+CIRCUIT_MAX_COOLDOWN = 120.0
+QUOTE_STALE_MAX_AGE = 3600      # oldest cached quote served while NSE is unavailable
+
+METRICS.describe('quarks_upstream_saturation', 'Fraction of the upstream token bucket in use (1 = throttling callers)')
+METRICS.describe('quarks_upstream_rate', 'Current adaptive upstream request rate (requests/second)')
+METRICS.describe('quarks_upstream_circuit_state', 'Upstream circuit breaker: 0 closed, 1 half-open, 2 open')
+METRICS.describe('quarks_upstream_rejected_total', 'Upstream calls shed without reaching NSE, by reason')
+METRICS.describe('quarks_stale_served_total', 'Stale cached values served while upstream was unavailable')
+
+
+class UpstreamUnavailable(Exception):
+    """Raised (without calling NSE) when the rate limiter or circuit breaker sheds a call"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket; `rate` may be adjusted while in use"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, max_wait, reserve=0.0):
+        """
+        Take one token, waiting at most max_wait seconds; returns success.
+        With reserve > 0 the token is only taken while more than `reserve`
+        tokens would remain, so lower-priority callers leave headroom.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                needed = min(self.burst, 1 + reserve)
+                if self.tokens >= needed:
+                    self.tokens -= 1
+                    return True
+                wait = (needed - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        with self._lock:
+            # Tokens accrued so far are credited at the old rate
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+
+    def saturation(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return 1.0 - self.tokens / self.burst
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures. After the
+    cooldown one probe call is let through (half-open); success closes the
+    circuit, failure re-opens it with a doubled, jittered cooldown.
+    """
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 base_cooldown=CIRCUIT_BASE_COOLDOWN, max_cooldown=CIRCUIT_MAX_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.cooldown = base_cooldown
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a half-open probe slot that was never used"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trips = 0
+            self.cooldown = self.base_cooldown
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.trips += 1
+                backoff = min(self.max_cooldown, self.base_cooldown * 2 ** (self.trips - 1))
+                self.cooldown = backoff * random.uniform(0.8, 1.2)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+                logger.warning(f"Upstream circuit opened for {self.cooldown:.1f}s after {self.failures} failures")
+
+
+def _is_throttle(error):
+    """True when an upstream error looks like NSE pushing back (429/403/503 or a timeout)"""
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status in (403, 429, 503) or isinstance(error, TimeoutError) or 'Timeout' in type(error).__name__
+
+
+def _is_upstream_fault(error):
+    """
+    True for errors that say NSE itself is unhealthy (transport failures,
+    timeouts, 403/429/5xx). Per-request errors such as an unknown symbol or an
+    unparseable payload are not faults and never count towards the circuit.
+    """
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is not None:
+        return status in (403, 429) or status >= 500
+    return _is_throttle(error) or isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError))
+
+
+_upstream_local = threading.local()
+
+
+class upstream_priority:
+    """Context manager setting the UPSTREAM_PRIORITIES class of this thread's upstream calls"""
+
+    def __init__(self, priority):
+        if priority not in UPSTREAM_PRIORITIES:
+            raise ValueError(f"Unknown upstream priority {priority}")
+        self.priority = priority
+
+    def __enter__(self):
+        self.previous = getattr(_upstream_local, 'priority', None)
+        _upstream_local.priority = self.priority
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _upstream_local.priority = self.previous
+        return False
+
+
+def current_upstream_priority():
+    return getattr(_upstream_local, 'priority', None) or 'interactive'
+
+
+class UpstreamGuard:
+    """Rate limiter + circuit breaker around every upstream market-data call"""
+
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, max_wait=UPSTREAM_MAX_WAIT,
+                 min_rate=UPSTREAM_MIN_RATE, breaker=None):
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = breaker or CircuitBreaker()
+
+    def call(self, name, func, *args, **kwargs):
+        if not self.breaker.allow():
+            METRICS.inc('quarks_upstream_rejected_total', call=name, reason='circuit_open',
+                        priority=current_upstream_priority())
+            raise UpstreamUnavailable(f"NSE circuit open, {name} not attempted")
+        priority = current_upstream_priority()
+        max_wait, reserve = UPSTREAM_PRIORITIES[priority]
+        if priority == 'interactive':
+            max_wait = self.max_wait
+        if not self.bucket.acquire(max_wait, reserve * self.bucket.burst):
+            self.breaker.release()
+            METRICS.inc('quarks_upstream_rejected_total', call=name, reason='rate_limited', priority=priority)
+            self._report()
+            raise UpstreamUnavailable(f"NSE rate limit reached, {name} not attempted")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not _is_upstream_fault(e):
+                # NSE answered; the request itself was bad. Free a half-open probe slot and move on
+                self.breaker.release()
+                raise
+            self.breaker.record_failure()
+            if _is_throttle(e):
+                # Multiplicative decrease: back off hard while NSE is throttling
+                self.bucket.set_rate(max(self.min_rate, self.bucket.rate / 2))
+            self._report()
+            raise
+        self.breaker.record_success()
+        # Additive increase back towards the configured rate
+        self.bucket.set_rate(min(self.max_rate, self.bucket.rate + self.max_rate / 20))
+        self._report()
+        return result
+
+    def _report(self):
+        METRICS.set_gauge('quarks_upstream_saturation', self.bucket.saturation())
+        METRICS.set_gauge('quarks_upstream_rate', self.bucket.rate)
+        METRICS.set_gauge('quarks_upstream_circuit_state', self.breaker.state)
+
+
+UPSTREAM = UpstreamGuard()
+
+
+########## Market data providers ###################
+# Every upstream read (live quotes, daily history, holidays) goes through
+# MARKET_DATA, so NSE can be swapped for the local bar store or recorded
+# fixtures. Select with QUARKS_MARKET_DATA=nse|barstore|barstore-offline|record|replay
+# (fixtures live under QUARKS_MARKET_FIXTURES, default 'market_fixtures').
+
+class MarketDataProvider:
+    """
+    Interface for market data sources.
+
+    quote() returns an NSE-shaped quote dict (at least priceInfo.lastPrice),
+    history() a stock_df-shaped DataFrame (DATE/OPEN/HIGH/LOW/CLOSE/VOLUME,
+    newest first) and holidays() NSE's holiday_list() payload.
+    """
+    name = 'base'
+    realtime = False  # True when quote() returns real-time exchange quotes
+
+    def quote(self, symbol):
+        raise NotImplementedError
+
+    def history(self, symbol, from_date, to_date, series="EQ"):
+        raise NotImplementedError
+
+    def holidays(self):
+        return {}
+
+
+class NSEProvider(MarketDataProvider):
+    """Live NSE through jugaad_data, behind the UPSTREAM rate limiter/circuit breaker"""
+    name = 'nse'
+    realtime = True
+
+    def __init__(self):
+        self._live = None
+
+    @property
+    def live(self):
+        if self._live is None:
+            self._live = NSELive()
+        return self._live
+
+    def quote(self, symbol):
+        return UPSTREAM.call('stock_quote', self.live.stock_quote, symbol)
+
+    def history(self, symbol, from_date, to_date, series="EQ"):
+        return UPSTREAM.call('stock_df', stock_df, symbol, from_date=from_date, to_date=to_date, series=series)
+
+    def holidays(self):
+        return UPSTREAM.call('holiday_list', self.live.holiday_list)
+
+
+class BarStoreProvider(MarketDataProvider):
+    """
+    Serves history from the local daily-bar store. With an upstream provider
+    missing ranges are fetched once and persisted; without one it is fully
+    offline and quotes are the last stored close.
+    """
+    name = 'barstore'
+
+    def __init__(self, upstream=None, store=None):
+        self.upstream = upstream
+        self._store = store
+
+    @property
+    def store(self):
+        return self._store or BAR_STORE
+
+    @property
+    def realtime(self):
+        return self.upstream is not None and self.upstream.realtime
+
+    def quote(self, symbol):
+        if self.upstream is not None:
+            return self.upstream.quote(symbol)
+        bars = self.store.bars(symbol)
+        if not len(bars.close):
+            raise KeyError(f"No stored bars for {symbol}")
+        previous = bars.close[-2] if len(bars.close) > 1 else bars.close[-1]
+        return {'info': {'symbol': symbol},
+                'priceInfo': {'lastPrice': float(bars.close[-1]), 'previousClose': float(previous)},
+                'metadata': {'lastUpdateTime': str(date.fromordinal(int(bars.days[-1]) + EPOCH_ORDINAL))}}
+
+    def history(self, symbol, from_date, to_date, series="EQ"):
+        self.store.ensure(symbol, from_date, to_date, source=self)
+        bars = self.store.bars(symbol)
+        lo = np.searchsorted(bars.days, TradingCalendar._to_day(from_date), side='left')
+        hi = np.searchsorted(bars.days, TradingCalendar._to_day(to_date), side='right')
+        sl = slice(lo, hi)
+        prev_close = np.concatenate([[np.nan], bars.close[:-1]])
+        df = pd.DataFrame({
+            'DATE': pd.to_datetime(bars.days[sl].astype('datetime64[D]')),
+            'SERIES': series,
+            'OPEN': bars.open[sl], 'HIGH': bars.high[sl], 'LOW': bars.low[sl],
+            'PREV. CLOSE': prev_close[sl], 'LTP': bars.close[sl], 'CLOSE': bars.close[sl],
+            'VOLUME': bars.volume[sl].astype(np.int64)
+        })
+        return df.iloc[::-1].reset_index(drop=True)
+
+    def holidays(self):
+        return self.upstream.holidays() if self.upstream is not None else {}
+
+
+class RecordReplayProvider(MarketDataProvider):
+    """
+    Record/replay fixtures under `directory`: bars/<SYMBOL>.csv, quotes.json
+    and holidays.json.
+
+    mode='record' passes every call through to upstream and writes the
+    response to disk; mode='replay' serves the recordings from memory and
+    never touches the network.
+    """
+
+    def __init__(self, directory, upstream=None, mode='replay'):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown mode {mode!r}")
+        if mode == 'record' and upstream is None:
+            raise ValueError("Recording needs an upstream provider")
+        self.directory = directory
+        self.upstream = upstream
+        self.mode = mode
+        self.name = mode
+        self._frames = {}  # symbol -> (DataFrame sorted by DATE, datetime64[D] index)
+        self._quotes = None
+        self._lock = threading.Lock()
+
+    @property
+    def realtime(self):
+        return self.mode == 'record' and self.upstream.realtime
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _quote_map(self):
+        if self._quotes is None:
+            path = self._path('quotes.json')
+            self._quotes = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    self._quotes = json.load(f)
+        return self._quotes
+
+    def _frame(self, symbol):
+        if symbol not in self._frames:
+            path = self._path('bars', f'{symbol}.csv')
+            if not os.path.exists(path):
+                return None
+            df = pd.read_csv(path, parse_dates=['DATE']).sort_values('DATE').reset_index(drop=True)
+            self._frames[symbol] = (df, df['DATE'].values.astype('datetime64[D]'))
+        return self._frames[symbol]
+
+    def quote(self, symbol):
+        if self.mode == 'record':
+            quote = self.upstream.quote(symbol)
+            with self._lock:
+                quotes = self._quote_map()
+                quotes[symbol] = quote
+                os.makedirs(self.directory, exist_ok=True)
+                with open(self._path('quotes.json'), 'w') as f:
+                    json.dump(quotes, f, indent=2, sort_keys=True, cls=PortfolioEncoder)
+            return quote
+        quote = self._quote_map().get(symbol)
+        if quote is None:
+            raise KeyError(f"No recorded quote for {symbol}")
+        return quote
+
+    def history(self, symbol, from_date, to_date, series="EQ"):
+        if self.mode == 'record':
+            df = self.upstream.history(symbol, from_date, to_date, series=series)
+            with self._lock:
+                existing = self._frame(symbol)
+                merged = pd.concat([existing[0], df]) if existing else df.copy()
+                merged['DATE'] = pd.to_datetime(merged['DATE'])
+                merged = merged.drop_duplicates('DATE', keep='last').sort_values('DATE').reset_index(drop=True)
+                os.makedirs(self._path('bars'), exist_ok=True)
+                merged.to_csv(self._path('bars', f'{symbol}.csv'), index=False)
+                self._frames[symbol] = (merged, merged['DATE'].values.astype('datetime64[D]'))
+            return df
+
+        frame = self._frame(symbol)
+        if frame is None:
+            raise KeyError(f"No recorded bars for {symbol}")
+        df, index = frame
+        lo = np.searchsorted(index, np.datetime64(pd.Timestamp(from_date).date()), side='left')
+        hi = np.searchsorted(index, np.datetime64(pd.Timestamp(to_date).date()), side='right')
+        # NSE returns newest first
+        return df.iloc[lo:hi].iloc[::-1].reset_index(drop=True)
+
+    def holidays(self):
+        path = self._path('holidays.json')
+        if self.mode == 'record':
+            holidays = self.upstream.holidays()
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(holidays, f, indent=2, sort_keys=True)
+            return holidays
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {}
+
+
+def market_data_provider_from_env():
+    """Build the provider selected by QUARKS_MARKET_DATA"""
+    kind = os.environ.get('QUARKS_MARKET_DATA', 'nse').lower()
+    fixtures = os.environ.get('QUARKS_MARKET_FIXTURES', 'market_fixtures')
+    if kind == 'barstore':
+        return BarStoreProvider(upstream=NSEProvider())
+    if kind == 'barstore-offline':
+        return BarStoreProvider()
+    if kind in ('record', 'replay'):
+        return RecordReplayProvider(fixtures, upstream=NSEProvider(), mode=kind)
+    if kind != 'nse':
+        logger.warning(f"Unknown QUARKS_MARKET_DATA={kind!r}, using live NSE")
+    return NSEProvider()
+
+
+MARKET_DATA = market_data_provider_from_env()
+
+
+def set_market_data_provider(provider):
+    """Swap the global market data provider; returns the previous one"""
+    global MARKET_DATA
+    previous, MARKET_DATA = MARKET_DATA, provider
+    with _quote_cache_lock:
+        _quote_cache.clear()
+    return previous
+
+
+# Shared live-quote cache: symbol -> (fetched_at, price). Every live quote we
+# fetch lands here so bulk callers (valuations, list pages) can reuse it.
+QUOTE_CACHE_TTL = 15  # seconds
+QUOTE_FETCH_WORKERS = 8
+_quote_cache = {}
+_quote_cache_lock = threading.Lock()
+_quote_listeners = []
+
+
+def add_quote_listener(listener):
+    """Register listener(symbol, price, quote) to be called for every live quote fetched"""
+    _quote_listeners.append(listener)
+
+
+def _publish_quote(symbol, price, quote):
+    for listener in list(_quote_listeners):
+        try:
+            listener(symbol, price, quote)
+        except Exception as e:
+            logger.warning(f"Quote listener {getattr(listener, '__name__', listener)} failed for {symbol}: {e}")
+
+
+def _fetch_live_quote(symbol):
+    """Fetch a live quote from the market data provider and record it in the shared quote cache"""
+    try:
+        with METRICS.timer('quarks_upstream_seconds', call='stock_quote'):
+            quote = MARKET_DATA.quote(symbol)
+        price = quote['priceInfo']['lastPrice']
+    except UpstreamUnavailable as e:
+        # NSE is being shed: serve the last known price rather than nothing
+        with _quote_cache_lock:
+            entry = _quote_cache.get(symbol)
+        if entry and time.time() - entry[0] <= QUOTE_STALE_MAX_AGE:
+            METRICS.inc('quarks_stale_served_total', kind='quote')
+            return entry[1]
+        logger.warning(f"Error fetching live data for {symbol}: {e}")
+        return None
+    except Exception as e:
+        METRICS.inc('quarks_upstream_errors_total', call='stock_quote')
+        logger.warning(f"Error fetching live data for {symbol}: {e}")
+        return None
+    with _quote_cache_lock:
+        _quote_cache[symbol] = (time.time(), price)
+    _publish_quote(symbol, price, quote)
+    return price
+
+
+def _stock_df(symbol, from_date, to_date, series="EQ", provider=None, stale_ok=True):
+    """
+    Daily history from the market data provider, with latency/error accounting.
+    While upstream is unavailable, whatever the local bar store already holds
+    for the range is served instead (unless stale_ok is False).
+    """
+    try:
+        with METRICS.timer('quarks_upstream_seconds', call='stock_df'):
+            return (provider or MARKET_DATA).history(symbol, from_date, to_date, series=series)
+    except UpstreamUnavailable:
+        if stale_ok:
+            df = BarStoreProvider().history(symbol, from_date, to_date, series=series)
+            if not df.empty:
+                METRICS.inc('quarks_stale_served_total', kind='history')
+                return df
+        raise
+    except Exception:
+        METRICS.inc('quarks_upstream_errors_total', call='stock_df')
+        raise
+
+
+def get_cached_price(symbol, max_age=QUOTE_CACHE_TTL):
+    """Return the cached live price for symbol if it is fresh enough, else None"""
+    with _quote_cache_lock:
+        entry = _quote_cache.get(symbol)
+    if entry and (max_age is None or time.time() - entry[0] <= max_age):
+        return entry[1]
+    return None
 
 
 def get_stock_price(symbol, live=True):
     """Fetch live or historical stock price"""
     if live:
-        try:
-            quote = nse.stock_quote(symbol)
-            print(symbol)
-            return quote['priceInfo']['lastPrice']
-        except Exception as e:
-            print(f"Error fetching live data for {symbol}: {e}")
-            return None
+        return _fetch_live_quote(symbol)
     else:
         try:
             today = date.today()
-            df = stock_df(symbol, from_date=today, to_date=today, series="EQ")
+            df = _stock_df(symbol, today, today)
             return df.iloc[-1]['CLOSE'] if not df.empty else None
         except Exception as e:
-            print(f"Error fetching historical data for {symbol}: {e}")
+            logger.warning(f"Error fetching historical data for {symbol}: {e}")
             return None
 
 
-def get_historical_price(symbol, date_str):
-    """Fetch historical closing price for a specific date (YYYY-MM-DD format)"""
-    try:
-        # Convert input date to date object
-        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+def get_stock_prices(symbols, live=True, max_age=QUOTE_CACHE_TTL):
+    """
+    Bulk quote path: fetch prices for many symbols in one pass.
 
-        # Fetch data for a range of dates (7 days before and after the target date)
-        from_date = target_date - timedelta(days=7)
-        to_date = target_date + timedelta(days=7)
+    Symbols are de-duplicated, fresh entries are served from the shared quote
+    cache and the rest are fetched concurrently. The fetches queue for the
+    upstream limiter at 'bulk' priority (or the caller's, if lower) instead
+    of being shed after the interactive wait.
 
-        # Fetch historical data
-        df = stock_df(symbol, from_date=from_date, to_date=to_date, series="EQ")
+    Returns:
+        dict: symbol -> price (None where the quote could not be fetched)
+    """
+    unique = list(dict.fromkeys(symbols))
+    prices = {}
+    missing = []
+    for symbol in unique:
+        cached = get_cached_price(symbol, max_age) if live else None
+        if live:
+            METRICS.cache_lookup('quotes', cached is not None)
+        if cached is not None:
+            prices[symbol] = cached
+        else:
+            missing.append(symbol)
 
-        if df.empty:
-            print(f"No data found for {symbol} between {from_date} and {to_date}.")
-            return None
+    if missing:
+        priority = current_upstream_priority()
+        if priority == 'interactive' and len(missing) > 1:
+            priority = 'bulk'
 
-        # Filter for the exact target date
-        target_data = df[df['DATE'] == target_date.strftime("%Y-%m-%d")]
+        def fetch(symbol):
+            with upstream_priority(priority):
+                return get_stock_price(symbol, live=live)
 
-        if target_data.empty:
-            print(f"No data found for {symbol} on {target_date}.")
-            return None
-        print(target_data.iloc[-1]['CLOSE'])
+        workers = max(1, min(QUOTE_FETCH_WORKERS, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            prices.update(zip(missing, pool.map(fetch, missing)))
+    return prices
 
-        return target_data.iloc[-1]['CLOSE']
 
-    except Exception as e:
-        print(f"Error fetching historical price for {symbol} on {date_str}: {e}")
-        return None
+def _json_number(value):
+    """Convert a NumPy scalar to a JSON-safe float (NaN and +/-inf become None)"""
+    value = float(value)
+    return value if np.isfinite(value) else None
 
 
-class Simulation:
-    def __init__(self, name, cash):
-        self.name = name
-        self.timestamp = datetime.now()
-        self.logs = []
-        self.images = []  # Store image paths
-        self.portfolio = {
-            'cash': cash,
-            'holdings': {},
-            'transactions': [],
-            'performance_images': []  # Store backtest result images
-        }
+def value_portfolios(snapshots, prices):
+    """
+    Vectorized mark-to-market for one or many portfolios.
 
-    def buy_stock(self, symbol, quantity, price=None, live=True):
-        """Buy a stock and add it to the portfolio"""
-        if price is None:
-            price = get_stock_price(symbol, live=live)
-            print(price)
-            if price is None:
-                print(f"Failed to fetch price for {symbol}. Transaction aborted.")
-                self.logs.append(f"Failed to fetch price for {symbol}. Transaction aborted.")
-                return
+    Parameters:
+        snapshots (list): [{'cash': float, 'holdings': {symbol: {'quantity', 'avg_price'}}}, ...]
+        prices (dict): symbol -> current price, e.g. from get_stock_prices()
 
-        cost = price * quantity
-        if self.portfolio['cash'] >= cost:
-            self.portfolio['cash'] -= cost
-            if symbol in self.portfolio['holdings']:
-                # Update average price and quantity
-                total_qty = self.portfolio['holdings'][symbol]['quantity'] + quantity
-                total_invested = self.portfolio['holdings'][symbol]['avg_price'] * self.portfolio['holdings'][symbol][
-                    'quantity'] + cost
-                self.portfolio['holdings'][symbol]['quantity'] = total_qty
-                self.portfolio['holdings'][symbol]['avg_price'] = total_invested / total_qty
-            else:
-                self.portfolio['holdings'][symbol] = {'quantity': quantity, 'avg_price': price}
+    Returns:
+        list: one valuation dict per snapshot, in input order, with per-holding
+              invested / current value / P/L / weight rows and portfolio totals
+    """
+    # Flatten every holding of every portfolio into parallel arrays so the
+    # whole batch is valued with a handful of NumPy operations.
+    owner, symbols, qty, avg = [], [], [], []
+    for i, snap in enumerate(snapshots):
+        for symbol, h in snap.get('holdings', {}).items():
+            owner.append(i)
+            symbols.append(symbol)
+            qty.append(h['quantity'])
+            avg.append(h['avg_price'])
+
+    n = len(snapshots)
+    raw_qty = qty
+    owner = np.asarray(owner, dtype=np.int64)
+    qty = np.asarray(qty, dtype=np.float64)
+    avg = np.asarray(avg, dtype=np.float64)
+    price = np.array([np.nan if prices.get(s) is None else prices[s] for s in symbols],
+                     dtype=np.float64)
+    priced = ~np.isnan(price)
+
+    invested = qty * avg
+    current = qty * price
+    pl = current - invested
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pl_pct = np.where(invested != 0, pl / invested * 100, np.nan)
+
+    cash = np.array([float(s.get('cash', 0)) for s in snapshots], dtype=np.float64)
+    total_invested = np.bincount(owner, weights=invested, minlength=n)
+    total_current = np.bincount(owner, weights=np.where(priced, current, 0.0), minlength=n)
+    # P/L only over holdings we could price, so a missing quote is not a 100% loss
+    total_cost_priced = np.bincount(owner, weights=np.where(priced, invested, 0.0), minlength=n)
+    total_pl = total_current - total_cost_priced
+    equity = cash + total_current
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_pl_pct = np.where(total_cost_priced != 0, total_pl / total_cost_priced * 100, np.nan)
+        weight = current / equity[owner]
+        cash_weight = np.where(equity != 0, cash / equity, np.nan)
+
+    valued_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    results = [{
+        'holdings': [],
+        'totals': {
+            'invested': _json_number(total_invested[i]),
+            'current_value': _json_number(total_current[i]),
+            'pl': _json_number(total_pl[i]),
+            'pl_pct': _json_number(total_pl_pct[i]),
+            'cash': _json_number(cash[i]),
+            'equity': _json_number(equity[i]),
+            'cash_weight': _json_number(cash_weight[i])
+        },
+        'unpriced': [],
+        'valued_at': valued_at
+    } for i in range(n)]
+
+    for k, symbol in enumerate(symbols):
+        result = results[owner[k]]
+        result['holdings'].append({
+            'symbol': symbol,
+            'quantity': raw_qty[k],
+            'avg_price': _json_number(avg[k]),
+            'current_price': _json_number(price[k]),
+            'invested': _json_number(invested[k]),
+            'current_value': _json_number(current[k]),
+            'pl': _json_number(pl[k]),
+            'pl_pct': _json_number(pl_pct[k]),
+            'weight': _json_number(weight[k])
+        })
+        if not priced[k]:
+            result['unpriced'].append(symbol)
+    return results
 
-            # Record transaction
-            self.portfolio['transactions'].append({
-                'type': 'BUY',
-                'symbol': symbol,
-                'quantity': quantity,
-                'price': price,
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            })
-            print(f"Bought {quantity} shares of {symbol} at {price:.2f}")
-            self.logs.append(f"Bought {quantity} shares of {symbol} at {price:.2f}")
-        else:
-            print(f"Insufficient cash to buy {quantity} shares of {symbol}.")
-            self.logs.append(f"Insufficient cash to buy {quantity} shares of {symbol}.")
 
-    def sell_stock(self, symbol, quantity, price=None, live=True):
-        """Sell a stock and update the portfolio"""
-        if symbol not in self.portfolio['holdings']:
-            print(f"{symbol} not in portfolio.")
-            self.logs.append(f"{symbol} not in portfolio.")
-            return
+def value_holdings(holdings, prices, cash=0.0):
+    """Mark a single holdings snapshot to market (see value_portfolios)"""
+    return value_portfolios([{'cash': cash, 'holdings': holdings}], prices)[0]
 
-        if self.portfolio['holdings'][symbol]['quantity'] < quantity:
-            print(f"Not enough {symbol} shares to sell.")
-            self.logs.append(f"Not enough {symbol} shares to sell.")
-            return
 
+def get_historical_price(symbol, date_str, snap=True):
+    """
+    Fetch historical closing price for a specific date (YYYY-MM-DD format).
+
+    Served from the local bar store; NSE is only contacted the first time a
+    date range is requested for the symbol. With snap=True a weekend or
+    exchange holiday resolves to the closing price of the nearest prior
+    session (looked up locally in TRADING_CALENDAR).
+    """
+    try:
+        # Convert input date to date object
+        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        if snap:
+            target_date = TRADING_CALENDAR.previous_session(target_date) or target_date
+
+        price = BAR_STORE.close_on(symbol, target_date)
         if price is None:
-            price = get_stock_price(symbol, live)
-            if price is None:
-                print(f"Failed to fetch price for {symbol}. Transaction aborted.")
-                self.logs.append(f"Failed to fetch price for {symbol}. Transaction aborted.")
-                return
+            logger.debug(f"No data found for {symbol} on {target_date}.")
+        return price
 
-        # Calculate profit/loss
-        pl = (price - self.portfolio['holdings'][symbol]['avg_price']) * quantity
-        self.portfolio['cash'] += price * quantity
-        self.portfolio['holdings'][symbol]['quantity'] -= quantity
+    except Exception as e:
+        logger.warning(f"Error fetching historical price for {symbol} on {date_str}: {e}")
+        return None
 
-        # Record transaction
-        self.portfolio['transactions'].append({
-            'type': 'SELL',
-            'symbol': symbol,
-            'quantity': quantity,
-            'price': price,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'pl': pl
-        })
-        print(f"Sold {quantity} shares of {symbol} at {price:.2f}")
-        self.logs.append(f"Sold {quantity} shares of {symbol} at {price:.2f}")
-        print(f"Profit/Loss: {pl:.2f}")
-        self.logs.append(f"Profit/Loss: {pl:.2f}")
 
-        # Remove stock if fully sold
-        if self.portfolio['holdings'][symbol]['quantity'] == 0:
-            del self.portfolio['holdings'][symbol]
+def get_historical_prices(requests, snap=True):
+    """
+    Batch historical close lookup for many (symbol, YYYY-MM-DD) pairs.
 
-    def add_historical_transaction(self, symbol, quantity, transaction_type, timestamp):
-        """Add historical transaction with automatic price detection"""
+    Pairs are grouped per symbol so each symbol costs one coverage check and
+    one vectorized lookup. Returns prices in input order (None where missing).
+    """
+    prices = [None] * len(requests)
+    by_symbol = {}
+    for i, (symbol, date_str) in enumerate(requests):
         try:
-            # Extract date from timestamp
-            transaction_date = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
-            price = get_historical_price(symbol, transaction_date)
+            target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            continue
+        if snap:
+            target_date = TRADING_CALENDAR.previous_session(target_date) or target_date
+        by_symbol.setdefault(symbol, []).append((i, target_date))
+
+    for symbol, items in by_symbol.items():
+        try:
+            closes = BAR_STORE.closes_on(symbol, [d for _, d in items])
+        except Exception as e:
+            logger.warning(f"Error fetching historical prices for {symbol}: {e}")
+            continue
+        for (i, _), price in zip(items, closes):
+            prices[i] = None if np.isnan(price) else float(price)
+    return prices
+
+
+# Days are stored as int offsets from the Unix epoch (date(1970, 1, 1)).
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+TRADING_DAYS_PER_YEAR = 252
+
+# NSE capital-market trading holidays that fall on weekdays. Used to build the
+# local trading calendar so backtests never probe NSE for closed sessions;
+# refresh_trading_calendar() merges in the live holiday master.
+NSE_HOLIDAYS = [
+    # 2023
+    '2023-01-26', '2023-03-07', '2023-03-30', '2023-04-04', '2023-04-07', '2023-04-14',
+    '2023-05-01', '2023-06-29', '2023-08-15', '2023-09-19', '2023-10-02', '2023-10-24',
+    '2023-11-14', '2023-11-27', '2023-12-25',
+    # 2024
+    '2024-01-22', '2024-01-26', '2024-03-08', '2024-03-25', '2024-03-29', '2024-04-11',
+    '2024-04-17', '2024-05-01', '2024-05-20', '2024-06-17', '2024-07-17', '2024-08-15',
+    '2024-10-02', '2024-11-01', '2024-11-15', '2024-11-20', '2024-12-25',
+    # 2025
+    '2025-02-26', '2025-03-14', '2025-03-31', '2025-04-10', '2025-04-14', '2025-04-18',
+    '2025-05-01', '2025-08-15', '2025-08-27', '2025-10-02', '2025-10-21', '2025-10-22',
+    '2025-11-05', '2025-12-25',
+    # 2026
+    '2026-01-15', '2026-01-26', '2026-03-03', '2026-03-26', '2026-03-31', '2026-04-03',
+    '2026-04-14', '2026-05-01', '2026-05-28', '2026-06-26', '2026-09-14', '2026-10-02',
+    '2026-10-20', '2026-11-10', '2026-11-24', '2026-12-25',
+]
+
+
+class TradingCalendar:
+    """
+    Local NSE trading-session index.
 
-            if price is None:
-                print(f"Transaction failed: Could not find price for {symbol} on {transaction_date}")
-                self.logs.append(f"Transaction failed: Could not find price for {symbol} on {transaction_date}")
-                return
+    Sessions are weekdays minus known holidays, plus any extra sessions seen in
+    bar data (e.g. special Saturday sessions). The calendar is held as dense
+    per-day arrays over a fixed span so membership and "previous session"
+    lookups are O(1) and never touch the network.
+    """
 
-            if transaction_type.upper() == 'BUY':
-                # Historical buy transaction
-                if self.portfolio['cash'] >= price * quantity:
-                    if symbol in self.portfolio['holdings']:
-                        # Update average price
-                        total_qty = self.portfolio['holdings'][symbol]['quantity'] + quantity
-                        total_invested = (self.portfolio['holdings'][symbol]['avg_price'] *
-                                          self.portfolio['holdings'][symbol]['quantity'] +
-                                          price * quantity)
-                        self.portfolio['holdings'][symbol]['quantity'] = total_qty
-                        self.portfolio['holdings'][symbol]['avg_price'] = total_invested / total_qty
-                    else:
-                        self.portfolio['holdings'][symbol] = {
-                            'quantity': quantity,
-                            'avg_price': price
-                        }
+    def __init__(self, holidays=(), first=date(2000, 1, 1), last=date(2035, 12, 31)):
+        self.first_day = first.toordinal() - EPOCH_ORDINAL
+        self.last_day = last.toordinal() - EPOCH_ORDINAL
+        self._holidays = set()
+        self._extra_sessions = set()
+        self._lock = threading.Lock()
+        self.add_holidays(holidays)
+
+    @staticmethod
+    def _to_day(d):
+        if isinstance(d, str):
+            d = datetime.strptime(d, "%Y-%m-%d").date()
+        elif isinstance(d, datetime):
+            d = d.date()
+        return d.toordinal() - EPOCH_ORDINAL
+
+    def _rebuild(self):
+        days = np.arange(self.first_day, self.last_day + 1, dtype=np.int32)
+        # 1970-01-01 was a Thursday, so (day + 3) % 7 gives Monday=0 .. Sunday=6
+        is_open = (days + 3) % 7 < 5
+        offset = self.first_day
+        for d in self._holidays:
+            if self.first_day <= d <= self.last_day:
+                is_open[d - offset] = False
+        for d in self._extra_sessions:
+            if self.first_day <= d <= self.last_day:
+                is_open[d - offset] = True
+        # prev_session[i] = last open day <= day i (or -1 if none yet)
+        prev = np.where(is_open, days, -1)
+        self._is_open = is_open
+        self._prev_session = np.maximum.accumulate(prev)
+
+    def add_holidays(self, days):
+        with self._lock:
+            self._holidays.update(self._to_day(d) for d in days)
+            self._extra_sessions.difference_update(self._holidays)
+            self._rebuild()
+
+    def add_sessions(self, days):
+        """Mark days as sessions, e.g. dates observed in stored bar data"""
+        with self._lock:
+            days = {self._to_day(d) for d in days}
+            self._extra_sessions.update(days)
+            self._holidays.difference_update(days)
+            self._rebuild()
+
+    def _in_range(self, day):
+        return self.first_day <= day <= self.last_day
+
+    def is_session(self, d):
+        day = self._to_day(d)
+        if not self._in_range(day):
+            return (day + 3) % 7 < 5
+        return bool(self._is_open[day - self.first_day])
+
+    def previous_session(self, d, inclusive=True):
+        """Return the last session on or before d (strictly before when inclusive=False)"""
+        day = self._to_day(d) - (0 if inclusive else 1)
+        if not self._in_range(day):
+            while (day + 3) % 7 >= 5:
+                day -= 1
+            return date.fromordinal(day + EPOCH_ORDINAL)
+        prev = int(self._prev_session[day - self.first_day])
+        return date.fromordinal(prev + EPOCH_ORDINAL) if prev >= 0 else None
+
+    def session_days(self, start, end):
+        """Sessions between start and end (inclusive) as an int32 epoch-day array"""
+        lo, hi = self._to_day(start), self._to_day(end)
+        lo_c, hi_c = max(lo, self.first_day), min(hi, self.last_day)
+        if lo_c > hi_c:
+            days = np.arange(lo, hi + 1, dtype=np.int32)
+            return days[(days + 3) % 7 < 5]
+        window = self._is_open[lo_c - self.first_day:hi_c - self.first_day + 1]
+        days = np.flatnonzero(window).astype(np.int32) + lo_c
+        # Outside the indexed span fall back to plain weekdays
+        if lo < lo_c or hi > hi_c:
+            before = np.arange(lo, lo_c, dtype=np.int32)
+            after = np.arange(hi_c + 1, hi + 1, dtype=np.int32)
+            days = np.concatenate((before[(before + 3) % 7 < 5], days, after[(after + 3) % 7 < 5]))
+        return days
+
+    def sessions(self, start, end):
+        """Sessions between start and end (inclusive) as date objects"""
+        return [date.fromordinal(int(d) + EPOCH_ORDINAL) for d in self.session_days(start, end)]
+
+
+TRADING_CALENDAR = TradingCalendar(NSE_HOLIDAYS)
+
+IST_OFFSET_SECONDS = 5 * 3600 + 1800           # India has no DST
+NSE_OPEN_SECONDS = 9 * 3600 + 15 * 60          # 09:15 IST
+NSE_CLOSE_SECONDS = 15 * 3600 + 30 * 60        # 15:30 IST
+
+
+def is_market_open(ts=None):
+    """True when epoch second ts (default now) falls inside an NSE session"""
+    ist = int(time.time() if ts is None else ts) + IST_OFFSET_SECONDS
+    if not NSE_OPEN_SECONDS <= ist % 86400 <= NSE_CLOSE_SECONDS:
+        return False
+    return TRADING_CALENDAR.is_session(date.fromordinal(ist // 86400 + EPOCH_ORDINAL))
 
-                    self.portfolio['cash'] -= price * quantity
-                    self.portfolio['transactions'].append({
-                        'type': 'BUY',
-                        'symbol': symbol,
-                        'quantity': quantity,
-                        'price': price,
-                        'timestamp': timestamp
-                    })
-                    print(f"Added historical BUY: {quantity} {symbol} @ {price:.2f} on {transaction_date}")
-                    self.logs.append(f"Added historical BUY: {quantity} {symbol} @ {price:.2f} on {transaction_date}")
-                else:
-                    print(f"Historical BUY failed: Insufficient cash on {transaction_date}")
-                    self.logs.append(f"Historical BUY failed: Insufficient cash on {transaction_date}")
+CALENDAR_REFRESH_SECONDS = 24 * 3600  # re-read NSE's holiday master once a day
+CALENDAR_RETRY_SECONDS = 3600         # ... or sooner after a failed refresh
+_calendar_refresher = None
+_calendar_refresher_lock = threading.Lock()
 
-            elif transaction_type.upper() == 'SELL':
-                # Historical sell transaction
-                if symbol not in self.portfolio['holdings']:
-                    print(f"Historical SELL failed: {symbol} not in portfolio on {transaction_date}")
-                    self.logs.append(f"Historical SELL failed: {symbol} not in portfolio on {transaction_date}")
-                    return
 
-                if self.portfolio['holdings'][symbol]['quantity'] < quantity:
-                    print(f"Historical SELL failed: Not enough {symbol} shares on {transaction_date}")
-                    self.logs.append(f"Historical SELL failed: Not enough {symbol} shares on {transaction_date}")
-                    return
+def refresh_trading_calendar():
+    """Merge NSE's published capital-market holiday list into the local calendar"""
+    try:
+        holidays = MARKET_DATA.holidays().get('CM', [])
+        days = [datetime.strptime(h['tradingDate'], "%d-%b-%Y").date() for h in holidays]
+        TRADING_CALENDAR.add_holidays(days)
+        return len(days)
+    except Exception as e:
+        logger.warning(f"Error refreshing trading calendar: {e}")
+        return 0
 
-                pl = (price - self.portfolio['holdings'][symbol]['avg_price']) * quantity
-                self.portfolio['cash'] += price * quantity
-                self.portfolio['holdings'][symbol]['quantity'] -= quantity
 
-                if self.portfolio['holdings'][symbol]['quantity'] == 0:
-                    del self.portfolio['holdings'][symbol]
+def start_calendar_refresh(interval=CALENDAR_REFRESH_SECONDS, retry=CALENDAR_RETRY_SECONDS):
+    """
+    Refresh the trading calendar now and then periodically in a daemon thread.
+    Safe to call more than once; only the first call starts the thread.
+    """
+    global _calendar_refresher
 
-                self.portfolio['transactions'].append({
-                    'type': 'SELL',
-                    'symbol': symbol,
-                    'quantity': quantity,
-                    'price': price,
-                    'timestamp': timestamp,
-                    'pl': pl
-                })
-                print(f"Added historical SELL: {quantity} {symbol} @ {price:.2f} on {transaction_date}")
-                self.logs.append(f"Added historical SELL: {quantity} {symbol} @ {price:.2f} on {transaction_date}")
-                print(f"Historical P/L for this transaction: {pl:.2f}")
-                self.logs.append(f"Historical P/L for this transaction: {pl:.2f}")
+    def run():
+        with upstream_priority('background'):
+            while True:
+                time.sleep(interval if refresh_trading_calendar() else retry)
 
-            else:
-                print("Invalid transaction type. Use 'BUY' or 'SELL'")
-                self.logs.append("Invalid transaction type. Use 'BUY' or 'SELL'")
+    with _calendar_refresher_lock:
+        if _calendar_refresher is None:
+            _calendar_refresher = threading.Thread(target=run, name='calendar-refresh', daemon=True)
+            _calendar_refresher.start()
+    return _calendar_refresher
 
-        except Exception as e:
-            print(f"Error processing historical transaction: {str(e)}")
-            self.logs.append(f"Error processing historical transaction: {str(e)}")
-
-    def view_portfolio(self):
-        """Display portfolio with current valuations"""
-        if not self.portfolio['holdings']:
-            print("Portfolio is empty.")
-            print("LOGS:", self.logs)
-            self.logs.append("Portfolio is empty.")
-            return
 
-        total_invested = 0
-        total_current = 0
-        report = []
+BAR_FETCH_MIN_DAYS = 365        # widen every bar-store fetch to at least a year
+BAR_TAIL_RECHECK_SECONDS = 600  # how often to re-probe NSE for today's bar
 
-        for symbol, data in self.portfolio['holdings'].items():
-            current_price = nse.stock_quote(symbol)['priceInfo']['lastPrice']
-            invested = data['avg_price'] * data['quantity']
-            current_value = current_price * data['quantity']
-            pl = current_value - invested
 
-            report.append({
-                'Symbol': symbol,
-                'Quantity': data['quantity'],
-                'Avg Price': data['avg_price'],
-                'Current Price': current_price,
-                'Invested': invested,
-                'Current Value': current_value,
-                'P/L': pl
-            })
+class SymbolBars:
+    """
+    In-memory daily bars for one symbol as parallel NumPy arrays.
 
-            total_invested += invested
-            total_current += current_value
-
-        df = pd.DataFrame(report)
-        print("\nPortfolio Summary:")
-        self.logs.append("\nPortfolio Summary:")
-        print(df.to_string(index=False))
-        self.logs.append(df.to_string(index=False))
-        print(f"\nTotal Invested: {total_invested:.2f}")
-        self.logs.append(f"\nTotal Invested: {total_invested:.2f}")
-        print(f"Current Value: {total_current:.2f}")
-        self.logs.append(f"Current Value: {total_current:.2f}")
-        print(f"Net Profit/Loss: {total_current - total_invested:.2f}")
-        self.logs.append(f"Net Profit/Loss: {total_current - total_invested:.2f}")
-        print(f"Cash Balance: {self.portfolio['cash']:.2f}")
-        self.logs.append(f"Cash Balance: {self.portfolio['cash']:.2f}")
-        print("\n\nLOGS:", self.logs)
+    `prev_index` is a dense per-calendar-day array holding the position of the
+    last bar on or before that day, so a point lookup is a single array read.
+    """
 
-    def buy_and_hold(self, symbol, initial_investment, start_date):
-        price = get_historical_price(symbol, start_date)
-        if price:
-            quantity = initial_investment // price
-            self.add_historical_transaction(symbol, quantity, "BUY", f"{start_date} 09:15:00")
+    def __init__(self, days, opens, highs, lows, closes, volumes):
+        self.days = days
+        self.open = opens
+        self.high = highs
+        self.low = lows
+        self.close = closes
+        self.volume = volumes
+        if len(days):
+            self.first_day = int(days[0])
+            prev_index = np.full(int(days[-1]) - self.first_day + 1, -1, dtype=np.int32)
+            prev_index[days - self.first_day] = np.arange(len(days), dtype=np.int32)
+            self.prev_index = np.maximum.accumulate(prev_index)
+        else:
+            self.first_day = 0
+            self.prev_index = np.empty(0, dtype=np.int32)
+
+    def index_of(self, days, snap=False):
+        """Positions of the bars for the given epoch days (-1 where missing)"""
+        days = np.asarray(days, dtype=np.int64)
+        if not len(self.days):
+            return np.full(days.shape, -1, dtype=np.int64)
+        offset = days - self.first_day
+        clipped = np.clip(offset, 0, len(self.prev_index) - 1)
+        idx = np.where(offset < 0, -1, self.prev_index[clipped]).astype(np.int64)
+        if not snap:
+            exact = self.days[np.maximum(idx, 0)] == days
+            idx = np.where((idx >= 0) & exact, idx, -1)
+        return idx
+
+
+class BarStore:
+    """
+    Local daily-bar store backed by SQLite (`daily_bars` / `bar_coverage`).
 
-    def momentum_strategy(self, symbol, current_date, lookback_days=14, threshold=0.05):
-        # Convert current_date to datetime.date if it's a datetime.datetime object
-        if isinstance(current_date, datetime):
-            current_date = current_date.date()
+    Bars are fetched from the market data provider only for date ranges that have never been
+    covered; afterwards every lookup is served from per-symbol arrays held in
+    memory.
+    """
 
-        # Calculate start and end dates for historical data
-        end_date = current_date
-        start_date = end_date - timedelta(days=lookback_days * 4)  # Get more data for better analysis
+    def __init__(self, db_path='trading_system.db'):
+        self.db_path = db_path
+        self._bars = {}
+        self._coverage = None
+        self._tail_checked = {}
+        self._inflight = {}  # symbol -> lock held while that symbol is being fetched
+        self._lock = threading.RLock()
+
+    def _load_coverage(self):
+        if self._coverage is None:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                rows = conn.execute('SELECT symbol, first_day, last_day FROM bar_coverage').fetchall()
+                self._coverage = {sym: (first, last) for sym, first, last in rows}
+            finally:
+                conn.close()
+        return self._coverage
 
-        # Fetch historical data
-        df = stock_df(symbol, from_date=start_date, to_date=end_date, series="EQ")
-        if len(df) < lookback_days * 2:
-            return
+    def _fetch(self, symbol, first_day, last_day, source=None):
+        """
+        Fetch [first_day, last_day] from the provider and persist it; returns success.
+        Called without the store lock: only the merge into SQLite/coverage takes it.
+        """
+        source = source or MARKET_DATA
+        if isinstance(source, BarStoreProvider):
+            # Never fetch from ourselves; go to the bar-store provider's upstream (if any)
+            source = source.upstream
+            if source is None:
+                return False
+        from_date = date.fromordinal(first_day + EPOCH_ORDINAL)
+        to_date = date.fromordinal(last_day + EPOCH_ORDINAL)
+        try:
+            df = _stock_df(symbol, from_date, to_date, provider=source, stale_ok=False)
+        except Exception as e:
+            logger.warning(f"Error fetching bars for {symbol} between {from_date} and {to_date}: {e}")
+            return False
 
-        # Calculate multiple timeframe returns
-        df['returns_short'] = df['CLOSE'].pct_change(lookback_days)
-        df['returns_medium'] = df['CLOSE'].pct_change(lookback_days * 2)
-        df['returns_long'] = df['CLOSE'].pct_change(lookback_days * 3)
-        
-        # Calculate moving averages for trend confirmation
-        df['SMA20'] = df['CLOSE'].rolling(window=20).mean()
-        
-        # Calculate volume indicators
-        df['volume_sma'] = df['VOLUME'].rolling(window=lookback_days).mean()
-        df['volume_ratio'] = df['VOLUME'] / df['volume_sma']
-        
-        # Calculate volatility
-        df['volatility'] = df['CLOSE'].rolling(window=lookback_days).std() / df['CLOSE'].rolling(window=lookback_days).mean()
-        
-        # Determine if trend is up
-        trend_is_up = df['CLOSE'].iloc[-1] > df['CLOSE'].iloc[-5]  # Price higher than 5 days ago
-        
-        # Adaptive threshold based on market volatility
-        adaptive_threshold = threshold * (1 + df['volatility'].iloc[-1])
-        
-        # Calculate momentum score (weighted average of returns)
-        df['momentum_score'] = (df['returns_short'] * 0.5 + 
-                            df['returns_medium'] * 0.3 + 
-                            df['returns_long'] * 0.2)
-        
-        current_momentum = df['momentum_score'].iloc[-1]
-        current_volume_ratio = df['volume_ratio'].iloc[-1]
-        current_price = df['CLOSE'].iloc[-1]
-        if any([
-            # Condition 1: Strong momentum with decent volume
-            current_momentum > adaptive_threshold and current_volume_ratio > 1.0,
-            
-            # Condition 2: Very strong momentum even without volume confirmation
-            current_momentum > adaptive_threshold * 1.5,
-            
-            # Condition 3: Positive momentum with strong uptrend
-            current_momentum > 0 and trend_is_up and df['CLOSE'].iloc[-1] > df['SMA20'].iloc[-1]
-        ]):
-            # Calculate position size based on strength of signal
-            position_size = 0.05  # Base position size: 5% of portfolio
-            
-            # Increase position for stronger signals
-            if current_momentum > adaptive_threshold * 2:
-                position_size = 0.08  # Stronger signal: 8% of portfolio
-                
-            # Reduce position in high volatility
-            if df['volatility'].iloc[-1] > df['volatility'].rolling(window=lookback_days).mean().iloc[-1] * 1.2:
-                position_size *= 0.7  # Reduce by 30% in high volatility
-                
-            quantity = max(1, int(self.portfolio['cash'] * position_size / current_price))
-            print(f"BUY SIGNAL: Purchasing {quantity} shares of {symbol}")
-            self.add_historical_transaction(symbol, quantity, "BUY", f"{current_date} 09:15:00")
+        rows = []
+        if not df.empty:
+            days = pd.to_datetime(df['DATE']).values.astype('datetime64[D]').astype(np.int64)
+            rows = list(zip([symbol] * len(df), days.tolist(),
+                            df['OPEN'].astype(float).tolist(), df['HIGH'].astype(float).tolist(),
+                            df['LOW'].astype(float).tolist(), df['CLOSE'].astype(float).tolist(),
+                            df['VOLUME'].fillna(0).astype(np.int64).tolist()))
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.executemany('''INSERT OR REPLACE INTO daily_bars
+                                    (symbol, day, open, high, low, close, volume)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+                # Today's bar may not be published yet, so only close the range up to yesterday
+                today_day = date.today().toordinal() - EPOCH_ORDINAL
+                covered_last = min(last_day, today_day - 1)
+                coverage = self._load_coverage()
+                first, last = coverage.get(symbol, (first_day, covered_last))
+                first, last = min(first, first_day), max(last, covered_last)
+                conn.execute('INSERT OR REPLACE INTO bar_coverage (symbol, first_day, last_day) VALUES (?, ?, ?)',
+                             (symbol, first, last))
+                conn.commit()
+                coverage[symbol] = (first, last)
+            finally:
+                conn.close()
+            self._bars.pop(symbol, None)
+        return True
 
-        # SELL SIGNALS
-        elif any([
-            # Condition 1: Strong negative momentum with volume confirmation
-            current_momentum < -adaptive_threshold and current_volume_ratio > 1.0,
-            
-            # Condition 2: Very strong negative momentum
-            current_momentum < -adaptive_threshold * 1.5,
-            
-            # Condition 3: Price below short-term moving average with negative momentum
-            current_momentum < 0 and df['CLOSE'].iloc[-1] < df['SMA20'].iloc[-1] and not trend_is_up
-        ]):
-            if symbol in self.portfolio['holdings']:
-                print(f"SELL SIGNAL: Selling all shares of {symbol}")
-                self.add_historical_transaction(symbol, self.portfolio['holdings'][symbol]['quantity'], "SELL",
-                                            f"{current_date} 09:15:00")
-        
-        # Profit taking and stop-loss logic - more adaptive
-        elif symbol in self.portfolio['holdings']:
-            avg_price = self.portfolio['holdings'][symbol]['avg_price']
-            profit_pct = (current_price - avg_price) / avg_price
-            
-            # Adaptive profit taking based on volatility
-            profit_target = max(0.12, 0.10 * (1 + df['volatility'].iloc[-1]))  # Min 12% profit target
-            
-            # Adaptive stop-loss based on volatility
-            stop_loss = min(-0.05, -0.04 * (1 + df['volatility'].iloc[-1]))  # Max 5% loss
-            
-            # Take profits at target or cut losses at stop-loss
-            if profit_pct > profit_target or profit_pct < stop_loss:
-                print(f"{'PROFIT TAKING' if profit_pct > 0 else 'STOP LOSS'}: Selling {symbol} at {profit_pct:.2%}")
-                self.add_historical_transaction(symbol, self.portfolio['holdings'][symbol]['quantity'], "SELL",
-                                            f"{current_date} 09:15:00")
-            
-            # Partial profit taking at smaller gains
-            elif profit_pct > profit_target * 0.7 and current_momentum < 0:
-                # Take partial profits if momentum is weakening
-                sell_quantity = max(1, self.portfolio['holdings'][symbol]['quantity'] // 2)
-                print(f"PARTIAL PROFIT TAKING: Selling {sell_quantity} shares of {symbol} at {profit_pct:.2%}")
-                self.add_historical_transaction(symbol, sell_quantity, "SELL", f"{current_date} 09:15:00")
+    def ensure(self, symbol, start, end, source=None):
+        """
+        Make sure bars for [start, end] are in the local store (fetching gaps from source).
+        Returns False when a fetch that was due failed.
+        """
+        start_day = TradingCalendar._to_day(start)
+        today_day = date.today().toordinal() - EPOCH_ORDINAL
+        end_day = min(TradingCalendar._to_day(end), today_day)
+        if start_day > end_day:
+            return True
+        with self._lock:
+            gaps, hit = self._gaps(symbol, start_day, end_day, today_day)
+            METRICS.cache_lookup('bar_store', hit or not gaps)
+            if not gaps:
+                return True
+            inflight = self._inflight.setdefault(symbol, threading.Lock())
+        # The network fetch runs outside the store lock, one fetcher per symbol;
+        # concurrent callers wait here and then usually find the range covered.
+        with inflight:
+            with self._lock:
+                gaps, _ = self._gaps(symbol, start_day, end_day, today_day)
+            ok = True
+            for first_day, last_day in gaps:
+                if not self._fetch(symbol, first_day, last_day, source):
+                    ok = False
+                elif last_day >= today_day:
+                    with self._lock:
+                        self._tail_checked[symbol] = time.time()
+        return ok
+
+    def _gaps(self, symbol, start_day, end_day, today_day):
+        """Uncovered parts of [start_day, end_day] that are due a fetch, and whether it was fully covered"""
+        coverage = self._load_coverage().get(symbol)
+        gaps = []
+        hit = coverage is not None and coverage[0] <= start_day and end_day <= coverage[1]
+        if coverage is None:
+            gaps.append((min(start_day, end_day - BAR_FETCH_MIN_DAYS), end_day))
+        else:
+            first, last = coverage
+            if start_day < first:
+                gaps.append((min(start_day, first - BAR_FETCH_MIN_DAYS), first - 1))
+            if end_day > last:
+                # The open-ended tail (today) is only re-probed every few minutes
+                checked = self._tail_checked.get(symbol, 0)
+                if end_day < today_day or time.time() - checked > BAR_TAIL_RECHECK_SECONDS:
+                    gaps.append((last + 1, end_day))
+        return gaps, hit
+
+    def symbols(self):
+        """Every symbol with bars in the store"""
+        with self._lock:
+            return sorted(self._load_coverage())
+
+    def coverage_signature(self):
+        """Cheap fingerprint of the covered ranges; changes whenever bars are added"""
+        with self._lock:
+            coverage = self._load_coverage()
+            return [len(coverage), sum(first for first, _ in coverage.values()),
+                    sum(last for _, last in coverage.values())]
+
+    def bars(self, symbol):
+        """Return the SymbolBars for symbol (loading from SQLite on first use)"""
+        with self._lock:
+            bars = self._bars.get(symbol)
+            if bars is None:
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    rows = conn.execute('''SELECT day, open, high, low, close, volume FROM daily_bars
+                                           WHERE symbol=? ORDER BY day''', (symbol,)).fetchall()
+                finally:
+                    conn.close()
+                cols = np.array(rows, dtype=np.float64).reshape(-1, 6)
+                bars = SymbolBars(cols[:, 0].astype(np.int32), cols[:, 1], cols[:, 2],
+                                  cols[:, 3], cols[:, 4], cols[:, 5])
+                self._bars[symbol] = bars
+                # Bars on weekends are special sessions (e.g. budget day)
+                weekend = bars.days[(bars.days + 3) % 7 >= 5]
+                if len(weekend):
+                    TRADING_CALENDAR.add_sessions(date.fromordinal(int(d) + EPOCH_ORDINAL) for d in weekend)
+            return bars
+
+    def save_intraday(self, symbol, interval, starts, ohlcv):
+        """Upsert intraday bars (interval in seconds, starts in epoch seconds)"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = [(symbol, interval, int(ts), *map(float, row)) for ts, row in zip(starts, ohlcv)]
+            conn.executemany('''INSERT OR REPLACE INTO intraday_bars
+                                (symbol, interval, start, open, high, low, close, volume)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error saving intraday bars for {symbol}: {e}")
+        finally:
+            conn.close()
 
-    def bollinger_bands_strategy(self, symbol, current_date, window=20, num_std=2):
-        # Get historical data
-        # end_date = date.today()
-        end_date = current_date
-        start_date = end_date - timedelta(days=window * 2)
-        df = stock_df(symbol, from_date=start_date, to_date=end_date, series="EQ")
+    def intraday(self, symbol, interval, limit=None):
+        """Most recent persisted intraday bars as (starts, ohlcv), oldest first"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute('''SELECT start, open, high, low, close, volume FROM intraday_bars
+                                   WHERE symbol=? AND interval=? ORDER BY start DESC LIMIT ?''',
+                                (symbol, interval, -1 if limit is None else limit)).fetchall()
+        finally:
+            conn.close()
+        cols = np.array(rows[::-1], dtype=np.float64).reshape(-1, 6)
+        return cols[:, 0].astype(np.int64), cols[:, 1:]
+
+    def closes_on(self, symbol, dates, snap=False):
+        """
+        Batch lookup of closing prices.
 
-        if len(df) < window:
-            return
-        
-        df['MA'] = df['CLOSE'].rolling(window=window).mean()
-        df['STD'] = df['CLOSE'].rolling(window=window).std()
-        df['Upper'] = df['MA'] + (df['STD'] * num_std)
-        df['Lower'] = df['MA'] - (df['STD'] * num_std)
+        Parameters:
+            symbol (str): Stock symbol
+            dates (list): Dates (date objects or YYYY-MM-DD strings)
+            snap (bool): Use the last bar on or before each date when there is no exact bar
 
-        df['BB_Width'] = (df['Upper'] - df['Lower']) / df['MA']
-        df['%B'] = (df['CLOSE'] - df['Lower']) / (df['Upper'] - df['Lower'])
-        
-        # Calculate RSI for confirmation
-        delta = df['CLOSE'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        df['RSI'] = 100 - (100 / (1 + rs))
-        
-        current_price = df['CLOSE'].iloc[-1]
-        prev_price = df['CLOSE'].iloc[-2]
-        
-        # Enhanced decision logic
-        if current_price < df['Lower'].iloc[-1] and df['RSI'].iloc[-1] < 30:
-            # Strong buy signal: price below lower band and oversold RSI
-            quantity = max(1, int(self.portfolio['cash'] * 0.05 / current_price))  # Use 5% of cash
-            self.add_historical_transaction(symbol, quantity, "BUY", f"{current_date} 09:15:00")
-            
-        elif current_price > df['Upper'].iloc[-1] and df['RSI'].iloc[-1] > 70:
-            # Strong sell signal: price above upper band and overbought RSI
-            if symbol in self.portfolio['holdings']:
-                self.add_historical_transaction(symbol, self.portfolio['holdings'][symbol]['quantity'], "SELL", 
-                                            f"{current_date} 09:15:00")
-        
-        # Mean reversion opportunity
-        elif df['%B'].iloc[-1] < 0.1 and df['%B'].iloc[-2] < df['%B'].iloc[-1] and df['BB_Width'].iloc[-1] > df['BB_Width'].rolling(window=20).mean().iloc[-1]:
-            # Price near lower band, starting to move up, and volatility is high
-            quantity = max(1, int(self.portfolio['cash'] * 0.03 / current_price))  # Use 3% of cash
-            self.add_historical_transaction(symbol, quantity, "BUY", f"{current_date} 09:15:00")
-        
-        # Take profit on strength
-        elif df['%B'].iloc[-1] > 0.9 and df['%B'].iloc[-2] > df['%B'].iloc[-1]:
-            # Price near upper band and starting to turn down
-            if symbol in self.portfolio['holdings']:
-                # Sell half position to lock in profits
-                sell_quantity = max(1, self.portfolio['holdings'][symbol]['quantity'] // 2)
-                self.add_historical_transaction(symbol, sell_quantity, "SELL", f"{current_date} 09:15:00")
+        Returns:
+            np.ndarray: Closing prices (NaN where no bar is available)
+        """
+        days = np.array([TradingCalendar._to_day(d) for d in dates], dtype=np.int64)
+        if not len(days):
+            return np.empty(0, dtype=np.float64)
+        self.ensure(symbol, date.fromordinal(int(days.min()) + EPOCH_ORDINAL),
+                    date.fromordinal(int(days.max()) + EPOCH_ORDINAL))
+        bars = self.bars(symbol)
+        idx = bars.index_of(days, snap=snap)
+        if not len(bars.close):
+            return np.full(len(days), np.nan)
+        return np.where(idx >= 0, bars.close[np.maximum(idx, 0)], np.nan)
+
+    def close_on(self, symbol, d, snap=False):
+        """Closing price for a single date, or None"""
+        price = self.closes_on(symbol, [d], snap=snap)[0]
+        return None if np.isnan(price) else float(price)
+
+
+BAR_STORE = BarStore()
+
+########## Intraday bars ###################
+# Live quotes we already poll are folded into 1m/5m/15m OHLCV bars held in
+# fixed-size ring buffers per symbol, flushed to the bar store every minute.
+INTRADAY_INTERVALS = {'1m': 60, '5m': 300, '15m': 900}
+INTRADAY_CAPACITY = {'1m': 750, '5m': 600, '15m': 400}  # ~2 sessions of 1m, ~8 of 5m, ~16 of 15m
+INTRADAY_FLUSH_SECONDS = 60
+INTRADAY_MAX_QUOTE_AGE = 120  # quotes whose lastUpdateTime is older than this are not ticks
+
+
+def _quote_volume(quote):
+    """Cumulative traded volume for the day from an NSE quote, if it carries one"""
+    if not isinstance(quote, dict):
+        return None
+    for section, field in (('marketDeptOrderBook', 'tradeInfo'), ('preOpenMarket', None)):
+        data = quote.get(section) or {}
+        data = data.get(field) or {} if field else data
+        if data.get('totalTradedVolume') is not None:
+            return float(data['totalTradedVolume'])
+    return None
+
+
+def _quote_time(quote):
+    """Epoch seconds of an NSE quote's metadata.lastUpdateTime (IST), or None"""
+    updated = ((quote or {}).get('metadata') or {}).get('lastUpdateTime') if isinstance(quote, dict) else None
+    for fmt in ("%d-%b-%Y %H:%M:%S", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(str(updated), fmt)
+        except ValueError:
+            continue
+        return (parsed - datetime(1970, 1, 1)).total_seconds() - IST_OFFSET_SECONDS
+    return None
+
+
+class IntradayRing:
+    """Fixed-capacity ring of OHLCV bars for one symbol at one interval"""
+
+    def __init__(self, interval, capacity):
+        self.interval = interval
+        self.capacity = capacity
+        self.start = np.zeros(capacity, dtype=np.int64)    # bar start, epoch seconds
+        self.ohlcv = np.zeros((capacity, 5), dtype=np.float64)
+        self.count = 0
+        self.head = -1            # slot of the newest (possibly still forming) bar
+        self.flushed_from = 0     # bars starting at or after this still need persisting
+
+    def add_tick(self, ts, price, volume=0.0):
+        """Fold one trade/quote into the bar it falls in; late ticks for closed bars are dropped"""
+        bucket = int(ts) - int(ts) % self.interval
+        if self.count and bucket < self.start[self.head]:
+            return False
+        if not self.count or bucket > self.start[self.head]:
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self.start[self.head] = bucket
+            self.ohlcv[self.head] = (price, price, price, price, volume)
+        else:
+            bar = self.ohlcv[self.head]
+            bar[1] = max(bar[1], price)
+            bar[2] = min(bar[2], price)
+            bar[3] = price
+            bar[4] += volume
+        return True
 
-    def moving_average_crossover(self, symbol, start_date, short_window=50, long_window=200):
-        # Get historical data
-        end_date = start_date
-        start_date = end_date - timedelta(days=long_window * 2)
-        df = stock_df(symbol, from_date=start_date, to_date=end_date, series="EQ")
-        # Debugging: Check DataFrame
-        if df.empty or 'CLOSE' not in df.columns:
-            print(f"Error: No 'CLOSE' column found or DataFrame is empty for {symbol}")
-            return
+    def load(self, starts, ohlcv):
+        """Seed the ring with persisted bars (oldest first)"""
+        for ts, row in zip(starts[-self.capacity:], ohlcv[-self.capacity:]):
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self.start[self.head] = ts
+            self.ohlcv[self.head] = row
+        if self.count:
+            self.flushed_from = int(self.start[self.head])
+
+    def arrays(self, limit=None, since=None):
+        """(starts, ohlcv) oldest first; copies, so callers never see the ring move"""
+        n = self.count if limit is None else min(limit, self.count)
+        idx = (self.head - n + 1 + np.arange(n)) % self.capacity
+        starts, ohlcv = self.start[idx], self.ohlcv[idx]
+        if since is not None:
+            keep = starts >= since
+            starts, ohlcv = starts[keep], ohlcv[keep]
+        return starts, ohlcv
+
+
+class IntradayAggregator:
+    """Tick-to-bar aggregation for every symbol we receive live quotes for"""
+
+    def __init__(self, store=None, intervals=INTRADAY_INTERVALS):
+        self._store = store
+        self.intervals = intervals
+        self._rings = {}
+        self._cum_volume = {}
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        return self._store or BAR_STORE
+
+    def _rings_for(self, symbol):
+        rings = self._rings.get(symbol)
+        if rings is None:
+            rings = {}
+            for name, seconds in self.intervals.items():
+                ring = IntradayRing(seconds, INTRADAY_CAPACITY.get(name, 500))
+                # Pick up where we left off after a restart
+                ring.load(*self.store.intraday(symbol, seconds, limit=ring.capacity))
+                rings[name] = ring
+            self._rings[symbol] = rings
+        return rings
+
+    def on_quote(self, symbol, price, quote=None, ts=None):
+        """
+        Quote listener: fold a live quote into every interval's current bar.
 
-        if not isinstance(short_window, int) or not isinstance(long_window,
-                                                               int) or short_window <= 0 or long_window <= 0:
-            print(f"Error: Invalid window sizes -> short_window: {short_window}, long_window: {long_window}")
+        Only real ticks are kept: quotes from a non-live provider (e.g. the last
+        stored close), quotes whose lastUpdateTime is stale and anything outside
+        NSE session hours are dropped. An explicit ts skips the freshness checks.
+        """
+        if ts is None:
+            if not getattr(MARKET_DATA, 'realtime', False):
+                return
+            ts = time.time()
+            updated = _quote_time(quote)
+            if updated is not None and ts - updated > INTRADAY_MAX_QUOTE_AGE:
+                return
+        if not is_market_open(ts):
             return
+        cumulative = _quote_volume(quote)
+        with self._lock:
+            volume = 0.0
+            previous = self._cum_volume.get(symbol)
+            if cumulative is not None:
+                # Cumulative volume resets each session; a drop means a new day
+                volume = cumulative - previous if previous is not None and cumulative >= previous else 0.0
+                self._cum_volume[symbol] = cumulative
+            for ring in self._rings_for(symbol).values():
+                ring.add_tick(ts, price, volume)
+            due = time.time() - self._last_flush >= INTRADAY_FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Persist new and still-forming bars to the bar store"""
+        with self._lock:
+            self._last_flush = time.time()
+            pending = []
+            for symbol, rings in self._rings.items():
+                for ring in rings.values():
+                    starts, ohlcv = ring.arrays(since=ring.flushed_from)
+                    if len(starts):
+                        pending.append((symbol, ring.interval, starts, ohlcv))
+                        ring.flushed_from = int(starts[-1])  # the forming bar gets rewritten next time
+        for symbol, interval, starts, ohlcv in pending:
+            self.store.save_intraday(symbol, interval, starts, ohlcv)
+        return len(pending)
+
+    def bars(self, symbol, interval='5m', limit=None):
+        """Columnar intraday bars, oldest first (the last one may still be forming)"""
+        if interval not in self.intervals:
+            raise ValueError(f"Unknown interval {interval}; use one of {', '.join(self.intervals)}")
+        with self._lock:
+            starts, ohlcv = self._rings_for(symbol)[interval].arrays(limit)
+        return {
+            'symbol': symbol,
+            'interval': interval,
+            'epoch': '1970-01-01T00:00:00Z',
+            'time': starts,
+            'open': ohlcv[:, 0], 'high': ohlcv[:, 1], 'low': ohlcv[:, 2],
+            'close': ohlcv[:, 3], 'volume': ohlcv[:, 4]
+        }
 
-        if len(df) < long_window:
-            print(f"Not enough data for {symbol}. Required: {long_window}, Available: {len(df)}")
-            return
+    def dataframe(self, symbol, interval='5m', limit=None):
+        """Intraday bars shaped like stock_df (DATE in IST, OPEN/HIGH/LOW/CLOSE/VOLUME, newest first)"""
+        bars = self.bars(symbol, interval, limit)
+        df = pd.DataFrame({
+            'DATE': pd.to_datetime(bars['time'], unit='s', utc=True).tz_convert('Asia/Kolkata').tz_localize(None),
+            'OPEN': bars['open'], 'HIGH': bars['high'], 'LOW': bars['low'],
+            'CLOSE': bars['close'], 'VOLUME': bars['volume']
+        })
+        return df.iloc[::-1].reset_index(drop=True)
 
-        # Ensure 'CLOSE' is numeric
-        df['CLOSE'] = pd.to_numeric(df['CLOSE'], errors='coerce')
 
-        # Calculate MAs
-        df['SMA20'] = df['CLOSE'].rolling(window=20).mean()
-        df['SMA50'] = df['CLOSE'].rolling(window=short_window).mean()
-        df['SMA200'] = df['CLOSE'].rolling(window=long_window).mean()
+INTRADAY_BARS = IntradayAggregator()
+add_quote_listener(INTRADAY_BARS.on_quote)
+atexit.register(INTRADAY_BARS.flush)
 
-        df['EMA20'] = df['CLOSE'].ewm(span=20, adjust=False).mean()
-        df['EMA50'] = df['CLOSE'].ewm(span=short_window, adjust=False).mean()
-        
-        # Calculate MACD
-        df['MACD'] = df['EMA20'] - df['EMA50']
-        df['MACD_Signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
-        df['MACD_Hist'] = df['MACD'] - df['MACD_Signal']
-        
-        # Calculate volume indicators
-        df['Volume_SMA'] = df['VOLUME'].rolling(window=20).mean()
 
-        # Ensure enough non-null values exist
-        if df[['SMA50', 'SMA200']].isnull().all().iloc[-1]:
-            print(f"Insufficient data to compute moving averages for {symbol}")
-            return
+def get_intraday_bars(symbol, interval='5m', limit=None):
+    """Intraday bars for strategies (stock_df-shaped DataFrame); no upstream call"""
+    return INTRADAY_BARS.dataframe(symbol, interval, limit)
 
-        # Generate signals
-        if (df['SMA50'].iloc[-2] < df['SMA200'].iloc[-2] and df['SMA50'].iloc[-1] > df['SMA200'].iloc[-1] and
-            df['MACD_Hist'].iloc[-1] > 0 and df['VOLUME'].iloc[-1] > df['Volume_SMA'].iloc[-1]):
-            
-            print(f"Strong Golden Cross detected: Buying {symbol}")
-            position_size = 0.1  # 10% of portfolio
-            quantity = max(1, int(self.portfolio['cash'] * position_size / df['CLOSE'].iloc[-1]))
-            self.buy_stock(symbol, quantity, live=True)
 
-        # Death Cross with confirmation
-        elif (df['SMA50'].iloc[-2] > df['SMA200'].iloc[-2] and df['SMA50'].iloc[-1] < df['SMA200'].iloc[-1] and
-            df['MACD_Hist'].iloc[-1] < 0 and df['VOLUME'].iloc[-1] > df['Volume_SMA'].iloc[-1]):
-            
-            print(f"Strong Death Cross detected: Selling {symbol}")
-            if symbol in self.portfolio['holdings']:
-                self.sell_stock(symbol, self.portfolio['holdings'][symbol]['quantity'], live=True)
-        
-        # Additional buy signal: Price above all MAs with increasing MACD
-        elif (df['CLOSE'].iloc[-1] > df['SMA20'].iloc[-1] > df['SMA50'].iloc[-1] and
-            df['MACD_Hist'].iloc[-1] > df['MACD_Hist'].iloc[-2] > 0):
-            
-            print(f"Strong uptrend detected: Adding to position in {symbol}")
-            position_size = 0.05  # 5% of portfolio
-            quantity = max(1, int(self.portfolio['cash'] * position_size / df['CLOSE'].iloc[-1]))
-            self.buy_stock(symbol, quantity, live=True)
-        
-        # Take profit when price is extended above MAs
-        elif (symbol in self.portfolio['holdings'] and
-            df['CLOSE'].iloc[-1] > df['SMA20'].iloc[-1] * 1.1 and  # Price 10% above 20-day MA
-            df['MACD_Hist'].iloc[-1] < df['MACD_Hist'].iloc[-2]):  # MACD histogram decreasing
-            
-            print(f"Taking profits on extended move: Selling portion of {symbol}")
-            sell_quantity = max(1, self.portfolio['holdings'][symbol]['quantity'] // 3)  # Sell 1/3 of position
-            self.sell_stock(symbol, sell_quantity, live=True)
-    def adaptive_multi_strategy(self, symbol, current_date):
-        """
-        Highly optimized adaptive strategy with dynamic parameters and advanced market regime detection
-        for maximum returns across different market conditions.
-        """
-        # Convert current_date to datetime.date if it's a datetime.datetime object
-        if isinstance(current_date, datetime):
-            current_date = current_date.date()
-            
-        # Get historical data (200 trading days ~ 10 months)
-        end_date = current_date
-        start_date = end_date - timedelta(days=250)
-        df = stock_df(symbol, from_date=start_date, to_date=end_date, series="EQ")
+def price_history_arrays(price_history):
+    """
+    Normalize a stored price history to (days, close) arrays.
+
+    Accepts the columnar form ({'days': [...], 'close': [...]}) as well as the
+    legacy {'YYYY-MM-DD': price} dict found in older portfolio blobs.
+
+    Returns:
+        tuple: (np.ndarray int32 epoch days, np.ndarray float64 closes), sorted by day
+    """
+    if not price_history:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+    if 'days' in price_history and 'close' in price_history:
+        return (np.asarray(price_history['days'], dtype=np.int32),
+                np.asarray(price_history['close'], dtype=np.float64))
+
+    items = sorted(price_history.items())
+    days = np.array([str(k)[:10] for k, _ in items], dtype='datetime64[D]').astype(np.int32)
+    return days, np.array([v for _, v in items], dtype=np.float64)
+
+
+def columnar_series(days, values, name):
+    """Columnar JSON form of a daily series: {'days': [epoch days], name: [values]}"""
+    return {'epoch': '1970-01-01', 'days': days.tolist(), name: values.tolist()}
+
+
+def compute_performance_metrics(days, equity, invested, traded, risk_free_rate=0.0):
+    """
+    Compute backtest performance metrics from a daily equity curve.
+
+    Parameters:
+        days (np.ndarray): Session dates as epoch-day ints
+        equity (np.ndarray): Cash + holdings value at each session close
+        invested (np.ndarray): Holdings value at each session close
+        traded (np.ndarray): Gross notional traded during each session
+        risk_free_rate (float): Annual risk-free rate for Sharpe/Sortino
+
+    Returns:
+        dict: max drawdown, Sharpe, Sortino, CAGR, exposure and turnover
+    """
+    metrics = {
+        'sessions': int(len(equity)),
+        'max_drawdown': None,
+        'max_drawdown_duration': None,
+        'volatility': None,
+        'sharpe': None,
+        'sortino': None,
+        'cagr': None,
+        'exposure': None,
+        'turnover': None
+    }
+    if len(equity) == 0:
+        return metrics
+
+    peak = np.maximum.accumulate(equity)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = np.where(peak > 0, equity / peak - 1, 0.0)
+        exposure = np.where(equity > 0, invested / equity, 0.0)
+    metrics['max_drawdown'] = float(drawdown.min())
+    # Longest run of sessions spent below a previous peak
+    underwater = np.concatenate(([0], (drawdown < 0).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(underwater))
+    metrics['max_drawdown_duration'] = int((edges[1::2] - edges[::2]).max()) if len(edges) else 0
+    metrics['exposure'] = float(exposure.mean())
+    metrics['turnover'] = float(traded.sum() / equity.mean() * TRADING_DAYS_PER_YEAR / len(equity)) \
+        if equity.mean() > 0 else None
+
+    span_days = int(days[-1] - days[0])
+    if span_days > 0 and equity[0] > 0 and equity[-1] > 0:
+        metrics['cagr'] = float((equity[-1] / equity[0]) ** (365.25 / span_days) - 1)
+
+    if len(equity) > 2:
+        returns = np.diff(equity) / equity[:-1]
+        excess = returns - risk_free_rate / TRADING_DAYS_PER_YEAR
+        std = returns.std(ddof=1)
+        downside = np.sqrt(np.mean(np.minimum(excess, 0.0) ** 2))
+        annualizer = np.sqrt(TRADING_DAYS_PER_YEAR)
+        metrics['volatility'] = float(std * annualizer)
+        metrics['sharpe'] = float(excess.mean() / std * annualizer) if std > 0 else None
+        metrics['sortino'] = float(excess.mean() / downside * annualizer) if downside > 0 else None
+    return metrics
+
+
+########## Multi-symbol price panels ###################
+PANEL_WARMUP_DAYS = 400  # calendar days loaded before a backtest start for indicator warm-up
+
+
+def rolling_mean(values, window):
+    """
+    Trailing mean along axis 0 (dates) via cumulative sums.
+
+    Rows without `window` valid observations are NaN, so a symbol's missing
+    bars never leak into its neighbours' windows.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    zero = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate([zero, np.cumsum(np.where(valid, values, 0.0), axis=0)])
+    counts = np.concatenate([zero, np.cumsum(valid, axis=0)])
+    out = np.full(values.shape, np.nan)
+    if window <= len(values):
+        n = counts[window:] - counts[:-window]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[window - 1:] = np.where(n == window, (sums[window:] - sums[:-window]) / window, np.nan)
+    return out
+
+
+def rolling_std(values, window):
+    """Trailing sample standard deviation along axis 0"""
+    values = np.asarray(values, dtype=np.float64)
+    mean = rolling_mean(values, window)
+    mean_sq = rolling_mean(values * values, window)
+    with np.errstate(invalid='ignore'):
+        var = np.maximum(mean_sq - mean * mean, 0.0) * window / max(window - 1, 1)
+    return np.sqrt(var)
+
+
+def ewm_mean(values, span=None, alpha=None):
+    """Exponential moving average along axis 0; NaN gaps carry the previous value forward"""
+    values = np.asarray(values, dtype=np.float64)
+    alpha = alpha if alpha is not None else 2.0 / (span + 1)
+    out = np.empty(values.shape)
+    state = np.full(values.shape[1:], np.nan)
+    for i in range(len(values)):
+        row = values[i]
+        state = np.where(np.isnan(state), row, np.where(np.isnan(row), state, state + alpha * (row - state)))
+        out[i] = state
+    return out
+
+
+def relative_strength_index(values, period=14):
+    """RSI along axis 0 from simple rolling means of gains and losses, as the strategies compute it"""
+    values = np.asarray(values, dtype=np.float64)
+    change = np.diff(values, axis=0, prepend=np.nan)
+    # A symbol's first bar has no change; count it as flat like Series.diff().where(...) does
+    change = np.where(np.isnan(change) & ~np.isnan(values), 0.0, change)
+    gain = rolling_mean(np.where(change > 0, change, np.where(np.isnan(change), np.nan, 0.0)), period)
+    loss = rolling_mean(np.where(change < 0, -change, np.where(np.isnan(change), np.nan, 0.0)), period)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 100 - 100 / (1 + gain / loss)
+
+
+def forward_fill(values):
+    """Carry each column's last non-NaN value forward along axis 0"""
+    values = np.asarray(values, dtype=np.float64)
+    rows = np.arange(len(values)).reshape((-1,) + (1,) * (values.ndim - 1))
+    last = np.maximum.accumulate(np.where(np.isnan(values), -1, rows), axis=0)
+    filled = np.take_along_axis(values, np.maximum(last, 0), axis=0)
+    return np.where(last >= 0, filled, np.nan)
+
+
+def trailing_return(values, lookback):
+    """values[t] / values[t - lookback] - 1 along axis 0"""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if lookback < len(values):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[lookback:] = values[lookback:] / values[:-lookback] - 1
+    return out
+
+
+# Indicator name -> vectorized function(values, *params); shared by the
+# portfolio engine, walk-forward runs and the screener
+PANEL_INDICATORS = {
+    'sma': rolling_mean,
+    'std': rolling_std,
+    'ema': ewm_mean,
+    'rsi': relative_strength_index,
+    'return': trailing_return,
+}
+
+
+class PricePanel:
+    """
+    Daily bars for many symbols as dates x symbols float64 arrays (NaN where
+    a symbol has no bar that session). Indicators computed over the panel are
+    cached on it, so every consumer of the same panel shares them.
+    """
+
+    def __init__(self, days, symbols, opens, highs, lows, closes, volumes):
+        self.days = days
+        self.symbols = list(symbols)
+        self.index = {symbol: j for j, symbol in enumerate(self.symbols)}
+        self.open = opens
+        self.high = highs
+        self.low = lows
+        self.close = closes
+        self.volume = volumes
+        self._indicators = {}
+        self._filled_close = None
+
+    @property
+    def shape(self):
+        return self.close.shape
+
+    def rows_between(self, start, end):
+        """Row slice covering sessions in [start, end]"""
+        lo = int(np.searchsorted(self.days, TradingCalendar._to_day(start), side='left'))
+        hi = int(np.searchsorted(self.days, TradingCalendar._to_day(end), side='right'))
+        return slice(lo, hi)
+
+    def indicator(self, name, *params, field='close'):
+        """Full-panel indicator array, computed once per (name, params, field)"""
+        key = (name, params, field)
+        values = self._indicators.get(key)
+        if values is None:
+            values = self._indicators[key] = PANEL_INDICATORS[name](getattr(self, field), *params)
+        return values
+
+    def filled_close(self):
+        """Closes with each symbol's last bar carried forward over gaps"""
+        if self._filled_close is None:
+            self._filled_close = forward_fill(self.close)
+        return self._filled_close
+
+
+def load_price_panel(symbols, start_date, end_date, store=None, fetch=True):
+    """
+    Preload daily bars for many symbols from the bar store into a PricePanel.
+
+    Only sessions on which at least one symbol traded become rows. With
+    fetch=False only bars already in the store are used. When the columnar
+    snapshot (BAR_COLUMNS) is current, the panel is a memory-mapped view of it.
+    """
+    store = store or BAR_STORE
+    symbols = list(dict.fromkeys(symbols))
+    if fetch:
+        for symbol in symbols:
+            store.ensure(symbol, start_date, end_date)
+    if store is BAR_STORE and BAR_COLUMNS.is_current():
+        # Columns built from exactly these bars: map them instead of copying per process
+        panel = BAR_COLUMNS.panel(symbols, start_date, end_date)
+        if panel is not None:
+            return panel
+    series = [store.bars(symbol) for symbol in symbols]
+
+    days = TRADING_CALENDAR.session_days(start_date, end_date)
+    shape = (len(days), len(symbols))
+    fields = {name: np.full(shape, np.nan) for name in ('open', 'high', 'low', 'close', 'volume')}
+    for j, bars in enumerate(series):
+        idx = bars.index_of(days, snap=False)
+        hit = idx >= 0
+        for name, column in (('open', bars.open), ('high', bars.high), ('low', bars.low),
+                             ('close', bars.close), ('volume', bars.volume)):
+            fields[name][hit, j] = column[idx[hit]]
+
+    traded = ~np.isnan(fields['close']).all(axis=1)
+    return PricePanel(days[traded], symbols, *(fields[name][traded] for name in
+                                                ('open', 'high', 'low', 'close', 'volume')))
+
+
+########## COLUMNAR BARS ###################
+
+BAR_COLUMNS_DIR = os.environ.get('QUARKS_BAR_COLUMNS')  # default: bar_columns/ next to the database
+BAR_COLUMN_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+BAR_COLUMNS_KEEP = 2  # generations kept on disk so panels handed to running workers stay mappable
+BAR_COLUMNS_BUILD_DELAY = 30  # seconds a background rebuild waits, so a burst of bar fetches costs one build
+
+
+class MappedPricePanel(PricePanel):
+    """
+    PricePanel whose arrays are read-only views of memory-mapped column files.
+
+    It pickles as a reference to the files (not the data), so process-pool
+    workers map the same page-cache pages instead of receiving a copy.
+    """
+
+    def __init__(self, source, *args):
+        super().__init__(*args)
+        self.source = source  # (directory, generation, row slice, column selection)
+
+    def __reduce__(self):
+        return _open_mapped_panel, self.source
+
+
+def _open_mapped_panel(directory, generation, rows, columns):
+    return ColumnarBarStore(directory).panel_from(generation, rows, columns)
+
+
+class ColumnarBarStore:
+    """
+    Fixed-width columnar snapshot of the bar store: one .npy file per field,
+    shaped (sessions x symbols), read with np.load(mmap_mode='r').
+
+    A build writes a new generation directory and then atomically swaps
+    current.json to point at it, so readers never see a half-written file.
+    Builds hold an exclusive lock file, so only one process builds (and
+    prunes) at a time; schedule_build() runs a debounced build off the
+    request path.
+    Panels are zero-copy row slices of the mapped arrays (column subsets copy
+    only the selected symbols), and every process mapping the same generation
+    shares one copy in the page cache.
+    """
+
+    def __init__(self, directory=BAR_COLUMNS_DIR, store=None):
+        self.store = store
+        self.directory = directory or os.path.join(os.path.dirname(os.path.abspath(self.bar_store.db_path)),
+                                                   'bar_columns')
+        self._generations = {}
+        self._build_timer = None
+        self._lock = threading.Lock()
+
+    @property
+    def bar_store(self):
+        return self.store or BAR_STORE
+
+    def manifest(self):
+        try:
+            with open(os.path.join(self.directory, 'current.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_current(self):
+        """True if the columns hold exactly what the bar store covers right now"""
+        manifest = self.manifest()
+        return manifest is not None and manifest['signature'] == self.bar_store.coverage_signature()
+
+    def schedule_build(self, delay=BAR_COLUMNS_BUILD_DELAY):
+        """Rebuild in a background thread after `delay` seconds unless a build is already pending"""
+        with self._lock:
+            if self._build_timer is not None:
+                return False
+            self._build_timer = threading.Timer(delay, self._background_build)
+            self._build_timer.daemon = True
+            self._build_timer.start()
+            return True
+
+    def _background_build(self):
+        try:
+            if not self.is_current():
+                self.build(blocking=False)
+        except OSError as e:
+            logger.warning(f"Could not build bar columns: {e}")
+        finally:
+            with self._lock:
+                self._build_timer = None
+
+    def build(self, blocking=True):
+        """
+        Write every symbol in the bar store to a new generation of column files.
+
+        Returns the manifest, or None when blocking=False and another process
+        holds the build lock. Nothing is rebuilt if the columns are already current.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.build.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                except BlockingIOError:
+                    return None
+            # Another process may have built while we waited for the lock
+            if self.is_current():
+                return self.manifest()
+            return self._build()
+
+    @METRICS.timed('quarks_bar_columns_build_seconds')
+    def _build(self):
+        store = self.bar_store
+        signature = store.coverage_signature()
+        symbols = store.symbols()
+        series = [store.bars(symbol) for symbol in symbols]
+        days = np.unique(np.concatenate([bars.days for bars in series])) if series else np.empty(0, np.int32)
+        days = days.astype(np.int32)
+
+        generation = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{os.getpid()}"
+        path = os.path.join(self.directory, generation)
+        os.makedirs(path)
+        np.save(os.path.join(path, 'days.npy'), days)
+        with open(os.path.join(path, 'symbols.json'), 'w') as f:
+            json.dump(symbols, f)
+        for field in BAR_COLUMN_FIELDS:
+            column = np.lib.format.open_memmap(os.path.join(path, f'{field}.npy'), mode='w+',
+                                               dtype=np.float64, shape=(len(days), len(symbols)))
+            column[:] = np.nan
+            # One symbol at a time, so a build never holds the whole panel in memory
+            for j, bars in enumerate(series):
+                column[np.searchsorted(days, bars.days), j] = getattr(bars, field)
+            column.flush()
+            del column
+
+        manifest = {'generation': generation, 'symbols': len(symbols), 'sessions': len(days),
+                    'first_day': int(days[0]) if len(days) else None,
+                    'last_day': int(days[-1]) if len(days) else None,
+                    'signature': signature, 'built_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        tmp = os.path.join(self.directory, f'current.json.{os.getpid()}')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.directory, 'current.json'))
+        self._prune(generation)
+        logger.info(f"Built bar columns {generation}: {len(days)} sessions x {len(symbols)} symbols")
+        return manifest
+
+    def _prune(self, current):
+        generations = sorted(name for name in os.listdir(self.directory)
+                             if os.path.isdir(os.path.join(self.directory, name)))
+        for name in generations[:-BAR_COLUMNS_KEEP]:
+            if name != current:
+                for file in os.listdir(os.path.join(self.directory, name)):
+                    os.remove(os.path.join(self.directory, name, file))
+                os.rmdir(os.path.join(self.directory, name))
+
+    def _generation(self, generation):
+        with self._lock:
+            opened = self._generations.get(generation)
+            if opened is None:
+                path = os.path.join(self.directory, generation)
+                with open(os.path.join(path, 'symbols.json')) as f:
+                    symbols = json.load(f)
+                opened = {
+                    'days': np.load(os.path.join(path, 'days.npy')),
+                    'symbols': symbols,
+                    'index': {symbol: j for j, symbol in enumerate(symbols)},
+                    'columns': {field: np.load(os.path.join(path, f'{field}.npy'), mmap_mode='r')
+                                for field in BAR_COLUMN_FIELDS}
+                }
+                self._generations = {generation: opened}  # older generations are unmapped once unused
+            return opened
+
+    def panel_from(self, generation, rows, columns):
+        opened = self._generation(generation)
+        symbols = opened['symbols'][columns] if isinstance(columns, slice) else \
+            [opened['symbols'][j] for j in columns]
+        # Slices stay views of the mapping; index lists select (and copy) only what was asked for
+        if isinstance(rows, slice) or isinstance(columns, slice):
+            select = (rows, columns)
+        else:
+            select = np.ix_(rows, columns)
+        return MappedPricePanel((os.path.abspath(self.directory), generation, rows, columns), opened['days'][rows], symbols,
+                                *(opened['columns'][field][select] for field in BAR_COLUMN_FIELDS))
+
+    def panel(self, symbols=None, start_date=None, end_date=None):
+        """
+        PricePanel over the mapped columns, or None if they are missing or do not hold every symbol.
+
+        Rows are trading-calendar sessions on which at least one requested symbol
+        traded, as in load_price_panel.
+        """
+        manifest = self.manifest()
+        if manifest is None:
+            return None
+        generation = manifest['generation']
+        opened = self._generation(generation)
+        days = opened['days']
+        lo = int(np.searchsorted(days, TradingCalendar._to_day(start_date), side='left')) if start_date else 0
+        hi = int(np.searchsorted(days, TradingCalendar._to_day(end_date), side='right')) if end_date else len(days)
+        if hi <= lo:
+            return None
+        if symbols is None:
+            columns = slice(None)
+        else:
+            index = opened['index']
+            symbols = list(dict.fromkeys(symbols))
+            if any(symbol not in index for symbol in symbols):
+                return None
+            columns = [index[symbol] for symbol in symbols]
+            if columns == list(range(columns[0], columns[0] + len(columns))):
+                columns = slice(columns[0], columns[0] + len(columns))
+        sessions = TRADING_CALENDAR.session_days(date.fromordinal(int(days[lo]) + EPOCH_ORDINAL),
+                                                 date.fromordinal(int(days[hi - 1]) + EPOCH_ORDINAL))
+        keep = np.isin(days[lo:hi], sessions)
+        keep &= ~np.isnan(opened['columns']['close'][lo:hi, columns]).all(axis=1)
+        rows = slice(lo, hi) if keep.all() else np.flatnonzero(keep) + lo
+        return self.panel_from(generation, rows, columns)
+
+
+BAR_COLUMNS = ColumnarBarStore()
+
+
+class BacktestContext:
+    """
+    What a portfolio strategy sees each session: the panel up to today (no
+    lookahead), cached panel indicators, and orders that trade the shared
+    cash/holdings book at today's close.
+    """
+
+    def __init__(self, simulation, panel):
+        self.simulation = simulation
+        self.panel = panel
+        self.symbols = panel.symbols
+        self.i = -1
+        self.step = -1
+        self.day = None
+        self.date = None
+        self.traded = 0.0
+        self.positions = np.zeros(len(panel.symbols))
+        for symbol, holding in simulation.portfolio['holdings'].items():
+            if symbol in panel.index:
+                self.positions[panel.index[symbol]] = holding['quantity']
+        self._marks = panel.filled_close()
+
+    def _advance(self, i):
+        self.i = i
+        self.step += 1
+        self.day = int(self.panel.days[i])
+        self.date = date.fromordinal(self.day + EPOCH_ORDINAL)
+
+    @property
+    def prices(self):
+        """Today's closes (NaN for symbols without a bar today)"""
+        return self.panel.close[self.i]
+
+    @property
+    def tradable(self):
+        return ~np.isnan(self.panel.close[self.i])
+
+    @property
+    def cash(self):
+        return self.simulation.portfolio['cash']
+
+    def history(self, field='close', lookback=None):
+        """Rows up to and including today, optionally only the last `lookback`"""
+        lo = 0 if lookback is None else max(0, self.i + 1 - lookback)
+        return getattr(self.panel, field)[lo:self.i + 1]
+
+    def indicator(self, name, *params, field='close'):
+        """Today's row of a cached panel indicator"""
+        return self.panel.indicator(name, *params, field=field)[self.i]
+
+    def sma(self, window):
+        return self.indicator('sma', window)
+
+    def ema(self, span):
+        return self.indicator('ema', span)
+
+    def rsi(self, period=14):
+        return self.indicator('rsi', period)
+
+    def trailing_return(self, lookback):
+        return self.indicator('return', lookback)
+
+    def position(self, symbol):
+        return self.positions[self.panel.index[symbol]]
+
+    def holdings_value(self):
+        marks = self._marks[self.i]
+        held = self.positions != 0
+        return float(np.dot(self.positions[held], marks[held]))
+
+    def equity(self):
+        return self.cash + self.holdings_value()
+
+    def order(self, symbol, quantity):
+        """Buy (quantity > 0) or sell (< 0) at today's close; returns whether it filled"""
+        j = self.panel.index[symbol]
+        price = self.panel.close[self.i, j]
+        quantity = int(quantity)
+        if quantity == 0 or np.isnan(price):
+            return False
+        price = float(price)
+        timestamp = f"{self.date} 09:15:00"
+        if quantity > 0:
+            filled = self.simulation.buy_stock(symbol, quantity, price=price, timestamp=timestamp)
+        else:
+            filled = self.simulation.sell_stock(symbol, -quantity, price=price, timestamp=timestamp)
+        if not filled:
+            return False
+        self.positions[j] = self.simulation.portfolio['holdings'].get(symbol, {}).get('quantity', 0)
+        self.traded += price * abs(quantity)
+        return True
+
+    def order_target_value(self, symbol, value):
+        price = self.panel.close[self.i, self.panel.index[symbol]]
+        if np.isnan(price):
+            return False
+        return self.order(symbol, int(value // price) - int(self.position(symbol)))
+
+    def order_target_percent(self, symbol, weight):
+        return self.order_target_value(symbol, weight * self.equity())
+
+    def rebalance(self, weights):
+        """
+        Move to target weights (symbol -> fraction of equity). Symbols held but
+        not listed are closed out; sells go first so buys can use the cash.
+        """
+        equity = self.equity()
+        targets = {symbol: 0.0 for symbol, j in self.panel.index.items() if self.positions[j]}
+        targets.update(weights)
+        orders = []
+        for symbol, weight in targets.items():
+            price = self.panel.close[self.i, self.panel.index[symbol]]
+            if np.isnan(price):
+                continue
+            delta = int(weight * equity // price) - int(self.position(symbol))
+            if delta:
+                orders.append((delta, symbol))
+        for delta, symbol in sorted(orders):
+            self.order(symbol, delta)
+
+
+class Simulation:
+    def __init__(self, name, cash):
+        self.name = name
+        self.timestamp = datetime.now()
+        self.logs = deque(maxlen=SIMULATION_LOG_LIMIT)
+        self.images = []  # Store image paths
+        self.portfolio = {
+            'cash': cash,
+            'holdings': {},
+            'transactions': [],
+            'performance_images': []  # Store backtest result images
+        }
+
+    def _log(self, message, level=logging.INFO):
+        """Record a message in the bounded log buffer and the module logger"""
+        self.logs.append(message)
+        logger.log(level, message, extra={'simulation': self.name})
+
+    def buy_stock(self, symbol, quantity, price=None, live=True, timestamp=None):
+        """Buy a stock and add it to the portfolio"""
+        if price is None:
+            price = get_stock_price(symbol, live=live)
+            if price is None:
+                self._log(f"Failed to fetch price for {symbol}. Transaction aborted.", logging.WARNING)
+                return False
+
+        cost = price * quantity
+        if self.portfolio['cash'] >= cost:
+            self.portfolio['cash'] -= cost
+            if symbol in self.portfolio['holdings']:
+                # Update average price and quantity
+                total_qty = self.portfolio['holdings'][symbol]['quantity'] + quantity
+                total_invested = self.portfolio['holdings'][symbol]['avg_price'] * self.portfolio['holdings'][symbol][
+                    'quantity'] + cost
+                self.portfolio['holdings'][symbol]['quantity'] = total_qty
+                self.portfolio['holdings'][symbol]['avg_price'] = total_invested / total_qty
+            else:
+                self.portfolio['holdings'][symbol] = {'quantity': quantity, 'avg_price': price}
+
+            # Record transaction
+            self.portfolio['transactions'].append({
+                'type': 'BUY',
+                'symbol': symbol,
+                'quantity': quantity,
+                'price': price,
+                'timestamp': timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
+            self._log(f"Bought {quantity} shares of {symbol} at {price:.2f}")
+            return True
+        else:
+            self._log(f"Insufficient cash to buy {quantity} shares of {symbol}.")
+            return False
+
+    def sell_stock(self, symbol, quantity, price=None, live=True, timestamp=None):
+        """Sell a stock and update the portfolio"""
+        if symbol not in self.portfolio['holdings']:
+            self._log(f"{symbol} not in portfolio.")
+            return False
+
+        if self.portfolio['holdings'][symbol]['quantity'] < quantity:
+            self._log(f"Not enough {symbol} shares to sell.")
+            return False
+
+        if price is None:
+            price = get_stock_price(symbol, live)
+            if price is None:
+                self._log(f"Failed to fetch price for {symbol}. Transaction aborted.", logging.WARNING)
+                return False
+
+        # Calculate profit/loss
+        pl = (price - self.portfolio['holdings'][symbol]['avg_price']) * quantity
+        self.portfolio['cash'] += price * quantity
+        self.portfolio['holdings'][symbol]['quantity'] -= quantity
+
+        # Record transaction
+        self.portfolio['transactions'].append({
+            'type': 'SELL',
+            'symbol': symbol,
+            'quantity': quantity,
+            'price': price,
+            'timestamp': timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'pl': pl
+        })
+        self._log(f"Sold {quantity} shares of {symbol} at {price:.2f}")
+        self._log(f"Profit/Loss: {pl:.2f}")
+
+        # Remove stock if fully sold
+        if self.portfolio['holdings'][symbol]['quantity'] == 0:
+            del self.portfolio['holdings'][symbol]
+        return True
+
+    def add_historical_transaction(self, symbol, quantity, transaction_type, timestamp):
+        """Add historical transaction with automatic price detection"""
+        try:
+            # Extract date from timestamp
+            transaction_date = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
+            price = get_historical_price(symbol, transaction_date)
+
+            if price is None:
+                self._log(f"Transaction failed: Could not find price for {symbol} on {transaction_date}", logging.WARNING)
+                return
+
+            if transaction_type.upper() == 'BUY':
+                # Historical buy transaction
+                if self.portfolio['cash'] >= price * quantity:
+                    if symbol in self.portfolio['holdings']:
+                        # Update average price
+                        total_qty = self.portfolio['holdings'][symbol]['quantity'] + quantity
+                        total_invested = (self.portfolio['holdings'][symbol]['avg_price'] *
+                                          self.portfolio['holdings'][symbol]['quantity'] +
+                                          price * quantity)
+                        self.portfolio['holdings'][symbol]['quantity'] = total_qty
+                        self.portfolio['holdings'][symbol]['avg_price'] = total_invested / total_qty
+                    else:
+                        self.portfolio['holdings'][symbol] = {
+                            'quantity': quantity,
+                            'avg_price': price
+                        }
+
+                    self.portfolio['cash'] -= price * quantity
+                    self.portfolio['transactions'].append({
+                        'type': 'BUY',
+                        'symbol': symbol,
+                        'quantity': quantity,
+                        'price': price,
+                        'timestamp': timestamp
+                    })
+                    self._log(f"Added historical BUY: {quantity} {symbol} @ {price:.2f} on {transaction_date}")
+                else:
+                    self._log(f"Historical BUY failed: Insufficient cash on {transaction_date}")
+
+            elif transaction_type.upper() == 'SELL':
+                # Historical sell transaction
+                if symbol not in self.portfolio['holdings']:
+                    self._log(f"Historical SELL failed: {symbol} not in portfolio on {transaction_date}")
+                    return
+
+                if self.portfolio['holdings'][symbol]['quantity'] < quantity:
+                    self._log(f"Historical SELL failed: Not enough {symbol} shares on {transaction_date}")
+                    return
+
+                pl = (price - self.portfolio['holdings'][symbol]['avg_price']) * quantity
+                self.portfolio['cash'] += price * quantity
+                self.portfolio['holdings'][symbol]['quantity'] -= quantity
+
+                if self.portfolio['holdings'][symbol]['quantity'] == 0:
+                    del self.portfolio['holdings'][symbol]
+
+                self.portfolio['transactions'].append({
+                    'type': 'SELL',
+                    'symbol': symbol,
+                    'quantity': quantity,
+                    'price': price,
+                    'timestamp': timestamp,
+                    'pl': pl
+                })
+                self._log(f"Added historical SELL: {quantity} {symbol} @ {price:.2f} on {transaction_date}")
+                self._log(f"Historical P/L for this transaction: {pl:.2f}")
+
+            else:
+                self._log("Invalid transaction type. Use 'BUY' or 'SELL'")
+
+        except Exception as e:
+            self._log(f"Error processing historical transaction: {str(e)}", logging.ERROR)
+
+    def view_portfolio(self, prices=None):
+        """
+        Value the portfolio at current prices.
+
+        Parameters:
+            prices (dict): Optional symbol -> price map; fetched through the
+                           bulk quote path when not supplied
+
+        Returns:
+            dict: Structured valuation from value_holdings()
+        """
+        holdings = self.portfolio['holdings']
+        if not holdings:
+            self._log("Portfolio is empty.")
+        if prices is None:
+            prices = get_stock_prices(list(holdings))
+
+        valuation = value_holdings(holdings, prices, cash=self.portfolio['cash'])
+        totals = valuation['totals']
+        for line in (f"Total Invested: {totals['invested']:.2f}",
+                     f"Current Value: {totals['current_value']:.2f}",
+                     f"Net Profit/Loss: {totals['pl']:.2f}",
+                     f"Cash Balance: {totals['cash']:.2f}"):
+            self._log(line)
+        if valuation['unpriced']:
+            line = f"Could not fetch prices for: {', '.join(valuation['unpriced'])}"
+            self._log(line)
+        return valuation
+
+    def buy_and_hold(self, symbol, initial_investment, start_date):
+        price = get_historical_price(symbol, start_date)
+        if price:
+            quantity = initial_investment // price
+            self.add_historical_transaction(symbol, quantity, "BUY", f"{start_date} 09:15:00")
+
+    def momentum_strategy(self, symbol, current_date, lookback_days=14, threshold=0.05):
+        # Convert current_date to datetime.date if it's a datetime.datetime object
+        if isinstance(current_date, datetime):
+            current_date = current_date.date()
+
+        # Calculate start and end dates for historical data
+        end_date = current_date
+        start_date = end_date - timedelta(days=lookback_days * 4)  # Get more data for better analysis
+
+        # Fetch historical data
+        df = _stock_df(symbol, start_date, end_date)
+        if len(df) < lookback_days * 2:
+            return
+
+        # Calculate multiple timeframe returns
+        df['returns_short'] = df['CLOSE'].pct_change(lookback_days)
+        df['returns_medium'] = df['CLOSE'].pct_change(lookback_days * 2)
+        df['returns_long'] = df['CLOSE'].pct_change(lookback_days * 3)
+        
+        # Calculate moving averages for trend confirmation
+        df['SMA20'] = df['CLOSE'].rolling(window=20).mean()
+        
+        # Calculate volume indicators
+        df['volume_sma'] = df['VOLUME'].rolling(window=lookback_days).mean()
+        df['volume_ratio'] = df['VOLUME'] / df['volume_sma']
+        
+        # Calculate volatility
+        df['volatility'] = df['CLOSE'].rolling(window=lookback_days).std() / df['CLOSE'].rolling(window=lookback_days).mean()
+        
+        # Determine if trend is up
+        trend_is_up = df['CLOSE'].iloc[-1] > df['CLOSE'].iloc[-5]  # Price higher than 5 days ago
+        
+        # Adaptive threshold based on market volatility
+        adaptive_threshold = threshold * (1 + df['volatility'].iloc[-1])
+        
+        # Calculate momentum score (weighted average of returns)
+        df['momentum_score'] = (df['returns_short'] * 0.5 + 
+                            df['returns_medium'] * 0.3 + 
+                            df['returns_long'] * 0.2)
+        
+        current_momentum = df['momentum_score'].iloc[-1]
+        current_volume_ratio = df['volume_ratio'].iloc[-1]
+        current_price = df['CLOSE'].iloc[-1]
+        if any([
+            # Condition 1: Strong momentum with decent volume
+            current_momentum > adaptive_threshold and current_volume_ratio > 1.0,
+            
+            # Condition 2: Very strong momentum even without volume confirmation
+            current_momentum > adaptive_threshold * 1.5,
+            
+            # Condition 3: Positive momentum with strong uptrend
+            current_momentum > 0 and trend_is_up and df['CLOSE'].iloc[-1] > df['SMA20'].iloc[-1]
+        ]):
+            # Calculate position size based on strength of signal
+            position_size = 0.05  # Base position size: 5% of portfolio
+            
+            # Increase position for stronger signals
+            if current_momentum > adaptive_threshold * 2:
+                position_size = 0.08  # Stronger signal: 8% of portfolio
+                
+            # Reduce position in high volatility
+            if df['volatility'].iloc[-1] > df['volatility'].rolling(window=lookback_days).mean().iloc[-1] * 1.2:
+                position_size *= 0.7  # Reduce by 30% in high volatility
+                
+            quantity = max(1, int(self.portfolio['cash'] * position_size / current_price))
+            logger.info(f"BUY SIGNAL: Purchasing {quantity} shares of {symbol}")
+            self.add_historical_transaction(symbol, quantity, "BUY", f"{current_date} 09:15:00")
+
+        # SELL SIGNALS
+        elif any([
+            # Condition 1: Strong negative momentum with volume confirmation
+            current_momentum < -adaptive_threshold and current_volume_ratio > 1.0,
+            
+            # Condition 2: Very strong negative momentum
+            current_momentum < -adaptive_threshold * 1.5,
+            
+            # Condition 3: Price below short-term moving average with negative momentum
+            current_momentum < 0 and df['CLOSE'].iloc[-1] < df['SMA20'].iloc[-1] and not trend_is_up
+        ]):
+            if symbol in self.portfolio['holdings']:
+                logger.info(f"SELL SIGNAL: Selling all shares of {symbol}")
+                self.add_historical_transaction(symbol, self.portfolio['holdings'][symbol]['quantity'], "SELL",
+                                            f"{current_date} 09:15:00")
+        
+        # Profit taking and stop-loss logic - more adaptive
+        elif symbol in self.portfolio['holdings']:
+            avg_price = self.portfolio['holdings'][symbol]['avg_price']
+            profit_pct = (current_price - avg_price) / avg_price
+            
+            # Adaptive profit taking based on volatility
+            profit_target = max(0.12, 0.10 * (1 + df['volatility'].iloc[-1]))  # Min 12% profit target
+            
+            # Adaptive stop-loss based on volatility
+            stop_loss = min(-0.05, -0.04 * (1 + df['volatility'].iloc[-1]))  # Max 5% loss
+            
+            # Take profits at target or cut losses at stop-loss
+            if profit_pct > profit_target or profit_pct < stop_loss:
+                logger.info(f"{'PROFIT TAKING' if profit_pct > 0 else 'STOP LOSS'}: Selling {symbol} at {profit_pct:.2%}")
+                self.add_historical_transaction(symbol, self.portfolio['holdings'][symbol]['quantity'], "SELL",
+                                            f"{current_date} 09:15:00")
+            
+            # Partial profit taking at smaller gains
+            elif profit_pct > profit_target * 0.7 and current_momentum < 0:
+                # Take partial profits if momentum is weakening
+                sell_quantity = max(1, self.portfolio['holdings'][symbol]['quantity'] // 2)
+                logger.info(f"PARTIAL PROFIT TAKING: Selling {sell_quantity} shares of {symbol} at {profit_pct:.2%}")
+                self.add_historical_transaction(symbol, sell_quantity, "SELL", f"{current_date} 09:15:00")
+
+    def bollinger_bands_strategy(self, symbol, current_date, window=20, num_std=2):
+        # Get historical data
+        # end_date = date.today()
+        end_date = current_date
+        start_date = end_date - timedelta(days=window * 2)
+        df = _stock_df(symbol, start_date, end_date)
+
+        if len(df) < window:
+            return
+        
+        df['MA'] = df['CLOSE'].rolling(window=window).mean()
+        df['STD'] = df['CLOSE'].rolling(window=window).std()
+        df['Upper'] = df['MA'] + (df['STD'] * num_std)
+        df['Lower'] = df['MA'] - (df['STD'] * num_std)
+
+        df['BB_Width'] = (df['Upper'] - df['Lower']) / df['MA']
+        df['%B'] = (df['CLOSE'] - df['Lower']) / (df['Upper'] - df['Lower'])
+        
+        # Calculate RSI for confirmation
+        delta = df['CLOSE'].diff()
+        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+        rs = gain / loss
+        df['RSI'] = 100 - (100 / (1 + rs))
+        
+        current_price = df['CLOSE'].iloc[-1]
+        prev_price = df['CLOSE'].iloc[-2]
+        
+        # Enhanced decision logic
+        if current_price < df['Lower'].iloc[-1] and df['RSI'].iloc[-1] < 30:
+            # Strong buy signal: price below lower band and oversold RSI
+            quantity = max(1, int(self.portfolio['cash'] * 0.05 / current_price))  # Use 5% of cash
+            self.add_historical_transaction(symbol, quantity, "BUY", f"{current_date} 09:15:00")
+            
+        elif current_price > df['Upper'].iloc[-1] and df['RSI'].iloc[-1] > 70:
+            # Strong sell signal: price above upper band and overbought RSI
+            if symbol in self.portfolio['holdings']:
+                self.add_historical_transaction(symbol, self.portfolio['holdings'][symbol]['quantity'], "SELL", 
+                                            f"{current_date} 09:15:00")
+        
+        # Mean reversion opportunity
+        elif df['%B'].iloc[-1] < 0.1 and df['%B'].iloc[-2] < df['%B'].iloc[-1] and df['BB_Width'].iloc[-1] > df['BB_Width'].rolling(window=20).mean().iloc[-1]:
+            # Price near lower band, starting to move up, and volatility is high
+            quantity = max(1, int(self.portfolio['cash'] * 0.03 / current_price))  # Use 3% of cash
+            self.add_historical_transaction(symbol, quantity, "BUY", f"{current_date} 09:15:00")
+        
+        # Take profit on strength
+        elif df['%B'].iloc[-1] > 0.9 and df['%B'].iloc[-2] > df['%B'].iloc[-1]:
+            # Price near upper band and starting to turn down
+            if symbol in self.portfolio['holdings']:
+                # Sell half position to lock in profits
+                sell_quantity = max(1, self.portfolio['holdings'][symbol]['quantity'] // 2)
+                self.add_historical_transaction(symbol, sell_quantity, "SELL", f"{current_date} 09:15:00")
+
+    def moving_average_crossover(self, symbol, start_date, short_window=50, long_window=200):
+        # Get historical data
+        end_date = start_date
+        start_date = end_date - timedelta(days=long_window * 2)
+        df = _stock_df(symbol, start_date, end_date)
+        # Debugging: Check DataFrame
+        if df.empty or 'CLOSE' not in df.columns:
+            logger.debug(f"Error: No 'CLOSE' column found or DataFrame is empty for {symbol}")
+            return
+
+        if not isinstance(short_window, int) or not isinstance(long_window,
+                                                               int) or short_window <= 0 or long_window <= 0:
+            logger.warning(f"Error: Invalid window sizes -> short_window: {short_window}, long_window: {long_window}")
+            return
+
+        if len(df) < long_window:
+            logger.debug(f"Not enough data for {symbol}. Required: {long_window}, Available: {len(df)}")
+            return
+
+        # Ensure 'CLOSE' is numeric
+        df['CLOSE'] = pd.to_numeric(df['CLOSE'], errors='coerce')
+
+        # Calculate MAs
+        df['SMA20'] = df['CLOSE'].rolling(window=20).mean()
+        df['SMA50'] = df['CLOSE'].rolling(window=short_window).mean()
+        df['SMA200'] = df['CLOSE'].rolling(window=long_window).mean()
+
+        df['EMA20'] = df['CLOSE'].ewm(span=20, adjust=False).mean()
+        df['EMA50'] = df['CLOSE'].ewm(span=short_window, adjust=False).mean()
+        
+        # Calculate MACD
+        df['MACD'] = df['EMA20'] - df['EMA50']
+        df['MACD_Signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
+        df['MACD_Hist'] = df['MACD'] - df['MACD_Signal']
+        
+        # Calculate volume indicators
+        df['Volume_SMA'] = df['VOLUME'].rolling(window=20).mean()
+
+        # Ensure enough non-null values exist
+        if df[['SMA50', 'SMA200']].isnull().all().iloc[-1]:
+            logger.debug(f"Insufficient data to compute moving averages for {symbol}")
+            return
+
+        # Generate signals
+        if (df['SMA50'].iloc[-2] < df['SMA200'].iloc[-2] and df['SMA50'].iloc[-1] > df['SMA200'].iloc[-1] and
+            df['MACD_Hist'].iloc[-1] > 0 and df['VOLUME'].iloc[-1] > df['Volume_SMA'].iloc[-1]):
+            
+            logger.info(f"Strong Golden Cross detected: Buying {symbol}")
+            position_size = 0.1  # 10% of portfolio
+            quantity = max(1, int(self.portfolio['cash'] * position_size / df['CLOSE'].iloc[-1]))
+            self.buy_stock(symbol, quantity, live=True)
+
+        # Death Cross with confirmation
+        elif (df['SMA50'].iloc[-2] > df['SMA200'].iloc[-2] and df['SMA50'].iloc[-1] < df['SMA200'].iloc[-1] and
+            df['MACD_Hist'].iloc[-1] < 0 and df['VOLUME'].iloc[-1] > df['Volume_SMA'].iloc[-1]):
+            
+            logger.info(f"Strong Death Cross detected: Selling {symbol}")
+            if symbol in self.portfolio['holdings']:
+                self.sell_stock(symbol, self.portfolio['holdings'][symbol]['quantity'], live=True)
+        
+        # Additional buy signal: Price above all MAs with increasing MACD
+        elif (df['CLOSE'].iloc[-1] > df['SMA20'].iloc[-1] > df['SMA50'].iloc[-1] and
+            df['MACD_Hist'].iloc[-1] > df['MACD_Hist'].iloc[-2] > 0):
+            
+            logger.info(f"Strong uptrend detected: Adding to position in {symbol}")
+            position_size = 0.05  # 5% of portfolio
+            quantity = max(1, int(self.portfolio['cash'] * position_size / df['CLOSE'].iloc[-1]))
+            self.buy_stock(symbol, quantity, live=True)
+        
+        # Take profit when price is extended above MAs
+        elif (symbol in self.portfolio['holdings'] and
+            df['CLOSE'].iloc[-1] > df['SMA20'].iloc[-1] * 1.1 and  # Price 10% above 20-day MA
+            df['MACD_Hist'].iloc[-1] < df['MACD_Hist'].iloc[-2]):  # MACD histogram decreasing
+            
+            logger.info(f"Taking profits on extended move: Selling portion of {symbol}")
+            sell_quantity = max(1, self.portfolio['holdings'][symbol]['quantity'] // 3)  # Sell 1/3 of position
+            self.sell_stock(symbol, sell_quantity, live=True)
+    def adaptive_multi_strategy(self, symbol, current_date):
+        """
+        Highly optimized adaptive strategy with dynamic parameters and advanced market regime detection
+        for maximum returns across different market conditions.
+        """
+        # Convert current_date to datetime.date if it's a datetime.datetime object
+        if isinstance(current_date, datetime):
+            current_date = current_date.date()
+            
+        # Get historical data (200 trading days ~ 10 months)
+        end_date = current_date
+        start_date = end_date - timedelta(days=250)
+        df = _stock_df(symbol, start_date, end_date)
         
         if len(df) < 30:  # Need at least 30 days of data
-            print(f"Insufficient data for {symbol}")
+            logger.debug(f"Insufficient data for {symbol}")
             return
             
         # Ensure data is properly formatted
         df['CLOSE'] = pd.to_numeric(df['CLOSE'], errors='coerce')
         df['VOLUME'] = pd.to_numeric(df['VOLUME'], errors='coerce')
         
-        # Print debug info
-        print(f"Date: {current_date}, Symbol: {symbol}")
+        logger.debug("Date: %s, Symbol: %s", current_date, symbol)
         
         # OPTIMIZATION 1: Dynamic parameter selection based on stock volatility
         # Calculate historical volatility to determine appropriate parameters
@@ -582,7 +2807,7 @@ class Simulation:
             atr_period = 5
             profit_take_pct = 0.04  # 4%
             stop_loss_pct = 0.03    # 3%
-            print(f"High volatility mode: {current_volatility:.2f}")
+            logger.debug(f"High volatility mode: {current_volatility:.2f}")
         elif current_volatility > 0.25:  # Medium volatility
             ma_short = 5
             ma_medium = 10
@@ -592,7 +2817,7 @@ class Simulation:
             atr_period = 7
             profit_take_pct = 0.05  # 5%
             stop_loss_pct = 0.04    # 4%
-            print(f"Medium volatility mode: {current_volatility:.2f}")
+            logger.debug(f"Medium volatility mode: {current_volatility:.2f}")
         else:  # Low volatility
             ma_short = 8
             ma_medium = 15
@@ -602,7 +2827,7 @@ class Simulation:
             atr_period = 10
             profit_take_pct = 0.07  # 7%
             stop_loss_pct = 0.05    # 5%
-            print(f"Low volatility mode: {current_volatility:.2f}")
+            logger.debug(f"Low volatility mode: {current_volatility:.2f}")
         
         # 1. Calculate trend indicators with dynamic parameters
         # Moving averages
@@ -675,11 +2900,12 @@ class Simulation:
         is_downtrend = (df['CLOSE'].iloc[-1] < df[f'SMA{ma_medium}'].iloc[-1]) and \
                     (df[f'SMA{ma_short}'].iloc[-1] < df[f'SMA{ma_medium}'].iloc[-1])
         
-        # Print market regime
-        print(f"ADX: {df['ADX'].iloc[-1]:.2f}, Market Regime: {'Strong Trend' if is_strong_trend else 'Weak Trend' if is_weak_trend else 'Ranging'}")
-        print(f"Trend Direction: {'Uptrend' if is_uptrend else 'Downtrend' if is_downtrend else 'Neutral'}")
-        if is_regime_transition:
-            print(f"REGIME TRANSITION DETECTED: ADX ROC = {df['ADX_ROC'].iloc[-1]:.2f}")
+        # Log market regime (skipped entirely unless debug logging is on)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"ADX: {df['ADX'].iloc[-1]:.2f}, Market Regime: {'Strong Trend' if is_strong_trend else 'Weak Trend' if is_weak_trend else 'Ranging'}")
+            logger.debug(f"Trend Direction: {'Uptrend' if is_uptrend else 'Downtrend' if is_downtrend else 'Neutral'}")
+            if is_regime_transition:
+                logger.debug(f"REGIME TRANSITION DETECTED: ADX ROC = {df['ADX_ROC'].iloc[-1]:.2f}")
         
         # OPTIMIZATION 3: Enhanced scoring system with dynamic weights
         # Adjust weights based on market regime
@@ -753,10 +2979,11 @@ class Simulation:
                         (volatility_score * volatility_weight) + \
                         (volume_score * volume_weight)
         
-        # Print scores
-        print(f"Composite Score: {composite_score:.2f}")
-        print(f"Trend: {trend_score} ({trend_weight:.2f}), Momentum: {momentum_score} ({momentum_weight:.2f}), "
-            f"Volatility: {volatility_score} ({volatility_weight:.2f}), Volume: {volume_score} ({volume_weight:.2f})")
+        # Log scores
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Composite Score: {composite_score:.2f}")
+            logger.debug(f"Trend: {trend_score} ({trend_weight:.2f}), Momentum: {momentum_score} ({momentum_weight:.2f}), "
+                f"Volatility: {volatility_score} ({volatility_weight:.2f}), Volume: {volume_score} ({volume_weight:.2f})")
         
         # OPTIMIZATION 4: Dynamic position sizing based on conviction and volatility
         # Calculate position size based on volatility and signal strength
@@ -806,7 +3033,7 @@ class Simulation:
                 last_buy_date = datetime.strptime(recent_buys[-1]['timestamp'], "%Y-%m-%d %H:%M:%S").date()
                 days_held = (current_date - last_buy_date).days
                 recent_buy = days_held < min_holding_days
-                print(f"Holding {symbol} for {days_held} days (min: {min_holding_days})")
+                logger.debug(f"Holding {symbol} for {days_held} days (min: {min_holding_days})")
         else:
             # Check if we recently sold to avoid immediate repurchase
             recent_sells = [t for t in self.portfolio['transactions'] 
@@ -816,7 +3043,7 @@ class Simulation:
                 days_since_sell = (current_date - last_sell_date).days
                 recent_sell = days_since_sell < min_wait_after_sell
                 if recent_sell:
-                    print(f"Recently sold {symbol}, waiting {min_wait_after_sell - days_since_sell} more days before buying")
+                    logger.debug(f"Recently sold {symbol}, waiting {min_wait_after_sell - days_since_sell} more days before buying")
         
         # OPTIMIZATION 6: Market regime-specific entry/exit thresholds
         # Set thresholds based on market regime
@@ -841,33 +3068,33 @@ class Simulation:
         if is_strong_trend and is_uptrend:
             if composite_score > buy_threshold and not recent_sell and not recent_buy:
                 buy_signal = True
-                print(f"Strong uptrend BUY signal for {symbol} with score {composite_score:.2f} > {buy_threshold}")
+                logger.info(f"Strong uptrend BUY signal for {symbol} with score {composite_score:.2f} > {buy_threshold}")
         
         elif is_ranging:
             if composite_score > buy_threshold and df['%B'].iloc[-1] < 0.4 and not recent_sell and not recent_buy:
                 buy_signal = True
-                print(f"Range market BUY signal for {symbol} with score {composite_score:.2f} > {buy_threshold}")
+                logger.info(f"Range market BUY signal for {symbol} with score {composite_score:.2f} > {buy_threshold}")
         
         elif is_weak_trend and is_uptrend:
             if composite_score > buy_threshold and not recent_sell and not recent_buy:
                 buy_signal = True
-                print(f"Weak uptrend BUY signal for {symbol} with score {composite_score:.2f} > {buy_threshold}")
+                logger.info(f"Weak uptrend BUY signal for {symbol} with score {composite_score:.2f} > {buy_threshold}")
         
         # ADDITIONAL BUY CONDITIONS - With dynamic parameters
         # Buy on RSI oversold condition
         if df['RSI'].iloc[-1] < 35 and df['RSI'].iloc[-1] > df['RSI'].iloc[-2] and not recent_sell and not recent_buy:
             buy_signal = True
-            print(f"RSI oversold BUY signal for {symbol} with RSI {df['RSI'].iloc[-1]:.2f}")
+            logger.info(f"RSI oversold BUY signal for {symbol} with RSI {df['RSI'].iloc[-1]:.2f}")
         
         # Buy on Bollinger Band bounce
         if df['%B'].iloc[-1] < 0.2 and df['%B'].iloc[-1] > df['%B'].iloc[-2] and not recent_sell and not recent_buy:
             buy_signal = True
-            print(f"Bollinger Band bounce BUY signal for {symbol} with %B {df['%B'].iloc[-1]:.2f}")
+            logger.info(f"Bollinger Band bounce BUY signal for {symbol} with %B {df['%B'].iloc[-1]:.2f}")
         
         # Buy on volume spike with price increase
         if df['Volume_Ratio'].iloc[-1] > 1.5 and df['CLOSE'].iloc[-1] > df['CLOSE'].iloc[-2] and not recent_sell and not recent_buy:
             buy_signal = True
-            print(f"Volume spike BUY signal for {symbol} with volume ratio {df['Volume_Ratio'].iloc[-1]:.2f}")
+            logger.info(f"Volume spike BUY signal for {symbol} with volume ratio {df['Volume_Ratio'].iloc[-1]:.2f}")
         
         # OPTIMIZATION 7: Sector and market trend awareness
         # This would require additional data, but conceptually:
@@ -892,28 +3119,28 @@ class Simulation:
                 if is_strong_trend and is_downtrend:
                     if composite_score < sell_threshold:
                         sell_signal = True
-                        print(f"Strong downtrend SELL signal for {symbol} with score {composite_score:.2f} < {sell_threshold}")
+                        logger.info(f"Strong downtrend SELL signal for {symbol} with score {composite_score:.2f} < {sell_threshold}")
                 
                 elif is_ranging:
                     if composite_score < sell_threshold and df['%B'].iloc[-1] > 0.6:
                         sell_signal = True
-                        print(f"Range market SELL signal for {symbol} with score {composite_score:.2f} < {sell_threshold}")
+                        logger.info(f"Range market SELL signal for {symbol} with score {composite_score:.2f} < {sell_threshold}")
                 
                 elif is_weak_trend and is_downtrend:
                     if composite_score < sell_threshold:
                         sell_signal = True
-                        print(f"Weak downtrend SELL signal for {symbol} with score {composite_score:.2f} < {sell_threshold}")
+                        logger.info(f"Weak downtrend SELL signal for {symbol} with score {composite_score:.2f} < {sell_threshold}")
             
             # ADDITIONAL SELL CONDITIONS - With dynamic parameters
             # Sell on RSI overbought condition
             if df['RSI'].iloc[-1] > 70 and df['RSI'].iloc[-1] < df['RSI'].iloc[-2] and days_held >= min_holding_days:
                 sell_signal = True
-                print(f"RSI overbought SELL signal for {symbol} with RSI {df['RSI'].iloc[-1]:.2f}")
+                logger.info(f"RSI overbought SELL signal for {symbol} with RSI {df['RSI'].iloc[-1]:.2f}")
             
             # Sell on Bollinger Band upper touch
             if df['%B'].iloc[-1] > 0.8 and df['%B'].iloc[-1] < df['%B'].iloc[-2] and days_held >= min_holding_days:
                 sell_signal = True
-                print(f"Bollinger Band upper SELL signal for {symbol} with %B {df['%B'].iloc[-1]:.2f}")
+                logger.info(f"Bollinger Band upper SELL signal for {symbol} with %B {df['%B'].iloc[-1]:.2f}")
             
             # Execute sell if signal is triggered
             if sell_signal:
@@ -931,17 +3158,17 @@ class Simulation:
             # Take partial profits at dynamic threshold
             if profit_pct > partial_profit_threshold:
                 sell_quantity = max(1, self.portfolio['holdings'][symbol]['quantity'] // 2)
-                print(f"Taking partial profits on {symbol} at {profit_pct:.2%} gain (threshold: {partial_profit_threshold:.2%})")
+                logger.info(f"Taking partial profits on {symbol} at {profit_pct:.2%} gain (threshold: {partial_profit_threshold:.2%})")
                 self.add_historical_transaction(symbol, sell_quantity, "SELL", f"{current_date} 09:15:00")
             
             # Take full profits at dynamic threshold
             if profit_pct > full_profit_threshold:
-                print(f"Taking full profits on {symbol} at {profit_pct:.2%} gain (threshold: {full_profit_threshold:.2%})")
+                logger.info(f"Taking full profits on {symbol} at {profit_pct:.2%} gain (threshold: {full_profit_threshold:.2%})")
                 self.add_historical_transaction(symbol, self.portfolio['holdings'][symbol]['quantity'], "SELL", f"{current_date} 09:15:00")
             
             # Dynamic stop loss based on volatility
             if profit_pct < -stop_loss_pct:
-                print(f"Stop loss triggered on {symbol} at {profit_pct:.2%} loss (threshold: {-stop_loss_pct:.2%})")
+                logger.info(f"Stop loss triggered on {symbol} at {profit_pct:.2%} loss (threshold: {-stop_loss_pct:.2%})")
                 self.add_historical_transaction(symbol, self.portfolio['holdings'][symbol]['quantity'], "SELL", f"{current_date} 09:15:00")
             
             # Dynamic trailing stop loss
@@ -952,7 +3179,7 @@ class Simulation:
                 trailing_stop = avg_price * (1 + profit_pct * trail_percentage)
                 
                 if current_price < trailing_stop:
-                    print(f"Trailing stop triggered on {symbol} at {profit_pct:.2%} profit (trail %: {trail_percentage:.2f})")
+                    logger.info(f"Trailing stop triggered on {symbol} at {profit_pct:.2%} profit (trail %: {trail_percentage:.2f})")
                     self.add_historical_transaction(symbol, self.portfolio['holdings'][symbol]['quantity'], "SELL", f"{current_date} 09:15:00")
     def _calculate_adx(self, df, period=14):
         """Helper method to calculate Average Directional Index (ADX)"""
@@ -975,179 +3202,2127 @@ class Simulation:
         df['ADX'] = df['ADX'].fillna(20)
         return df['ADX']
     def run_backtest(self, strategy, symbol, start_date, end_date):
-        # Initialize with proper price history structure
-        self.portfolio['price_history'] = {}
         initial_cash = self.portfolio['cash']
+        strategy_name = getattr(strategy, '__name__', 'strategy')
+
+        # Convert dates
+        if isinstance(start_date, str):
+            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+        if isinstance(end_date, str):
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+
+        # Only real NSE sessions are visited; weekends and holidays never hit the
+        # network. Closes for every session come from one bar-store lookup.
+        session_days = TRADING_CALENDAR.session_days(start_date, end_date) \
+            if start_date <= end_date else np.empty(0, dtype=np.int32)
+        BAR_STORE.ensure(symbol, start_date, end_date)
+        session_closes = BAR_STORE.closes_on(symbol, [date.fromordinal(int(d) + EPOCH_ORDINAL)
+                                                      for d in session_days])
+
+        # Daily equity curve, preallocated for every session in the range and
+        # trimmed to the sessions that actually had data at the end
+        capacity = len(session_days)
+        curve_days = np.empty(capacity, dtype=np.int32)
+        closes = np.empty(capacity, dtype=np.float64)
+        equity = np.empty(capacity, dtype=np.float64)
+        invested = np.empty(capacity, dtype=np.float64)
+        traded = np.empty(capacity, dtype=np.float64)
+        last_close = {}
+        n = 0
+
+        for day, price in zip(session_days.tolist(), session_closes.tolist()):
+            current_date = date.fromordinal(day + EPOCH_ORDINAL)
+            if np.isnan(price):
+                logger.debug(f"No price data for {symbol} on {current_date}")
+                continue
+
+            n_transactions = len(self.portfolio['transactions'])
+            with METRICS.timer('quarks_strategy_seconds', strategy=strategy_name):
+                strategy(symbol, current_date)
+
+            last_close[symbol] = price
+            notional = 0.0
+            for t in self.portfolio['transactions'][n_transactions:]:
+                notional += t['price'] * t['quantity']
+                last_close[t['symbol']] = t['price']
+
+            holdings_value = sum(h['quantity'] * last_close.get(s, h['avg_price'])
+                                 for s, h in self.portfolio['holdings'].items())
+            curve_days[n] = day
+            closes[n] = price
+            invested[n] = holdings_value
+            equity[n] = self.portfolio['cash'] + holdings_value
+            traded[n] = notional
+            n += 1
+
+        curve_days, closes = curve_days[:n], closes[:n]
+        equity, invested, traded = equity[:n], invested[:n], traded[:n]
+        self.portfolio['price_history'] = {'days': curve_days, 'close': closes}
+
+        # Debug: Show collected price history
+        logger.debug(f"Collected {n} price points")
+
+        # Final value comes straight off the equity curve (no extra price fetches)
+        final_value = equity[-1] if n else self.portfolio['cash']
+        self.portfolio['return'] = (final_value - initial_cash) / initial_cash
+        metrics = compute_performance_metrics(curve_days, equity, invested, traded)
+        self.portfolio['metrics'] = metrics
+
+        # Generate plot
+        image_path = self.plot_backtest_results(symbol)
+        if image_path:
+            if 'performance_images' not in self.portfolio:
+                self.portfolio['performance_images'] = []
+            self.portfolio['performance_images'].append(image_path)
+
+        return {
+            'return': self.portfolio['return'],
+            'metrics': metrics,
+            'equity_curve': columnar_series(curve_days, equity, 'equity'),
+            'transactions': self.portfolio['transactions'],
+            'graph_path': image_path,
+            'price_history': columnar_series(curve_days, closes, 'close')
+        }
+
+    def run_portfolio_backtest(self, strategy, symbols, start_date, end_date,
+                               warmup_days=PANEL_WARMUP_DAYS, panel=None):
+        """
+        Event-driven backtest of many symbols sharing this simulation's cash and holdings.
+
+        Parameters:
+            strategy (callable): Called once per session as strategy(ctx) with a BacktestContext
+            symbols (list): Universe of stock symbols
+            start_date (str/date): First session (YYYY-MM-DD)
+            end_date (str/date): Last session (YYYY-MM-DD)
+            warmup_days (int): Calendar days of history preloaded before start_date for indicators
+            panel (PricePanel): Preloaded panel to reuse instead of loading one from the bar store
+
+        Returns:
+            dict: Return, performance metrics, equity curve, transactions and final holdings
+        """
+        initial_cash = self.portfolio['cash']
+        strategy_name = getattr(strategy, '__name__', 'strategy')
+        if isinstance(start_date, str):
+            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+        if isinstance(end_date, str):
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+
+        if panel is None:
+            panel = load_price_panel(symbols, start_date - timedelta(days=warmup_days), end_date)
+        rows = panel.rows_between(start_date, end_date)
+        ctx = BacktestContext(self, panel)
+
+        curve_days = panel.days[rows]
+        n = len(curve_days)
+        equity = np.empty(n, dtype=np.float64)
+        invested = np.empty(n, dtype=np.float64)
+        traded = np.empty(n, dtype=np.float64)
+
+        # Sessions are the merged, date-ordered bar streams of every symbol
+        for k, i in enumerate(range(rows.start, rows.stop)):
+            ctx._advance(i)
+            traded_before = ctx.traded
+            with METRICS.timer('quarks_strategy_seconds', strategy=strategy_name):
+                strategy(ctx)
+            invested[k] = ctx.holdings_value()
+            equity[k] = self.portfolio['cash'] + invested[k]
+            traded[k] = ctx.traded - traded_before
+
+        final_value = equity[-1] if n else self.portfolio['cash']
+        self.portfolio['return'] = (final_value - initial_cash) / initial_cash
+        metrics = compute_performance_metrics(curve_days, equity, invested, traded)
+        self.portfolio['metrics'] = metrics
+        self._log(f"Portfolio backtest of {len(panel.symbols)} symbols over {n} sessions: "
+                  f"return {self.portfolio['return']:.2%}")
+
+        return {
+            'return': self.portfolio['return'],
+            'metrics': metrics,
+            'symbols': panel.symbols,
+            'equity_curve': columnar_series(curve_days, equity, 'equity'),
+            'transactions': self.portfolio['transactions'],
+            'holdings': self.portfolio['holdings'],
+            'cash': self.portfolio['cash']
+        }
+
+    def equal_weight_strategy(self, ctx, rebalance_every=21):
+        """Portfolio strategy: hold every tradable symbol at equal weight, rebalancing monthly"""
+        if ctx.step % rebalance_every:
+            return
+        tradable = [symbol for symbol, ok in zip(ctx.symbols, ctx.tradable) if ok]
+        if tradable:
+            ctx.rebalance({symbol: 1.0 / len(tradable) for symbol in tradable})
+
+    def momentum_rotation_strategy(self, ctx, lookback=126, top_n=5, rebalance_every=21):
+        """Portfolio strategy: rotate into the top_n symbols by trailing return (positive only)"""
+        if ctx.step % rebalance_every:
+            return
+        momentum = ctx.trailing_return(lookback)
+        eligible = ~np.isnan(momentum) & ctx.tradable & (momentum > 0)
+        ranked = np.argsort(np.where(eligible, -momentum, np.inf))[:top_n]
+        chosen = [ctx.symbols[j] for j in ranked if eligible[j]]
+        ctx.rebalance({symbol: 1.0 / len(chosen) for symbol in chosen} if chosen else {})
+
+    @METRICS.timed('quarks_plot_seconds')
+    def plot_backtest_results(self, symbol):
+        """Plot price history with buy/sell signals"""
+        days, prices = price_history_arrays(self.portfolio.get('price_history'))
+        if not len(days):
+            logger.debug("No price history in portfolio: %s", list(self.portfolio.keys()))
+            return None
+
+        try:
+            # Epoch days are already sorted; matplotlib plots datetime64 directly
+            dates = days.astype('datetime64[D]')
+
+            plt.figure(figsize=(14, 7))
+            plt.plot(dates, prices, label='Price', color='royalblue', linewidth=2)
+
+            # Plot transactions if they exist
+            if 'transactions' in self.portfolio:
+                for t in self.portfolio['transactions']:
+                    try:
+                        trans_date = datetime.strptime(t['timestamp'], "%Y-%m-%d %H:%M:%S").date()
+                        trans_type = t['type']
+                        price = t['price']
 
-        # Convert dates
-        if isinstance(start_date, str):
-            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-        if isinstance(end_date, str):
-            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+                        if trans_type == 'BUY':
+                            plt.scatter(trans_date, price, color='limegreen', marker='^',
+                                        s=150, edgecolors='black', label='Buy')
+                        elif trans_type == 'SELL':
+                            plt.scatter(trans_date, price, color='crimson', marker='v',
+                                        s=150, edgecolors='black', label='Sell')
+                    except Exception as e:
+                        logger.error(f"Error plotting transaction: {e}")
+                        continue
 
-        current_date = start_date
-        while current_date <= end_date:
-            if current_date.weekday() < 5:  # Skip weekends
-                date_str = current_date.strftime("%Y-%m-%d")
-                price = get_historical_price(symbol, date_str)
-                if price is not None:
-                    # Store as string date to avoid serialization issues
-                    self.portfolio['price_history'][date_str] = price
-                    strategy(symbol, current_date)
-                else:
-                    print(f"No price data for {symbol} on {date_str}")
-            current_date += timedelta(days=1)
+            plt.title(f"{symbol} Trading Performance")
+            plt.xlabel('Date')
+            plt.ylabel('Price ()')
+            plt.grid(True, linestyle='--', alpha=0.7)
+            plt.legend()
 
-        # Debug: Show collected price history
-        print(f"\nCollected {len(self.portfolio['price_history'])} price points")
-        print("Sample prices:", dict(list(self.portfolio['price_history'].items())[:3]))
+            # Format dates
+            plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+            plt.gcf().autofmt_xdate()
 
-        # Calculate returns
-        final_value = self.portfolio['cash']
-        for s, h in self.portfolio['holdings'].items():
-            last_price = get_historical_price(s, end_date.strftime("%Y-%m-%d"))
-            if last_price:
-                final_value += last_price * h['quantity']
+            # Save image
+            os.makedirs('static/graphs', exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            image_path = f"static/graphs/{self.name}_{symbol}_{timestamp}.png"
+            plt.savefig(image_path)
+            plt.close()
 
-        self.portfolio['return'] = (final_value - initial_cash) / initial_cash
+            return image_path
 
-        # Generate plot
-        image_path = self.plot_backtest_results(symbol)
-        if image_path:
-            if 'performance_images' not in self.portfolio:
-                self.portfolio['performance_images'] = []
-            self.portfolio['performance_images'].append(image_path)
+        except Exception as e:
+            logger.error(f"Error in plot_backtest_results: {e}")
+            return None
+
+
+################################## PART 1 : STRATEGIES; UNCOMMENT THE BELOW PART TO TRY STRATEGIES. SWITCH THE STRATEGY TO ALL AVAILABLE ONES TO CHECK THEM ########################################3
+
+
+"""
+
+simobject = Simulation("main1",20000)
+
+results = simobject.run_backtest(
+    strategy=simobject.bollinger_bands_strategy,
+    symbol="TCS",
+    start_date="2023-01-01",
+    end_date="2023-12-31",
+)
+
+print(f"Strategy Return: {results['return']*100:.2f}%")
+
+for transaction in results['transactions']:
+    print(transaction)
+
+
+"""
+
+
+############################################
+
+########## Shared-memory handoff ###################
+# Process-pool runners publish their preloaded arrays once in a shared-memory
+# block; what gets pickled to each worker is only the block's name and layout,
+# and workers attach read-only views without copying.
+SHARED_ALIGNMENT = 64
+
+
+def _attach_shared_arrays(name, layout):
+    shared = SharedArrays.__new__(SharedArrays)
+    shared.shm = shared_memory.SharedMemory(name=name)
+    shared.layout = layout
+    shared.owner = False
+    return shared
+
+
+class SharedArrays:
+    """Named NumPy arrays laid out in one shared-memory block; pickles as a handle to it"""
+
+    def __init__(self, arrays):
+        layout, offset = [], 0
+        arrays = {key: np.ascontiguousarray(values) for key, values in arrays.items()}
+        for key, values in arrays.items():
+            offset = -(-offset // SHARED_ALIGNMENT) * SHARED_ALIGNMENT
+            layout.append((key, values.dtype.str, values.shape, offset))
+            offset += values.nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.layout = layout
+        self.owner = True
+        for (key, _, _, _), view in zip(layout, self.arrays().values()):
+            view[...] = arrays[key]
+
+    def arrays(self):
+        """
+        {key: ndarray view into the block} (read-only outside the owning process).
+        The views do not keep the block mapped; hold on to this object while using them.
+        """
+        views = {}
+        for key, dtype, shape, offset in self.layout:
+            view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.shm.buf, offset=offset)
+            view.flags.writeable = self.owner
+            views[key] = view
+        return views
+
+    def attach(self):
+        """A read-only attachment to the same block (what a worker process should use)"""
+        return _attach_shared_arrays(self.shm.name, self.layout)
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # views are still alive; the mapping goes when they do
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __reduce__(self):
+        return _attach_shared_arrays, (self.shm.name, self.layout)
+
+
+def _attach_shared_panel(name, layout, symbols, source):
+    shared = _attach_shared_arrays(name, layout)
+    arrays = shared.arrays()
+    if source is not None:
+        panel = _open_mapped_panel(*source)
+    else:
+        panel = PricePanel(arrays['days'], symbols, *(arrays[field] for field in BAR_COLUMN_FIELDS))
+    panel._indicators.update((key[1], values) for key, values in arrays.items()
+                             if isinstance(key, tuple) and key[0] == 'indicator')
+    panel._filled_close = arrays.get('filled_close')
+    panel._shared = shared  # the block stays attached as long as the panel lives
+    return panel
+
+
+class SharedPanel(SharedArrays):
+    """
+    A PricePanel published for process-pool workers: unpickles as a PricePanel
+    over the shared block, with every indicator already computed in the parent.
+
+    Panels from the columnar store keep their bars in the memory-mapped files
+    and only the computed indicators go into shared memory.
+    """
+
+    def __init__(self, panel):
+        self.symbols = panel.symbols
+        self.source = panel.source if isinstance(panel, MappedPricePanel) else None
+        arrays = {}
+        if self.source is None:
+            arrays['days'] = panel.days
+            arrays.update((field, getattr(panel, field)) for field in BAR_COLUMN_FIELDS)
+        arrays.update((('indicator', key), values) for key, values in panel._indicators.items())
+        if panel._filled_close is not None:
+            arrays['filled_close'] = panel._filled_close
+        super().__init__(arrays)
+
+    def attach(self):
+        return _attach_shared_panel(self.shm.name, self.layout, self.symbols, self.source)
+
+    def __reduce__(self):
+        return _attach_shared_panel, (self.shm.name, self.layout, self.symbols, self.source)
+
+
+########## Walk-forward analysis ###################
+WALK_FORWARD_WORKERS = max(1, min(8, os.cpu_count() or 1))
+WALK_FORWARD_PARALLEL_MIN_SECONDS = 2.0  # below this much estimated work a pool costs more than it saves
+WALK_FORWARD_MAX_WINDOWS = 500
+# Pools are started from request threads while other threads (pollers, the
+# profiler, metrics) may hold locks, so workers never fork from this process:
+# they come from a clean forkserver (spawn where that is unavailable).
+PROCESS_POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+if PROCESS_POOL_CONTEXT.get_start_method() == 'forkserver' and __name__ != '__main__':
+    PROCESS_POOL_CONTEXT.set_forkserver_preload([__name__])
+PROCESS_POOLS_AT_ONCE = 1  # one pool at a time rather than one per concurrent request
+PROCESS_POOL_SLOT_WAIT = 1.0  # seconds to wait for a free slot before running in-process instead
+_process_pool_slots = threading.BoundedSemaphore(PROCESS_POOLS_AT_ONCE)
+DISTRIBUTION_PERCENTILES = (5, 25, 50, 75, 95)
+_worker_panel = None  # panel handed to process-pool workers once, at start-up
+_worker_arrays = None  # SharedArrays attached by process-pool workers at start-up
+
+
+def _process_pool(max_workers, initializer, initargs):
+    """A process pool on PROCESS_POOL_CONTEXT (take a _process_pool_slots slot first, with a timeout)"""
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=PROCESS_POOL_CONTEXT,
+                               initializer=initializer, initargs=initargs)
+
+
+def _init_panel_worker(panel):
+    global _worker_panel
+    # A pickled SharedPanel arrives already attached; attach() covers one passed by reference
+    _worker_panel = panel.attach() if isinstance(panel, SharedPanel) else panel
+
+
+def _run_panel_window(strategy_name, cash, start_day, end_day, panel=None):
+    """Run one portfolio-backtest window against a preloaded panel; returns its metrics"""
+    panel = panel if panel is not None else _worker_panel
+    start = date.fromordinal(start_day + EPOCH_ORDINAL)
+    end = date.fromordinal(end_day + EPOCH_ORDINAL)
+    simulation = Simulation(f"window {start}", cash)
+    result = simulation.run_portfolio_backtest(getattr(simulation, strategy_name), panel.symbols,
+                                               start, end, panel=panel)
+    return dict(result['metrics'], start=str(start), end=str(end),
+                trades=len(result['transactions']), **{'return': float(result['return'])})
+
+
+def summarize_distribution(values, percentiles=DISTRIBUTION_PERCENTILES):
+    """Mean/std/min/max and percentiles of a metric, ignoring None/NaN"""
+    arr = np.array([v for v in values if v is not None], dtype=np.float64)
+    arr = arr[~np.isnan(arr)]
+    if not len(arr):
+        return {'count': 0}
+    summary = {'count': int(len(arr)), 'mean': float(arr.mean()),
+               'std': float(arr.std(ddof=1)) if len(arr) > 1 else 0.0,
+               'min': float(arr.min()), 'max': float(arr.max())}
+    summary.update({f'p{p}': float(v) for p, v in zip(percentiles, np.percentile(arr, percentiles))})
+    return summary
+
+
+def walk_forward_backtest(strategy_name, symbols, start_date, end_date, window_sessions=252,
+                          step_sessions=21, cash=100000, workers=WALK_FORWARD_WORKERS,
+                          warmup_days=PANEL_WARMUP_DAYS):
+    """
+    Rolling-window (walk-forward) portfolio backtests over one preloaded panel.
+
+    History for the whole span is loaded once and indicators are computed
+    once over it: the first window runs in-process and warms the panel's
+    indicator cache, then the remaining windows run in parallel against that
+    same panel, so sliding forward never recomputes anything. The pool is
+    only used when the first window's timing says the rest is worth it.
+
+    Parameters:
+        strategy_name (str): Simulation portfolio strategy method, e.g. 'momentum_rotation_strategy'
+        symbols (list): Universe of stock symbols
+        start_date (str/date): First session of the first window
+        end_date (str/date): Last session considered
+        window_sessions (int): Sessions per window
+        step_sessions (int): Sessions between consecutive window starts
+        cash (float): Starting cash for every window
+        workers (int): Worker processes (1 runs everything in-process)
+
+    At most WALK_FORWARD_MAX_WINDOWS windows are run; a longer range needs a larger step.
+
+    Returns:
+        dict: Per-window metrics and the distribution of each metric across windows
+    """
+    if not callable(getattr(Simulation, strategy_name, None)):
+        raise ValueError(f"Unknown strategy {strategy_name}")
+    if window_sessions < 2 or step_sessions < 1:
+        raise ValueError("window_sessions must be >= 2 and step_sessions >= 1")
+    start_day, end_day = TradingCalendar._to_day(start_date), TradingCalendar._to_day(end_date)
+    panel = load_price_panel(symbols, date.fromordinal(start_day + EPOCH_ORDINAL - warmup_days),
+                             date.fromordinal(end_day + EPOCH_ORDINAL))
+    rows = panel.rows_between(start_date, end_date)
+    starts = list(range(rows.start, rows.stop - window_sessions + 1, step_sessions))
+    if not starts:
+        raise ValueError(f"Range has {rows.stop - rows.start} sessions, fewer than one window")
+    if len(starts) > WALK_FORWARD_MAX_WINDOWS:
+        raise ValueError(f"{len(starts)} windows requested; at most {WALK_FORWARD_MAX_WINDOWS} "
+                         f"(increase step_sessions to at least "
+                         f"{-(-(rows.stop - rows.start - window_sessions + 1) // WALK_FORWARD_MAX_WINDOWS)})")
+    first_days = [int(panel.days[s]) for s in starts]
+    last_days = [int(panel.days[s + window_sessions - 1]) for s in starts]
+
+    started = time.perf_counter()
+    results = [_run_panel_window(strategy_name, cash, first_days[0], last_days[0], panel=panel)]
+    estimated = (time.perf_counter() - started) * (len(starts) - 1)
+    run_window = functools.partial(_run_panel_window, strategy_name, cash)
+    remaining = (first_days[1:], last_days[1:])
+    rest = None
+    # A busy pool slot means another request is using the workers; run in-process rather than queue
+    if len(starts) > 1 and workers > 1 and estimated >= WALK_FORWARD_PARALLEL_MIN_SECONDS \
+            and _process_pool_slots.acquire(timeout=PROCESS_POOL_SLOT_WAIT):
+        try:
+            n_workers = min(workers, len(starts) - 1)
+            # Workers attach to the panel (and the indicators the first window computed) zero-copy
+            with SharedPanel(panel) as shared, _process_pool(n_workers, _init_panel_worker, (shared,)) as pool:
+                rest = list(pool.map(run_window, *remaining,
+                                     chunksize=max(1, (len(starts) - 1) // (n_workers * 4))))
+        except (OSError, BrokenProcessPool) as e:
+            logger.warning(f"Process pool unavailable ({e}); running windows in-process")
+        finally:
+            _process_pool_slots.release()
+    if rest is None:
+        rest = [run_window(a, b, panel=panel) for a, b in zip(*remaining)]
+    results += rest
+
+    return {
+        'strategy': strategy_name,
+        'symbols': panel.symbols,
+        'window_sessions': window_sessions,
+        'step_sessions': step_sessions,
+        'windows': results,
+        'distribution': {key: summarize_distribution([w[key] for w in results])
+                         for key in ('return', 'cagr', 'sharpe', 'sortino', 'max_drawdown',
+                                     'volatility', 'exposure', 'turnover')}
+    }
+
+
+########## Monte Carlo robustness ###################
+MONTE_CARLO_MAX_PATHS = 20000
+MONTE_CARLO_CHUNK_PATHS = 500
+MONTE_CARLO_PARALLEL_MIN_CELLS = 2_000_000  # paths x sessions below which one process is faster
+
+
+def _hold_between(entries, exits):
+    """Exposure of 1 from each entry until the next exit (exits win ties), along axis 0"""
+    events = np.where(exits, 0.0, np.where(entries, 1.0, np.nan))
+    return np.nan_to_num(forward_fill(events), nan=0.0)
+
+
+def vector_positions(strategy, close):
+    """
+    Target exposure (0..1) per session for a dates x paths close matrix.
+
+    Array versions of the single-symbol strategies' core rules, so thousands
+    of price paths can be evaluated at once.
+    """
+    with np.errstate(invalid='ignore'):
+        if strategy == 'buy_and_hold':
+            return np.ones(close.shape)
+        if strategy == 'momentum':
+            momentum = trailing_return(close, 14)
+            return _hold_between(momentum > 0.05, momentum < -0.05)
+        if strategy == 'bollinger':
+            mean, std = rolling_mean(close, 20), rolling_std(close, 20)
+            return _hold_between(close < mean - 2 * std, close > mean + 2 * std)
+        if strategy == 'ma_crossover':
+            return (rolling_mean(close, 50) > rolling_mean(close, 200)).astype(np.float64)
+    raise ValueError(f"Unknown vector strategy {strategy}")
+
+
+def _path_outcomes(close, positions, costs, eval_start):
+    """Total return, max drawdown and Sharpe of each column from eval_start on"""
+    asset = close[eval_start + 1:] / close[eval_start:-1] - 1
+    held = positions[eval_start:-1]
+    trades = np.diff(positions[eval_start:], axis=0)
+    daily = held * asset - costs(trades)
+    equity = np.cumprod(1 + daily, axis=0)
+    peak = np.maximum.accumulate(np.vstack([np.ones((1, equity.shape[1])), equity]), axis=0)[1:]
+    drawdown = (equity / peak - 1).min(axis=0)
+    std = daily.std(axis=0, ddof=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = np.where(std > 0, daily.mean(axis=0) / std * np.sqrt(TRADING_DAYS_PER_YEAR), np.nan)
+    return equity[-1] - 1, drawdown, sharpe
+
+
+def _init_arrays_worker(shared):
+    global _worker_arrays
+    # Keep the attachment itself: its views are only valid while it is alive
+    _worker_arrays = shared.attach() if shared.owner else shared
+
+
+def _monte_carlo_chunk(strategy, close, mode, n_paths, seed, block_size, slippage, price_noise, eval_start):
+    """Simulate one chunk of paths; returns (returns, drawdowns, sharpes) arrays"""
+    close = close if close is not None else _worker_arrays.arrays()['close']
+    rng = np.random.default_rng(seed)
+    if mode == 'bootstrap':
+        # Fixed-length block bootstrap of log returns keeps short-range autocorrelation
+        log_returns = np.diff(np.log(close))
+        n = len(log_returns)
+        block_size = min(block_size, n)
+        n_blocks = -(-n // block_size)
+        starts = rng.integers(0, n - block_size + 1, size=(n_blocks, n_paths))
+        idx = (starts[:, None, :] + np.arange(block_size)[None, :, None]).reshape(-1, n_paths)[:n]
+        paths = close[0] * np.exp(np.vstack([np.zeros((1, n_paths)), np.cumsum(log_returns[idx], axis=0)]))
+        positions = vector_positions(strategy, paths)
+        return _path_outcomes(paths, positions, lambda trades: np.abs(trades) * slippage, eval_start)
+
+    # Perturb: the historical path, but every fill lands at a noisy price and pays slippage
+    paths = close[:, None]
+    positions = vector_positions(strategy, paths)
+    noise = rng.normal(0.0, price_noise, size=(len(close) - eval_start - 1, n_paths))
+    returns, drawdowns, sharpes = _path_outcomes(
+        np.broadcast_to(paths, (len(close), n_paths)), np.broadcast_to(positions, (len(close), n_paths)),
+        lambda trades: trades * noise + np.abs(trades) * slippage, eval_start)
+    return returns, drawdowns, sharpes
+
+
+def monte_carlo_backtest(symbol, strategy, start_date, end_date, paths=1000, mode='bootstrap',
+                         block_size=20, slippage_bps=5.0, price_noise_bps=25.0, seed=None,
+                         workers=WALK_FORWARD_WORKERS, warmup_days=PANEL_WARMUP_DAYS):
+    """
+    Monte Carlo robustness check of a vectorized strategy on one symbol.
+
+    Parameters:
+        symbol (str): Stock symbol
+        strategy (str): 'buy_and_hold', 'momentum', 'bollinger' or 'ma_crossover'
+        start_date (str/date): Start of the evaluated span (YYYY-MM-DD)
+        end_date (str/date): End of the evaluated span (YYYY-MM-DD)
+        paths (int): Number of simulated paths
+        mode (str): 'bootstrap' resamples daily returns in blocks; 'perturb' keeps the
+                    historical path and randomizes fill prices and slippage
+        block_size (int): Sessions per bootstrap block
+        slippage_bps (float): Cost per unit of exposure traded, in basis points
+        price_noise_bps (float): Std-dev of fill price noise in 'perturb' mode
+        seed (int): Seed for reproducible runs
+
+    Returns:
+        dict: Historical outcome and return/drawdown/Sharpe percentiles across paths
+    """
+    if mode not in ('bootstrap', 'perturb'):
+        raise ValueError(f"Unknown mode {mode}")
+    paths = int(min(max(paths, 1), MONTE_CARLO_MAX_PATHS))
+    start_day = TradingCalendar._to_day(start_date)
+    panel = load_price_panel([symbol], date.fromordinal(start_day + EPOCH_ORDINAL - warmup_days), end_date)
+    close = panel.close[:, 0]
+    keep = ~np.isnan(close)
+    close, days = close[keep], panel.days[keep]
+    eval_start = int(np.searchsorted(days, start_day))
+    if len(close) - eval_start < 3:
+        raise ValueError(f"Not enough history for {symbol} between {start_date} and {end_date}")
+
+    slippage, price_noise = slippage_bps / 1e4, price_noise_bps / 1e4
+    historical = _path_outcomes(close[:, None], vector_positions(strategy, close[:, None]),
+                                lambda trades: np.abs(trades) * slippage, eval_start)
+
+    chunks = [min(MONTE_CARLO_CHUNK_PATHS, paths - i) for i in range(0, paths, MONTE_CARLO_CHUNK_PATHS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    args = [(strategy, close, mode, n, s, block_size, slippage, price_noise, eval_start)
+            for n, s in zip(chunks, seeds)]
+    outcomes = None
+    if workers > 1 and len(chunks) > 1 and paths * len(close) >= MONTE_CARLO_PARALLEL_MIN_CELLS \
+            and _process_pool_slots.acquire(timeout=PROCESS_POOL_SLOT_WAIT):
+        try:
+            # The price path is published once; tasks carry only their seeds and sizes
+            with SharedArrays({'close': close}) as shared, \
+                    _process_pool(min(workers, len(chunks)), _init_arrays_worker, (shared,)) as pool:
+                outcomes = list(pool.map(_monte_carlo_chunk, *zip(*((a[0], None) + a[2:] for a in args))))
+        except (OSError, BrokenProcessPool) as e:
+            logger.warning(f"Process pool unavailable ({e}); simulating in-process")
+        finally:
+            _process_pool_slots.release()
+    if outcomes is None:
+        outcomes = [_monte_carlo_chunk(*a) for a in args]
+    returns, drawdowns, sharpes = (np.concatenate(parts) for parts in zip(*outcomes))
+
+    return {
+        'symbol': symbol,
+        'strategy': strategy,
+        'mode': mode,
+        'paths': paths,
+        'sessions': int(len(close) - eval_start),
+        'seed': seed,
+        'historical': {'return': float(historical[0][0]), 'max_drawdown': float(historical[1][0]),
+                       'sharpe': _json_number(historical[2][0])},
+        'probability_of_loss': float((returns < 0).mean()),
+        'return': summarize_distribution(returns),
+        'max_drawdown': summarize_distribution(drawdowns),
+        'sharpe': summarize_distribution(sharpes)
+    }
+
+
+########## Streaming indicators ###################
+# O(1)-per-update indicator state for live evaluation. update() commits a
+# finished bar; preview() evaluates a forming bar (an intraday quote) without
+# touching state, so per-tick cost stays constant. Every indicator can be
+# dumped to JSON and restored, and StreamingIndicatorSet snapshots to SQLite.
+SUM_RESYNC_INTERVAL = 10000  # re-add running sums from the buffer this often to cap float drift
+
+
+class StreamingIndicator:
+    """Base class: params are the constructor kwargs, everything else is state"""
+    kind = None
+
+    def __init__(self, **params):
+        self.params = params
+        self.value = None
+
+    def update(self, close, high=None, low=None, volume=None):
+        raise NotImplementedError
+
+    def preview(self, close, high=None, low=None, volume=None):
+        raise NotImplementedError
+
+    def state(self):
+        data = {}
+        for name, attr in vars(self).items():
+            if name == 'params':
+                continue
+            data[name] = {'deque': list(attr), 'maxlen': attr.maxlen} if isinstance(attr, deque) else \
+                attr.state() if isinstance(attr, StreamingIndicator) else attr
+        return {'kind': self.kind, 'params': self.params, 'data': data}
+
+    @staticmethod
+    def restore(state):
+        indicator = STREAMING_INDICATORS[state['kind']](**state['params'])
+        for name, attr in state['data'].items():
+            if isinstance(attr, dict) and 'deque' in attr:
+                attr = deque((tuple(x) if isinstance(x, list) else x for x in attr['deque']), maxlen=attr['maxlen'])
+            elif isinstance(attr, dict) and 'kind' in attr:
+                attr = StreamingIndicator.restore(attr)
+            elif isinstance(attr, list):
+                attr = tuple(attr)
+            setattr(indicator, name, attr)
+        return indicator
+
+
+class _ScalarStateIndicator(StreamingIndicator):
+    """Indicators whose state is a handful of scalars: _next() returns the new state"""
+
+    def _next(self, close, high, low, volume):
+        raise NotImplementedError
 
+    def _value_of(self, state):
+        raise NotImplementedError
+
+    def update(self, close, high=None, low=None, volume=None):
+        state = self._next(close, close if high is None else high, close if low is None else low, volume or 0)
+        vars(self).update(state)
+        self.value = self._value_of(state)
+        return self.value
+
+    def preview(self, close, high=None, low=None, volume=None):
+        return self._value_of(self._next(close, close if high is None else high,
+                                         close if low is None else low, volume or 0))
+
+
+class StreamingSMA(StreamingIndicator):
+    kind = 'sma'
+
+    def __init__(self, window=20):
+        super().__init__(window=window)
+        self.window = window
+        self.buffer = deque(maxlen=window)
+        self.total = 0.0
+        self.updates = 0
+
+    def _total_with(self, close):
+        dropped = self.buffer[0] if len(self.buffer) == self.window else 0.0
+        return self.total - dropped + close
+
+    def preview(self, close, high=None, low=None, volume=None):
+        if len(self.buffer) < self.window - 1:
+            return None
+        return self._total_with(close) / self.window
+
+    def update(self, close, high=None, low=None, volume=None):
+        self.value = self.preview(close)
+        self.total = self._total_with(close)
+        self.buffer.append(close)
+        self.updates += 1
+        if self.updates % SUM_RESYNC_INTERVAL == 0:
+            self.total = float(sum(self.buffer))
+        return self.value
+
+
+class StreamingStd(StreamingIndicator):
+    """Rolling sample standard deviation (matches pandas rolling().std())"""
+    kind = 'std'
+
+    def __init__(self, window=20):
+        super().__init__(window=window)
+        self.window = window
+        self.buffer = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.updates = 0
+
+    def _sums_with(self, close):
+        dropped = self.buffer[0] if len(self.buffer) == self.window else 0.0
+        return self.total - dropped + close, self.total_sq - dropped * dropped + close * close
+
+    def _stats(self, total, total_sq):
+        n = self.window
+        mean = total / n
+        return mean, math.sqrt(max(total_sq - total * mean, 0.0) / (n - 1)) if n > 1 else 0.0
+
+    def preview(self, close, high=None, low=None, volume=None):
+        if len(self.buffer) < self.window - 1:
+            return None
+        return self._stats(*self._sums_with(close))[1]
+
+    def update(self, close, high=None, low=None, volume=None):
+        self.value = self.preview(close)
+        self.total, self.total_sq = self._sums_with(close)
+        self.buffer.append(close)
+        self.updates += 1
+        if self.updates % SUM_RESYNC_INTERVAL == 0:
+            self.total = float(sum(self.buffer))
+            self.total_sq = float(sum(x * x for x in self.buffer))
+        return self.value
+
+
+class StreamingBollinger(StreamingStd):
+    """Bollinger bands: (middle, upper, lower)"""
+    kind = 'bollinger'
+
+    def __init__(self, window=20, num_std=2.0):
+        super().__init__(window=window)
+        self.params['num_std'] = num_std
+        self.num_std = num_std
+
+    def preview(self, close, high=None, low=None, volume=None):
+        if len(self.buffer) < self.window - 1:
+            return None
+        mean, std = self._stats(*self._sums_with(close))
+        return mean, mean + self.num_std * std, mean - self.num_std * std
+
+
+class StreamingEMA(_ScalarStateIndicator):
+    kind = 'ema'
+
+    def __init__(self, span=20):
+        super().__init__(span=span)
+        self.alpha = 2.0 / (span + 1)
+        self.ema = None
+
+    def _next(self, close, high, low, volume):
+        return {'ema': close if self.ema is None else self.ema + self.alpha * (close - self.ema)}
+
+    def _value_of(self, state):
+        return state['ema']
+
+
+class StreamingRSI(_ScalarStateIndicator):
+    """Wilder's RSI: seeded with the simple average of the first `period` changes"""
+    kind = 'rsi'
+
+    def __init__(self, period=14):
+        super().__init__(period=period)
+        self.period = period
+        self.prev_close = None
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.changes = 0
+
+    def _next(self, close, high, low, volume):
+        if self.prev_close is None:
+            return {'prev_close': close, 'avg_gain': 0.0, 'avg_loss': 0.0, 'changes': 0}
+        change = close - self.prev_close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        changes = self.changes + 1
+        if changes <= self.period:
+            avg_gain = self.avg_gain + gain / self.period
+            avg_loss = self.avg_loss + loss / self.period
+        else:
+            avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+            avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+        return {'prev_close': close, 'avg_gain': avg_gain, 'avg_loss': avg_loss, 'changes': changes}
+
+    def _value_of(self, state):
+        if state['changes'] < self.period:
+            return None
+        if state['avg_loss'] == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1.0 + state['avg_gain'] / state['avg_loss'])
+
+
+def _true_range(high, low, prev_close):
+    if prev_close is None:
+        return high - low
+    return max(high - low, abs(high - prev_close), abs(low - prev_close))
+
+
+class StreamingATR(_ScalarStateIndicator):
+    kind = 'atr'
+
+    def __init__(self, period=14):
+        super().__init__(period=period)
+        self.period = period
+        self.prev_close = None
+        self.atr = 0.0
+        self.bars = 0
+
+    def _next(self, close, high, low, volume):
+        tr = _true_range(high, low, self.prev_close)
+        bars = self.bars + 1
+        atr = self.atr + tr / self.period if bars <= self.period else \
+            (self.atr * (self.period - 1) + tr) / self.period
+        return {'prev_close': close, 'atr': atr, 'bars': bars}
+
+    def _value_of(self, state):
+        return state['atr'] if state['bars'] >= self.period else None
+
+
+class StreamingOBV(_ScalarStateIndicator):
+    kind = 'obv'
+
+    def __init__(self):
+        super().__init__()
+        self.prev_close = None
+        self.obv = 0.0
+
+    def _next(self, close, high, low, volume):
+        if self.prev_close is None or close == self.prev_close:
+            obv = self.obv
+        else:
+            obv = self.obv + volume if close > self.prev_close else self.obv - volume
+        return {'prev_close': close, 'obv': obv}
+
+    def _value_of(self, state):
+        return state['obv']
+
+
+class StreamingADX(_ScalarStateIndicator):
+    """Wilder's ADX with +DI/-DI: value is (adx, plus_di, minus_di)"""
+    kind = 'adx'
+
+    def __init__(self, period=14):
+        super().__init__(period=period)
+        self.period = period
+        self.prev = None  # (high, low, close)
+        self.s_tr = self.s_plus = self.s_minus = 0.0
+        self.bars = 0
+        self.dx_count = 0
+        self.adx = 0.0
+
+    def _next(self, close, high, low, volume):
+        if self.prev is None:
+            return {'prev': (high, low, close)}
+        prev_high, prev_low, prev_close = self.prev
+        up, down = high - prev_high, prev_low - low
+        plus_dm = up if up > down and up > 0 else 0.0
+        minus_dm = down if down > up and down > 0 else 0.0
+        tr = _true_range(high, low, prev_close)
+        p = self.period
+        bars = self.bars + 1
+        if bars <= p:
+            s_tr, s_plus, s_minus = self.s_tr + tr, self.s_plus + plus_dm, self.s_minus + minus_dm
+        else:
+            s_tr = self.s_tr - self.s_tr / p + tr
+            s_plus = self.s_plus - self.s_plus / p + plus_dm
+            s_minus = self.s_minus - self.s_minus / p + minus_dm
+        state = {'prev': (high, low, close), 's_tr': s_tr, 's_plus': s_plus, 's_minus': s_minus,
+                 'bars': bars, 'dx_count': self.dx_count, 'adx': self.adx}
+        if bars >= p and s_tr > 0:
+            plus_di, minus_di = 100 * s_plus / s_tr, 100 * s_minus / s_tr
+            dx = 100 * abs(plus_di - minus_di) / (plus_di + minus_di) if plus_di + minus_di else 0.0
+            dx_count = self.dx_count + 1
+            state['dx_count'] = dx_count
+            state['adx'] = self.adx + dx / p if dx_count <= p else (self.adx * (p - 1) + dx) / p
+            state['di'] = (plus_di, minus_di)
+        return state
+
+    def _value_of(self, state):
+        if state.get('dx_count', 0) < self.period or 'di' not in state:
+            return None
+        return (state['adx'],) + state['di']
+
+
+class StreamingStochastic(StreamingIndicator):
+    """Stochastic oscillator: value is (%K, %D); highs/lows tracked with monotonic deques"""
+    kind = 'stochastic'
+
+    def __init__(self, k_period=14, d_period=3):
+        super().__init__(k_period=k_period, d_period=d_period)
+        self.k_period = k_period
+        self.bars = 0
+        self.highs = deque()  # (bar, high), highs strictly decreasing
+        self.lows = deque()   # (bar, low), lows strictly increasing
+        self.d = StreamingSMA(d_period)
+
+    def _extremes_with(self, high, low):
+        """Highest high / lowest low over the last k_period bars if (high, low) were the next bar"""
+        oldest = self.bars - self.k_period + 1  # first committed bar still inside the new window
+        highs = [h for i, h in itertools.islice(self.highs, 2) if i >= oldest]
+        lows = [lo for i, lo in itertools.islice(self.lows, 2) if i >= oldest]
+        return max(highs[:1] + [high]), min(lows[:1] + [low])
+
+    def _k(self, close, high, low):
+        highest, lowest = self._extremes_with(high, low)
+        return 100.0 * (close - lowest) / (highest - lowest) if highest > lowest else 50.0
+
+    def preview(self, close, high=None, low=None, volume=None):
+        high, low = close if high is None else high, close if low is None else low
+        if self.bars < self.k_period - 1:
+            return None
+        k = self._k(close, high, low)
+        return k, self.d.preview(k)
+
+    def update(self, close, high=None, low=None, volume=None):
+        high, low = close if high is None else high, close if low is None else low
+        k = self._k(close, high, low) if self.bars >= self.k_period - 1 else None
+        self.value = (k, self.d.update(k)) if k is not None else None
+        while self.highs and self.highs[-1][1] <= high:
+            self.highs.pop()
+        while self.lows and self.lows[-1][1] >= low:
+            self.lows.pop()
+        self.highs.append((self.bars, high))
+        self.lows.append((self.bars, low))
+        self.bars += 1
+        oldest = self.bars - self.k_period
+        while self.highs[0][0] <= oldest:
+            self.highs.popleft()
+        while self.lows[0][0] <= oldest:
+            self.lows.popleft()
+        return self.value
+
+
+STREAMING_INDICATORS = {cls.kind: cls for cls in (
+    StreamingSMA, StreamingStd, StreamingBollinger, StreamingEMA, StreamingRSI,
+    StreamingATR, StreamingOBV, StreamingADX, StreamingStochastic)}
+
+# The indicator mix the adaptive strategy looks at
+DEFAULT_STREAMING_INDICATORS = {
+    'sma20': ('sma', {'window': 20}),
+    'sma50': ('sma', {'window': 50}),
+    'sma200': ('sma', {'window': 200}),
+    'ema12': ('ema', {'span': 12}),
+    'ema26': ('ema', {'span': 26}),
+    'bollinger': ('bollinger', {'window': 20, 'num_std': 2.0}),
+    'rsi': ('rsi', {'period': 14}),
+    'atr': ('atr', {'period': 14}),
+    'stochastic': ('stochastic', {'k_period': 14, 'd_period': 3}),
+    'obv': ('obv', {}),
+    'adx': ('adx', {'period': 14}),
+}
+
+
+class StreamingIndicatorSet:
+    """
+    Named streaming indicators for one symbol. Daily bars are committed with
+    update_bar() (each day at most once); live quotes go through preview().
+    Callers sharing a set between threads hold `lock` around every call.
+    """
+
+    def __init__(self, symbol, specs=None):
+        self.symbol = symbol
+        self.last_day = None
+        self.lock = threading.Lock()
+        self.indicators = {name: STREAMING_INDICATORS[kind](**params)
+                           for name, (kind, params) in (specs or DEFAULT_STREAMING_INDICATORS).items()}
+
+    def update_bar(self, day, close, high=None, low=None, volume=None):
+        """Commit one finished bar (epoch day); bars at or before last_day are ignored"""
+        if self.last_day is not None and day <= self.last_day:
+            return self.values()
+        self.last_day = int(day)
+        return {name: ind.update(close, high, low, volume) for name, ind in self.indicators.items()}
+
+    def preview(self, close, high=None, low=None, volume=None):
+        """Indicator values including a still-forming bar, without changing state"""
+        return {name: ind.preview(close, high, low, volume) for name, ind in self.indicators.items()}
+
+    def values(self):
+        return {name: ind.value for name, ind in self.indicators.items()}
+
+    def catch_up(self, before_day=None, store=None):
+        """Commit every stored daily bar after last_day (and before before_day); returns how many"""
+        bars = (store or BAR_STORE).bars(self.symbol)
+        start = 0 if self.last_day is None else int(np.searchsorted(bars.days, self.last_day, side='right'))
+        end = len(bars.days) if before_day is None else int(np.searchsorted(bars.days, before_day, side='left'))
+        for i in range(start, end):
+            self.update_bar(int(bars.days[i]), float(bars.close[i]), float(bars.high[i]),
+                            float(bars.low[i]), float(bars.volume[i]))
+        return max(end - start, 0)
+
+    def state(self):
+        return {'symbol': self.symbol, 'last_day': self.last_day,
+                'indicators': {name: ind.state() for name, ind in self.indicators.items()}}
+
+    @classmethod
+    def restore(cls, state):
+        indicator_set = cls(state['symbol'], specs={})
+        indicator_set.last_day = state['last_day']
+        indicator_set.indicators = {name: StreamingIndicator.restore(s)
+                                    for name, s in state['indicators'].items()}
+        return indicator_set
+
+
+@METRICS.timed('quarks_db_seconds', fn='save_indicator_snapshot')
+def save_indicator_snapshot(key, indicator_set):
+    """Persist a StreamingIndicatorSet under key (e.g. 'strategy:12' or a symbol)"""
+    conn = sqlite3.connect('trading_system.db')
+    try:
+        conn.execute('''INSERT OR REPLACE INTO indicator_snapshots (key, symbol, state, updated_at)
+                        VALUES (?, ?, ?, CURRENT_TIMESTAMP)''',
+                     (key, indicator_set.symbol, json.dumps(indicator_set.state())))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error saving indicator snapshot {key}: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+@METRICS.timed('quarks_db_seconds', fn='load_indicator_snapshot')
+def load_indicator_snapshot(key):
+    """Restore a StreamingIndicatorSet saved under key, or None"""
+    conn = sqlite3.connect('trading_system.db')
+    try:
+        row = conn.execute('SELECT state FROM indicator_snapshots WHERE key=?', (key,)).fetchone()
+        return StreamingIndicatorSet.restore(json.loads(row[0])) if row else None
+    except Exception as e:
+        logger.error(f"Error loading indicator snapshot {key}: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+_live_indicator_sets = {}
+_live_indicator_locks = {}  # key -> lock held while that key's set is loaded
+_live_indicator_lock = threading.Lock()  # guards _live_indicator_locks only
+
+
+def live_indicators(symbol, key=None, warmup_days=PANEL_WARMUP_DAYS):
+    """
+    Current indicator values for symbol including today's live quote.
+
+    The set is restored from its snapshot (or warmed from the bar store once),
+    caught up with any new daily bars, and then each call costs one preview.
+
+    Returns:
+        dict: {'symbol', 'price', 'as_of', 'indicators': {name: value}}
+    """
+    key = key or symbol
+    # Network I/O first, without holding any lock
+    yesterday = date.today() - timedelta(days=1)
+    BAR_STORE.ensure(symbol, yesterday - timedelta(days=warmup_days), yesterday)
+    with _live_indicator_lock:
+        key_lock = _live_indicator_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        indicator_set = _live_indicator_sets.get(key)
+        if indicator_set is None:
+            indicator_set = load_indicator_snapshot(key) or StreamingIndicatorSet(symbol)
+            _live_indicator_sets[key] = indicator_set
+    with indicator_set.lock:
+        # Only completed sessions are committed; today's bar is previewed below
+        if indicator_set.catch_up(before_day=date.today().toordinal() - EPOCH_ORDINAL):
+            save_indicator_snapshot(key, indicator_set)
+
+    price = get_stock_price(symbol)
+    with indicator_set.lock:
+        values = indicator_set.preview(price) if price is not None else indicator_set.values()
+        last_day = indicator_set.last_day
+    return {
+        'symbol': symbol,
+        'price': price,
+        'as_of': str(date.fromordinal(last_day + EPOCH_ORDINAL)) if last_day else None,
+        'indicators': values
+    }
+
+
+########## MARKET SNAPSHOT ###################
+
+SECTOR_MAP_PATH = os.environ.get(
+    'QUARKS_SECTOR_MAP', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'sector_company.json'))
+SECTOR_PERIODS = {'3_days': 3, '7_days': 7, '1_month': 21, '6_months': 126}  # in sessions
+SECTOR_TOP_N = 5
+TOP_MOVERS_N = 10
+SNAPSHOT_HISTORY_DAYS = 270  # calendar days of bars behind the longest period / trend window
+SNAPSHOT_REFRESH_SECONDS = QUOTE_CACHE_TTL
+FORECAST_WINDOW = 60  # sessions in the trend regression
+FORECAST_HORIZON = 7  # sessions ahead for expected_return
+SNAPSHOT_HISTORY_RETRY_SECONDS = 300  # after a partial history fill, wait this long before retrying
+
+# Used when the frontend's sector_company.json is not deployed next to the backend
+DEFAULT_SECTOR_MAP = {
+    'Information Technology': ['TCS', 'INFY', 'HCLTECH', 'WIPRO', 'TECHM'],
+    'Banking': ['HDFCBANK', 'ICICIBANK', 'SBIN', 'KOTAKBANK', 'AXISBANK'],
+    'Pharmaceuticals': ['SUNPHARMA', 'DRREDDY', 'CIPLA', 'DIVISLAB', 'LUPIN'],
+    'Automobile': ['MARUTI', 'TATAMOTORS', 'M&M', 'BAJAJ-AUTO', 'EICHERMOT'],
+    'Financial Services': ['BAJFINANCE', 'BAJAJFINSV', 'HDFCLIFE', 'SBILIFE', 'SHRIRAMFIN'],
+    'Metals & Mining': ['TATASTEEL', 'JSWSTEEL', 'HINDALCO', 'VEDL', 'COALINDIA'],
+    'Energy': ['RELIANCE', 'ONGC', 'NTPC', 'POWERGRID', 'BPCL'],
+    'Construction & Real Estate': ['LT', 'DLF', 'GODREJPROP', 'ULTRACEMCO', 'GRASIM'],
+    'FMCG': ['HINDUNILVR', 'ITC', 'NESTLEIND', 'BRITANNIA', 'DABUR'],
+}
+
+
+def load_sector_map(path=SECTOR_MAP_PATH):
+    """
+    Read the sector map in the frontend's sector_company.json layout.
+
+    Returns:
+        dict: {sector: [{'company': str, 'ticker': str, 'sector': str}]}
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Sector map {path} unavailable ({e}); using the built-in map")
+        return {sector: [{'company': ticker, 'ticker': ticker, 'sector': sector} for ticker in tickers]
+                for sector, tickers in DEFAULT_SECTOR_MAP.items()}
+
+
+def trend_fit(closes, window=FORECAST_WINDOW, horizon=FORECAST_HORIZON):
+    """
+    Least-squares fit of log price on time for every column of a (sessions x symbols) array.
+
+    Returns:
+        tuple: (slope % per session, expected % return over horizon, R^2) arrays,
+               NaN for columns without a full window
+    """
+    y = np.log(closes[-window:])
+    x = np.arange(len(y), dtype=float)
+    x -= x.mean()
+    dev = y - y.mean(axis=0)
+    sxx = (x ** 2).sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beta = (x[:, None] * dev).sum(axis=0) / sxx
+        r2 = beta ** 2 * sxx / (dev ** 2).sum(axis=0)
+    if len(y) < window:
+        beta = np.full(closes.shape[1], np.nan)
+    return np.expm1(beta) * 100, np.expm1(beta * horizon) * 100, np.clip(r2, 0.0, 1.0)
+
+
+class MarketSnapshot:
+    """
+    Latest price for every symbol in the sector map, held as arrays in map order.
+
+    Live quotes land through the quote listener in O(1); sector returns, breadth
+    and top movers are recomputed with array operations at most once per change
+    and served from memory. Reference closes and trend fits come from a daily
+    price panel, so a request never waits on quotes: symbols without a live
+    quote use their latest close while a bulk refresh runs in the background.
+    Likewise the panel is built from bars already stored, and missing history
+    is fetched by a background thread that rebuilds it when done.
+    """
+
+    def __init__(self, sector_map=None, store=None):
+        self._sector_map = sector_map
+        self.store = store
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = 0
+        self._computed_version = -1
+        self._aggregates = None
+        self._history_day = None       # day whose history was fetched completely
+        self._history_built_day = None  # day the panel was last built for
+        self._history_attempt = 0.0
+        self._filling = False
+        self._last_refresh = 0.0
+        self._refreshing = False
+
+    def _build(self):
+        sector_map = self._sector_map if self._sector_map is not None else load_sector_map()
+        symbols, companies, codes = [], [], []
+        self.sectors = list(sector_map)
+        seen = set()
+        for code, sector in enumerate(self.sectors):
+            for entry in sector_map[sector]:
+                ticker = str(entry['ticker']).upper()
+                if ticker not in seen:
+                    seen.add(ticker)
+                    symbols.append(ticker)
+                    companies.append(entry.get('company', ticker))
+                    codes.append(code)
+        self.symbols = symbols
+        self.companies = companies
+        self.codes = np.array(codes, dtype=np.intp)
+        self.members = [np.flatnonzero(self.codes == code) for code in range(len(self.sectors))]
+        self.last = np.full(len(symbols), np.nan)
+        self.prev_close = np.full(len(symbols), np.nan)
+        self._index = {symbol: j for j, symbol in enumerate(symbols)}
+
+    def _load_history(self):
+        """Build today's panel from stored bars and start a background fill of what is missing"""
+        today = date.today()
+        if self._history_day == today:
+            return
+        if self._history_built_day != today:
+            self._build_history(today)
+        if not self._filling and time.time() - self._history_attempt > SNAPSHOT_HISTORY_RETRY_SECONDS:
+            self._filling = True
+            self._history_attempt = time.time()
+            threading.Thread(target=self._fill_history, args=(today,), name='market-snapshot-history',
+                             daemon=True).start()
+
+    def _fill_history(self, today):
+        """Fetch missing bars off the request path; today counts as loaded only if every fetch succeeded"""
+        try:
+            store = self.store or BAR_STORE
+            start = today - timedelta(days=SNAPSHOT_HISTORY_DAYS)
+            complete = True
+            with upstream_priority('background'):
+                for symbol in self.symbols:
+                    complete = store.ensure(symbol, start, today) and complete
+            with self._lock:
+                self._build_history(today)
+                if complete:
+                    self._history_day = today
+        except Exception as e:
+            logger.warning(f"Market snapshot history fill failed: {e}")
+        finally:
+            self._filling = False
+
+    def _build_history(self, today):
+        panel = load_price_panel(self.symbols, today - timedelta(days=SNAPSHOT_HISTORY_DAYS), today, self.store,
+                                 fetch=False)
+        closes = panel.filled_close()
+        n = len(panel.days)
+        # During the session today's bar is not stored yet and the live price plays its part
+        today_bar = n > 0 and panel.days[-1] == TradingCalendar._to_day(today)
+        live_row = n - 1 if today_bar else n
+        self.latest_close = closes[-1] if n else np.full(len(self.symbols), np.nan)
+        self.session_prev_close = closes[live_row - 1] if live_row >= 1 else np.full(len(self.symbols), np.nan)
+        self.bases = {}
+        for period, sessions in SECTOR_PERIODS.items():
+            row = live_row - sessions
+            if row >= 0:
+                self.bases[period] = (closes[row], str(date.fromordinal(int(panel.days[row]) + EPOCH_ORDINAL)))
+        slope, expected, r2 = trend_fit(closes) if n else (np.array([]),) * 3
+        self.trends = {}
+        for j, symbol in enumerate(self.symbols):
+            if n and np.isfinite(slope[j]):
+                self.trends[symbol] = {
+                    'slope': float(slope[j]),
+                    'sector': self.sectors[self.codes[j]],
+                    'expected_return': float(expected[j]),
+                    'trend_strength': float(r2[j]),
+                    'score': float(expected[j] * r2[j])
+                }
+        self._history_built_day = today
+        self._version += 1
+
+    def on_quote(self, symbol, price, quote=None):
+        """Quote listener: record the latest price in O(1)"""
+        index = self._index
+        j = index.get(symbol) if index is not None else None
+        if j is None:
+            return
+        self.last[j] = price
+        previous = (quote or {}).get('priceInfo', {}).get('previousClose')
+        if previous:
+            self.prev_close[j] = previous
+        self._version += 1
+
+    def refresh(self):
+        """Fetch quotes for every mapped symbol through the bulk path (the listener records them)"""
+        try:
+            with upstream_priority('background'):
+                get_stock_prices(self.symbols)
+        except Exception as e:
+            logger.warning(f"Market snapshot refresh failed: {e}")
+        finally:
+            self._last_refresh = time.time()
+            self._refreshing = False
+
+    def _ensure_current(self):
+        if self._index is None:
+            self._build()
+        self._load_history()
+        if not self._refreshing and time.time() - self._last_refresh > SNAPSHOT_REFRESH_SECONDS:
+            self._refreshing = True
+            threading.Thread(target=self.refresh, name='market-snapshot-refresh', daemon=True).start()
+
+    def _stock_rows(self, rows, values, key):
+        return [{'ticker': self.symbols[j], 'company': self.companies[j], key: float(values[j])} for j in rows]
+
+    def _compute(self):
+        price = np.where(np.isnan(self.last), self.latest_close, self.last)
+        prev = np.where(np.isnan(self.prev_close), self.session_prev_close, self.prev_close)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            change = (price / prev - 1) * 100
+        n_sectors = len(self.sectors)
+        today = str(date.today())
+
+        data = {}
+        for period, (base, start) in self.bases.items():
+            with np.errstate(invalid='ignore', divide='ignore'):
+                returns = (price / base - 1) * 100
+            ok = np.isfinite(returns)
+            counts = np.bincount(self.codes[ok], minlength=n_sectors)
+            sums = np.bincount(self.codes[ok], weights=returns[ok], minlength=n_sectors)
+            sectors = {}
+            for code, sector in enumerate(self.sectors):
+                if not counts[code]:
+                    continue
+                sector_return = sums[code] / counts[code]
+                members = self.members[code][ok[self.members[code]]]
+                ranked = members[np.argsort(-returns[members], kind='stable')]
+                sectors[sector] = {
+                    'sector_return_pct': float(sector_return),
+                    'stock_count': int(counts[code]),
+                    'outperformers': self._stock_rows(
+                        [j for j in ranked if returns[j] > sector_return][:SECTOR_TOP_N], returns, 'return_pct'),
+                    'underperformers': self._stock_rows(
+                        [j for j in ranked[::-1] if returns[j] < sector_return][:SECTOR_TOP_N], returns, 'return_pct'),
+                    'analysis_period': {'start_date': start, 'end_date': today}
+                }
+            data[period] = sectors
+
+        moved = np.isfinite(change)
+        advances = np.bincount(self.codes[moved & (change > 0)], minlength=n_sectors)
+        declines = np.bincount(self.codes[moved & (change < 0)], minlength=n_sectors)
+        ranked = np.flatnonzero(moved)[np.argsort(-change[moved], kind='stable')]
+        breadth = {
+            'advances': int(advances.sum()),
+            'declines': int(declines.sum()),
+            'unchanged': int(moved.sum() - advances.sum() - declines.sum()),
+            'advance_decline_ratio': _json_number(advances.sum() / declines.sum()) if declines.sum() else None,
+            'sectors': {sector: {'advances': int(advances[code]), 'declines': int(declines[code])}
+                        for code, sector in enumerate(self.sectors)}
+        }
+        movers = {
+            'gainers': self._stock_rows([j for j in ranked[:TOP_MOVERS_N] if change[j] > 0], change, 'change_pct'),
+            'losers': self._stock_rows([j for j in ranked[::-1][:TOP_MOVERS_N] if change[j] < 0], change, 'change_pct')
+        }
         return {
-            'return': self.portfolio['return'],
-            'transactions': self.portfolio['transactions'],
-            'graph_path': image_path,
-            'price_history': self.portfolio['price_history']  # Return for debugging
+            'data': data,
+            'breadth': breadth,
+            'top_movers': movers,
+            'live_quotes': int(np.isfinite(self.last).sum()),
+            'symbols': len(self.symbols),
+            'as_of': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
-    
-    def plot_backtest_results(self, symbol):
-        """Plot price history with buy/sell signals"""
-        if not self.portfolio.get('price_history'):
-            print("DEBUG - No price history in portfolio:", self.portfolio.keys())
-            return None
 
-        try:
-            # Convert string dates to datetime objects for plotting
-            dates = [datetime.strptime(d, "%Y-%m-%d").date()
-                     for d in sorted(self.portfolio['price_history'].keys())]
-            prices = [self.portfolio['price_history'][d]
-                      for d in sorted(self.portfolio['price_history'].keys())]
+    def sector_performance(self):
+        """Sector returns per period, market breadth and top movers (served from memory)"""
+        with self._lock:
+            self._ensure_current()
+            version = self._version
+            if self._computed_version != version:
+                with METRICS.timer('quarks_snapshot_compute_seconds'):
+                    self._aggregates = self._compute()
+                self._computed_version = version
+            return self._aggregates
+
+    def forecast_trends(self):
+        """{symbol: {slope, sector, expected_return, trend_strength, score}} from the daily trend fit"""
+        with self._lock:
+            self._ensure_current()
+            return self.trends
+
+
+MARKET_SNAPSHOT = MarketSnapshot()
+add_quote_listener(MARKET_SNAPSHOT.on_quote)
+
+
+########## SCREENER ###################
+
+SCREEN_HISTORY_DAYS = 400  # calendar days loaded; enough for SMA200 plus cross windows
+SCREEN_PANEL_CACHE = 4
+SCREEN_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+SCREEN_COMPARISONS = {
+    '<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal,
+    '==': np.equal, '!=': np.not_equal,
+}
+SCREEN_ARITHMETIC = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide}
+# Named events, expanded to "<fast> crosses <direction> <slow>"
+SCREEN_EVENTS = {
+    'golden': (('sma', 50), ('sma', 200), 'above'),
+    'death': (('sma', 50), ('sma', 200), 'below'),
+}
+_SCREEN_TOKEN = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|([A-Za-z_][A-Za-z_0-9]*)|(<=|>=|==|!=|[<>+\-*/(),]))')
+
+
+class ScreenSyntaxError(ValueError):
+    """A screener expression that could not be parsed"""
+
+
+class _ScreenParser:
+    """
+    Recursive-descent parser turning a screener expression into a function of a PricePanel.
+
+    Conditions compile to dates x symbols boolean arrays and values to float
+    arrays, both computed over the whole panel at once:
+
+        rsi(14) < 30 and close > sma200
+        golden cross in last 5 sessions
+        sma(20) crosses above sma(50) in the last 3 sessions
+        (close - sma(20)) / std(20) < -2 or not return(20) > 0
+
+    Series are the bar fields and PANEL_INDICATORS, written name(params) or
+    name<period> (sma200); a trailing field argument switches the input, e.g.
+    sma(20, volume).
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            match = _SCREEN_TOKEN.match(text, pos)
+            if not match or match.end() == pos:
+                raise ScreenSyntaxError(f"Unexpected character at {pos}: {text[pos:pos + 10]!r}")
+            number, word, symbol = match.groups()
+            self.tokens.append(('num', float(number)) if number else
+                               ('word', word.lower()) if word else ('op', symbol))
+            pos = match.end()
+        self.pos = 0
+        self.series = {}  # label -> compiled value, reported next to each match
+
+    def _peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def _accept(self, kind, value=None):
+        token = self._peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.pos += 1
+            return token[1]
+        return None
+
+    def _expect(self, kind, value=None):
+        found = self._accept(kind, value)
+        if found is None:
+            got = self._peek()[1]
+            raise ScreenSyntaxError(f"Expected {value or kind} but found {got if got is not None else 'end of input'}")
+        return found
+
+    def parse_condition(self):
+        condition = self._or()
+        if self.pos != len(self.tokens):
+            raise ScreenSyntaxError(f"Unexpected {self._peek()[1]!r}")
+        return condition
+
+    def parse_value(self):
+        value = self._sum()
+        if self.pos != len(self.tokens):
+            raise ScreenSyntaxError(f"Unexpected {self._peek()[1]!r}")
+        return value
+
+    def _or(self):
+        left = self._and()
+        while self._accept('word', 'or'):
+            right = self._and()
+            left = (lambda a, b: lambda panel: a(panel) | b(panel))(left, right)
+        return left
+
+    def _and(self):
+        left = self._unary()
+        while self._accept('word', 'and'):
+            right = self._unary()
+            left = (lambda a, b: lambda panel: a(panel) & b(panel))(left, right)
+        return left
+
+    def _unary(self):
+        if self._accept('word', 'not'):
+            inner = self._unary()
+            return lambda panel: ~inner(panel)
+        return self._window(self._atom())
+
+    def _atom(self):
+        word = self._peek()[1]
+        if word in SCREEN_EVENTS and self._peek(1) == ('word', 'cross'):
+            self.pos += 2
+            fast, slow, direction = SCREEN_EVENTS[word]
+            return self._cross(self._indicator(*fast), self._indicator(*slow), direction)
+        if self._peek() == ('op', '('):
+            # Either a parenthesised condition or the start of an arithmetic operand
+            start = self.pos
+            self.pos += 1
+            try:
+                condition = self._or()
+                self._expect('op', ')')
+                if self._peek()[1] not in SCREEN_COMPARISONS and self._peek()[1] not in SCREEN_ARITHMETIC \
+                        and self._peek() != ('word', 'crosses'):
+                    return condition
+            except ScreenSyntaxError:
+                pass
+            self.pos = start
+        left = self._sum()
+        if self._accept('word', 'crosses'):
+            direction = self._accept('word', 'above') or self._expect('word', 'below')
+            return self._cross(left, self._sum(), direction)
+        op = self._peek()[1]
+        if op not in SCREEN_COMPARISONS:
+            raise ScreenSyntaxError(f"Expected a comparison but found {op if op is not None else 'end of input'}")
+        self.pos += 1
+        right = self._sum()
+        compare = SCREEN_COMPARISONS[op]
+
+        def evaluate(panel):
+            a, b = left(panel), right(panel)
+            with np.errstate(invalid='ignore'):
+                return compare(a, b) & ~(np.isnan(a) | np.isnan(b))
+        return evaluate
+
+    @staticmethod
+    def _cross(fast, slow, direction):
+        def evaluate(panel):
+            spread = fast(panel) - slow(panel)
+            before = np.vstack([np.full((1,) + spread.shape[1:], np.nan), spread[:-1]])
+            with np.errstate(invalid='ignore'):
+                if direction == 'above':
+                    return (spread > 0) & (before <= 0)
+                return (spread < 0) & (before >= 0)
+        return evaluate
+
+    def _window(self, condition):
+        # "... in [the] last N sessions": true if the condition held on any of the last N rows
+        if not self._accept('word', 'in'):
+            return condition
+        self._accept('word', 'the')
+        self._expect('word', 'last')
+        sessions = int(self._expect('num'))
+        if not (self._accept('word', 'sessions') or self._accept('word', 'session')
+                or self._accept('word', 'days') or self._accept('word', 'bars')):
+            raise ScreenSyntaxError("Expected 'sessions' after the window length")
+        if sessions < 1:
+            raise ScreenSyntaxError("Window must be at least one session")
+
+        def evaluate(panel):
+            hits = np.cumsum(condition(panel), axis=0)
+            lagged = np.vstack([np.zeros((min(sessions, len(hits)),) + hits.shape[1:]), hits[:-sessions]])
+            return (hits - lagged) > 0
+        return evaluate
+
+    def _sum(self):
+        left = self._product()
+        while self._peek()[1] in ('+', '-') and self._peek()[0] == 'op':
+            op = SCREEN_ARITHMETIC[self._expect('op')]
+            right = self._product()
+            left = (lambda f, a, b: lambda panel: f(a(panel), b(panel)))(op, left, right)
+        return left
+
+    def _product(self):
+        left = self._factor()
+        while self._peek()[1] in ('*', '/') and self._peek()[0] == 'op':
+            op = SCREEN_ARITHMETIC[self._expect('op')]
+            right = self._factor()
+
+            def evaluate(panel, f=op, a=left, b=right):
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    return f(a(panel), b(panel))
+            left = evaluate
+        return left
+
+    def _factor(self):
+        if self._accept('op', '-'):
+            inner = self._factor()
+            return lambda panel: -inner(panel)
+        number = self._accept('num')
+        if number is not None:
+            return lambda panel: number
+        if self._accept('op', '('):
+            value = self._sum()
+            self._expect('op', ')')
+            return value
+        name = self._accept('word')
+        if name is None:
+            got = self._peek()[1]
+            raise ScreenSyntaxError(f"Expected a value but found {got if got is not None else 'end of input'}")
+        if name in SCREEN_FIELDS:
+            self.series.setdefault(name, lambda panel: getattr(panel, name))
+            return self.series[name]
+        match = re.fullmatch(r'([a-z]+)(\d+)', name)
+        if match and match.group(1) in PANEL_INDICATORS:
+            return self._indicator(match.group(1), int(match.group(2)))
+        if name not in PANEL_INDICATORS:
+            raise ScreenSyntaxError(f"Unknown series {name!r}")
+        params, field = [], 'close'
+        if self._accept('op', '('):
+            while not self._accept('op', ')'):
+                if params or field != 'close':
+                    self._expect('op', ',')
+                word = self._accept('word')
+                if word is not None:
+                    if word not in SCREEN_FIELDS:
+                        raise ScreenSyntaxError(f"Unknown field {word!r}")
+                    field = word
+                else:
+                    param = self._expect('num')
+                    params.append(int(param) if param == int(param) else param)
+        return self._indicator(name, *params, field=field)
+
+    def _indicator(self, name, *params, field='close'):
+        args = [str(p) for p in params] + ([field] if field != 'close' else [])
+        label = f"{name}({', '.join(args)})" if args else name
+        self.series.setdefault(label, lambda panel: panel.indicator(name, *params, field=field))
+        return self.series[label]
+
+
+_screen_panels = {}
+_screen_panels_lock = threading.Lock()
+
+
+def screen_panel(symbols=None, as_of=None, lookback_days=SCREEN_HISTORY_DAYS, store=None):
+    """
+    The panel a screen runs over: local bars only (nothing is fetched), cached per day.
+
+    With no symbols the universe is every symbol the bar store covers.
+    """
+    store = store or BAR_STORE
+    end = TradingCalendar._to_day(as_of or date.today())
+    if symbols is None:
+        symbols = store.symbols()
+        if store is BAR_STORE and not BAR_COLUMNS.is_current():
+            # Whole-universe screens read the columnar snapshot when it is current; until
+            # the background rebuild lands they take the SQLite path in load_price_panel
+            BAR_COLUMNS.schedule_build()
+    key = (id(store), tuple(symbols), end, lookback_days)
+    with _screen_panels_lock:
+        panel = _screen_panels.get(key)
+    if panel is None:
+        end_date = date.fromordinal(end + EPOCH_ORDINAL)
+        panel = load_price_panel(symbols, end_date - timedelta(days=lookback_days), end_date, store, fetch=False)
+        with _screen_panels_lock:
+            if len(_screen_panels) >= SCREEN_PANEL_CACHE:
+                _screen_panels.pop(next(iter(_screen_panels)))
+            _screen_panels[key] = panel
+    return panel
+
+
+@METRICS.timed('quarks_screen_seconds')
+def run_screen(expression, symbols=None, rank_by=None, ascending=False, limit=50, as_of=None, store=None):
+    """
+    Filter a universe with a screener expression in one vectorized pass and rank the matches.
+
+    Parameters:
+        expression (str): Condition, e.g. "rsi(14) < 30 and close > sma200" or "golden cross in last 5 sessions"
+        symbols (list): Universe (default: every symbol in the local bar store)
+        rank_by (str): Value expression to sort matches by (default: return(20))
+        ascending (bool): Sort order for rank_by
+        limit (int): Maximum matches returned
+        as_of (str|date): Session to screen on (default: latest)
+
+    Returns:
+        dict: {'as_of', 'universe', 'matched', 'results': [{'symbol', 'rank', 'close', <series>...}]}
+    """
+    parser = _ScreenParser(expression)
+    condition = parser.parse_condition()
+    ranking = _ScreenParser(rank_by or 'return(20)')
+    rank_value = ranking.parse_value()
+
+    panel = screen_panel([s.upper() for s in symbols] if symbols else None, as_of, store=store)
+    if not len(panel.days):
+        return {'as_of': None, 'universe': len(panel.symbols), 'matched': 0, 'results': []}
+    row = len(panel.days) - 1
+    mask = np.broadcast_to(condition(panel), panel.shape)[row]
+    ranks = np.broadcast_to(np.asarray(rank_value(panel), dtype=np.float64), panel.shape)[row]
+    close = panel.filled_close()[row]
+    columns = {label: np.broadcast_to(value(panel), panel.shape)[row] for label, value in parser.series.items()}
+
+    matched = np.flatnonzero(mask)
+    keys = np.where(np.isnan(ranks[matched]), np.inf, ranks[matched] if ascending else -ranks[matched])
+    order = matched[np.argsort(keys, kind='stable')][:limit]
+    results = []
+    for j in order:
+        result = {'symbol': panel.symbols[j], 'rank': _json_number(ranks[j]), 'close': _json_number(close[j])}
+        result.update((label, _json_number(values[j])) for label, values in columns.items())
+        results.append(result)
+    return {
+        'as_of': str(date.fromordinal(int(panel.days[row]) + EPOCH_ORDINAL)),
+        'universe': len(panel.symbols),
+        'matched': int(len(matched)),
+        'results': results
+    }
+
 
-            plt.figure(figsize=(14, 7))
-            plt.plot(dates, prices, label='Price', color='royalblue', linewidth=2)
+########## WATCHLIST PRICES ###################
 
-            # Plot transactions if they exist
-            if 'transactions' in self.portfolio:
-                for t in self.portfolio['transactions']:
-                    try:
-                        trans_date = datetime.strptime(t['timestamp'], "%Y-%m-%d %H:%M:%S").date()
-                        trans_type = t['type']
-                        price = t['price']
+class WatchlistPriceFiller:
+    """
+    Fills the initial last_price of watchlist items off the request path.
 
-                        if trans_type == 'BUY':
-                            plt.scatter(trans_date, price, color='limegreen', marker='^',
-                                        s=150, edgecolors='black', label='Buy')
-                        elif trans_type == 'SELL':
-                            plt.scatter(trans_date, price, color='crimson', marker='v',
-                                        s=150, edgecolors='black', label='Sell')
-                    except Exception as e:
-                        print(f"Error plotting transaction: {e}")
-                        continue
+    Adds take the price from the shared quote cache when it is fresh; otherwise
+    the item is stored unpriced and the symbol is queued here. The next quote for
+    it (our own background fetch or any other caller's) fills every unpriced row.
+    """
 
-            plt.title(f"{symbol} Trading Performance")
-            plt.xlabel('Date')
-            plt.ylabel('Price ()')
-            plt.grid(True, linestyle='--', alpha=0.7)
-            plt.legend()
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._pool = None
 
-            # Format dates
-            plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-            plt.gcf().autofmt_xdate()
+    def price_or_schedule(self, symbol):
+        """Return the cached price for symbol, or None after queueing a background fill"""
+        price = get_cached_price(symbol)
+        if price is None:
+            self.schedule(symbol)
+        return price
 
-            # Save image
-            os.makedirs('static/graphs', exist_ok=True)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            image_path = f"static/graphs/{self.name}_{symbol}_{timestamp}.png"
-            plt.savefig(image_path)
-            plt.close()
+    def schedule(self, symbol):
+        with self._lock:
+            if symbol in self._pending:
+                return
+            self._pending.add(symbol)
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='watchlist-prices')
+            pool = self._pool
+        pool.submit(self._fetch, symbol)
+
+    def _fetch(self, symbol):
+        # Off the request path, so wait for a token rather than being shed
+        with upstream_priority('bulk'):
+            price = get_stock_price(symbol)
+        if price is not None:
+            self.fill(symbol, price)
+        else:
+            with self._lock:
+                self._pending.discard(symbol)
 
-            return image_path
+    def on_quote(self, symbol, price, quote=None):
+        if symbol in self._pending:
+            self.fill(symbol, price)
 
+    def fill(self, symbol, price):
+        with self._lock:
+            if symbol not in self._pending:
+                return
+            self._pending.discard(symbol)
+        conn = sqlite3.connect('trading_system.db')
+        try:
+            conn.execute('UPDATE watchlist_items SET last_price=? WHERE symbol=? AND last_price IS NULL',
+                         (price, symbol))
+            conn.commit()
         except Exception as e:
-            print(f"Error in plot_backtest_results: {e}")
-            return None
+            logger.warning(f"Could not fill watchlist price for {symbol}: {e}")
+        finally:
+            conn.close()
 
 
-################################## PART 1 : STRATEGIES; UNCOMMENT THE BELOW PART TO TRY STRATEGIES. SWITCH THE STRATEGY TO ALL AVAILABLE ONES TO CHECK THEM ########################################3
+WATCHLIST_PRICES = WatchlistPriceFiller()
+add_quote_listener(WATCHLIST_PRICES.on_quote)
 
 
-"""
+########## PRICE ALERTS ###################
 
-simobject = Simulation("main1",20000)
+ALERT_KINDS = ('ABOVE', 'BELOW', 'CHANGE_PCT')
+ALERT_QUEUE_SIZE = 1000  # undelivered events kept per stream
+ALERT_POLL_SECONDS = QUOTE_CACHE_TTL
 
-results = simobject.run_backtest(
-    strategy=simobject.bollinger_bands_strategy,
-    symbol="TCS",
-    start_date="2023-01-01",
-    end_date="2023-12-31",
-)
 
-print(f"Strategy Return: {results['return']*100:.2f}%")
+class _ThresholdIndex:
+    """Sorted thresholds for one symbol and direction (parallel lists so bisect runs on plain floats)"""
+    __slots__ = ('thresholds', 'ids')
 
-for transaction in results['transactions']:
-    print(transaction)
+    def __init__(self):
+        self.thresholds = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, threshold, alert_id):
+        i = bisect.bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(i, threshold)
+        self.ids.insert(i, alert_id)
+
+    def discard(self, threshold, alert_id):
+        i = bisect.bisect_left(self.thresholds, threshold)
+        while i < len(self.ids) and self.thresholds[i] == threshold:
+            if self.ids[i] == alert_id:
+                del self.thresholds[i], self.ids[i]
+                return True
+            i += 1
+        return False
 
+    def pop_at_or_below(self, price):
+        """Remove and return the ids of every threshold <= price"""
+        i = bisect.bisect_right(self.thresholds, price)
+        ids = self.ids[:i]
+        del self.thresholds[:i], self.ids[:i]
+        return ids
 
-"""
+    def pop_at_or_above(self, price):
+        """Remove and return the ids of every threshold >= price"""
+        i = bisect.bisect_left(self.thresholds, price)
+        ids = self.ids[i:]
+        del self.thresholds[i:], self.ids[i:]
+        return ids
 
 
-############################################
+class PriceAlertEngine:
+    """
+    One-shot price alerts on watchlist items, matched against the live quote stream.
+
+    Each symbol keeps two sorted threshold indexes: alerts that fire when the
+    price rises to a level and alerts that fire when it falls to one. A tick
+    bisects each index once and pops only the crossed prefix/suffix, so matching
+    costs O(log n + triggered) however many alerts are armed. Percentage alerts
+    are turned into a price level against the item's initial price when created.
+    """
+
+    def __init__(self, poll_seconds=ALERT_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._rising = {}  # symbol -> _ThresholdIndex, fires when price >= threshold
+        self._falling = {}  # symbol -> _ThresholdIndex, fires when price <= threshold
+        self._alerts = {}  # id -> armed alert
+        self._subscribers = {}  # user_id -> [queue.Queue]
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._poller = None
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded:
+                return
+            conn = sqlite3.connect('trading_system.db')
+            try:
+                rows = conn.execute('''SELECT id, user_id, watchlist_id, symbol, kind, value, threshold, created_at
+                                       FROM price_alerts WHERE triggered_at IS NULL''').fetchall()
+            finally:
+                conn.close()
+            for row in rows:
+                self._arm(self._alert_dict(row))
+            self._loaded = True
+
+    @staticmethod
+    def _alert_dict(row):
+        alert_id, user_id, watchlist_id, symbol, kind, value, threshold, created_at = row[:8]
+        return {'id': alert_id, 'user_id': user_id, 'watchlist_id': watchlist_id, 'symbol': symbol,
+                'kind': kind, 'value': value, 'threshold': threshold, 'created_at': created_at}
+
+    @staticmethod
+    def _rises(alert):
+        return alert['kind'] == 'ABOVE' or (alert['kind'] == 'CHANGE_PCT' and alert['value'] > 0)
+
+    def _arm(self, alert):
+        book = self._rising if self._rises(alert) else self._falling
+        book.setdefault(alert['symbol'], _ThresholdIndex()).add(alert['threshold'], alert['id'])
+        self._alerts[alert['id']] = alert
+
+    def _disarm(self, alert_id):
+        alert = self._alerts.pop(alert_id, None)
+        if alert:
+            book = self._rising if self._rises(alert) else self._falling
+            index = book.get(alert['symbol'])
+            if index is not None:
+                index.discard(alert['threshold'], alert_id)
+                if not index:
+                    del book[alert['symbol']]
+
+    def add_alert(self, user_id, watchlist_id, symbol, kind, value):
+        """
+        Arm an alert on a watchlist item.
+
+        Parameters:
+            kind (str): ABOVE / BELOW (value is a price) or CHANGE_PCT (value is a signed % move
+                        from the price the symbol was added at)
+
+        Returns:
+            dict: The stored alert, or None if the watchlist item does not exist
+        """
+        kind = str(kind).upper()
+        if kind not in ALERT_KINDS:
+            raise ValueError(f"kind must be one of {', '.join(ALERT_KINDS)}")
+        value = float(value)
+        if (kind == 'CHANGE_PCT' and value == 0) or (kind != 'CHANGE_PCT' and value <= 0):
+            raise ValueError("value must be a positive price, or a non-zero percentage for CHANGE_PCT")
+        self._ensure_loaded()
+
+        conn = sqlite3.connect('trading_system.db')
+        try:
+            row = conn.execute('''SELECT i.last_price FROM watchlist_items i
+                                  JOIN watchlists w ON w.id = i.watchlist_id
+                                  WHERE w.id=? AND w.user_id=? AND i.symbol=?''',
+                               (watchlist_id, user_id, symbol)).fetchone()
+            if row is None:
+                return None
+            threshold = value
+            if kind == 'CHANGE_PCT':
+                base = row[0] if row[0] is not None else get_cached_price(symbol)
+                if base is None:
+                    raise ValueError(f"No reference price for {symbol} yet; try again shortly")
+                threshold = base * (1 + value / 100)
+            created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            cursor = conn.execute('''INSERT INTO price_alerts
+                                     (user_id, watchlist_id, symbol, kind, value, threshold, created_at)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                  (user_id, watchlist_id, symbol, kind, value, threshold, created_at))
+            conn.commit()
+            alert = self._alert_dict((cursor.lastrowid, user_id, watchlist_id, symbol, kind, value,
+                                      threshold, created_at))
+        finally:
+            conn.close()
+        with self._lock:
+            self._arm(alert)
+        return alert
+
+    def remove_alert(self, user_id, alert_id):
+        """Delete one of the user's alerts; returns False if there was no such alert"""
+        conn = sqlite3.connect('trading_system.db')
+        try:
+            cursor = conn.execute('DELETE FROM price_alerts WHERE id=? AND user_id=?', (alert_id, user_id))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._disarm(alert_id)
+        return cursor.rowcount > 0
+
+    def remove_item_alerts(self, watchlist_id, symbols):
+        """Drop every alert on watchlist items that no longer exist"""
+        if not symbols:
+            return
+        conn = sqlite3.connect('trading_system.db')
+        try:
+            marks = ','.join('?' * len(symbols))
+            ids = [row[0] for row in conn.execute(
+                f'SELECT id FROM price_alerts WHERE watchlist_id=? AND symbol IN ({marks})',
+                [watchlist_id] + list(symbols))]
+            conn.execute(f'DELETE FROM price_alerts WHERE watchlist_id=? AND symbol IN ({marks})',
+                         [watchlist_id] + list(symbols))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            for alert_id in ids:
+                self._disarm(alert_id)
+
+    def list_alerts(self, user_id, watchlist_id=None):
+        """All of a user's alerts (armed and triggered), optionally for one watchlist"""
+        conn = sqlite3.connect('trading_system.db')
+        try:
+            query = '''SELECT id, user_id, watchlist_id, symbol, kind, value, threshold, created_at,
+                              triggered_at, triggered_price FROM price_alerts WHERE user_id=?'''
+            params = [user_id]
+            if watchlist_id is not None:
+                query += ' AND watchlist_id=?'
+                params.append(watchlist_id)
+            alerts = []
+            for row in conn.execute(query + ' ORDER BY id', params):
+                alert = self._alert_dict(row)
+                alert.update(triggered_at=row[8], triggered_price=row[9])
+                alerts.append(alert)
+            return alerts
+        finally:
+            conn.close()
+
+    def watched_symbols(self):
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._rising.keys() | self._falling.keys())
+
+    def on_quote(self, symbol, price, quote=None):
+        """Quote listener: fire every alert this price crosses"""
+        if not getattr(MARKET_DATA, 'realtime', False):
+            return  # a stored close replayed as a quote must not fire (and delete) one-shot alerts
+        if not self._loaded:
+            self._ensure_loaded()
+        if symbol not in self._rising and symbol not in self._falling:
+            return
+        with self._lock:
+            ids = []
+            rising = self._rising.get(symbol)
+            if rising is not None:
+                ids += rising.pop_at_or_below(price)
+                if not rising:
+                    del self._rising[symbol]
+            falling = self._falling.get(symbol)
+            if falling is not None:
+                ids += falling.pop_at_or_above(price)
+                if not falling:
+                    del self._falling[symbol]
+            triggered = [self._alerts.pop(alert_id) for alert_id in ids]
+        if triggered:
+            self._fire(triggered, price)
+
+    def _fire(self, alerts, price):
+        triggered_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        events = [dict(alert, triggered_at=triggered_at, triggered_price=price) for alert in alerts]
+        METRICS.inc('quarks_alerts_triggered_total', amount=len(events))
+        with self._lock:
+            targets = [(event, list(self._subscribers.get(event['user_id'], ()))) for event in events]
+        for event, queues in targets:
+            for subscription in queues:
+                try:
+                    subscription.put_nowait(event)
+                except queue.Full:
+                    METRICS.inc('quarks_alerts_dropped_total')
+        conn = sqlite3.connect('trading_system.db')
+        try:
+            conn.executemany('UPDATE price_alerts SET triggered_at=?, triggered_price=? WHERE id=?',
+                             [(triggered_at, price, event['id']) for event in events])
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error recording triggered alerts: {e}")
+        finally:
+            conn.close()
+
+    def subscribe(self, user_id):
+        """Return a queue that receives the user's triggered alerts until unsubscribe()"""
+        subscription = queue.Queue(maxsize=ALERT_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append(subscription)
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll, name='price-alert-poller', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            queues = self._subscribers.get(user_id, [])
+            if subscription in queues:
+                queues.remove(subscription)
+            if not queues:
+                self._subscribers.pop(user_id, None)
+
+    def _poll(self):
+        # While someone is listening, keep quotes flowing for armed symbols (bulk path, cache-aware)
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._poller = None
+                    return
+            symbols = self.watched_symbols()
+            if symbols:
+                try:
+                    with upstream_priority('background'):
+                        get_stock_prices(symbols)
+                except Exception as e:
+                    logger.warning(f"Alert poll failed: {e}")
+            time.sleep(self.poll_seconds)
+
+
+PRICE_ALERTS = PriceAlertEngine()
+add_quote_listener(PRICE_ALERTS.on_quote)
+
 
 class Watchlist:
     def __init__(self, name):
         self.name = name
         self.watchlist = {}  # This will store symbol data
         self.db_id = None  # To track database ID for updates
+        self.version = 0  # Row version for compare-and-swap saves
         self.created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
     def add_to_watchlist(self, symbol, notes="added!"):
-        """Add a stock to the watchlist with validation."""
+        """Add a stock to the watchlist; the initial price comes from the quote cache or is filled later."""
         if symbol in self.watchlist:
-            print(f"{symbol} is already in the watchlist.")
+            logger.info(f"{symbol} is already in the watchlist.")
             return False
 
-        price = get_stock_price(symbol)
-        if price is not None:
-            self.watchlist[symbol] = {
-                'added_on': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'last_price': price,
-                'notes': notes
-            }
-            print(f"Added {symbol} to watchlist at {price:.2f}.")
-            return True
-        else:
-            print(f"Failed to add {symbol} to watchlist.")
-            return False
+        price = WATCHLIST_PRICES.price_or_schedule(symbol)
+        self.watchlist[symbol] = {
+            'added_on': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'last_price': price,
+            'notes': notes
+        }
+        logger.info(f"Added {symbol} to watchlist" + (f" at {price:.2f}." if price is not None else "."))
+        return True
 
     def remove_from_watchlist(self, symbol):
         """Remove a stock from the watchlist."""
         if symbol in self.watchlist:
             del self.watchlist[symbol]
-            print(f"Removed {symbol} from watchlist.")
+            logger.info(f"Removed {symbol} from watchlist.")
             return True
         else:
-            print(f"{symbol} is not in the watchlist.")
+            logger.info(f"{symbol} is not in the watchlist.")
             return False
 
 def view_watchlist(self):
     """Display the current watchlist with updated prices."""
     if not self.watchlist:
-        print("Watchlist is empty.")
+        logger.info("Watchlist is empty.")
         return []
 
     report = []
@@ -1166,8 +5341,7 @@ def view_watchlist(self):
         })
 
     df = pd.DataFrame(report)
-    print("\nWatchlist Summary:")
-    print(df.to_string(index=False))
+    logger.info("Watchlist Summary:\n%s", df.to_string(index=False))
     return report
 """
 wtl1 = Watchlist("watchlist1")
@@ -1179,6 +5353,7 @@ wtl1.view_watchlist()
 """
 
 
+@METRICS.timed('quarks_advice_seconds')
 def generate_advice_sheet(symbol):
     """
     Generate an advice sheet for a given stock and return as JSON-serializable dict.
@@ -1208,7 +5383,7 @@ def generate_advice_sheet(symbol):
     # Fetch historical data for 1-year return calculation
     end_date = date.today()
     start_date = end_date - timedelta(days=365)
-    df = stock_df(symbol, from_date=start_date, to_date=end_date, series="EQ")
+    df = _stock_df(symbol, start_date, end_date)
     if df.empty:
         return {'error': f"No historical data found for {symbol}"}
 
@@ -1465,14 +5640,15 @@ def predict_future_price(symbol, days_ahead=7):
     # Get historical data
     end_date = date.today()
     start_date = end_date - timedelta(days=365)
-    df = stock_df(symbol, from_date=start_date, to_date=end_date, series="EQ")
+    df = _stock_df(symbol, start_date, end_date)
 
     if len(df) < 30:
         return None
 
     # Fit ARIMA model
-    model = ARIMA(df['CLOSE'], order=(5, 1, 0))
-    model_fit = model.fit()
+    with METRICS.timer('quarks_model_fit_seconds', model='arima'):
+        model = ARIMA(df['CLOSE'], order=(5, 1, 0))
+        model_fit = model.fit()
 
     # Make prediction
     forecast = model_fit.forecast(steps=days_ahead)
@@ -1509,21 +5685,20 @@ def save_graph_image(fig, simulation_id, graph_name):
     return path
 
 
+@METRICS.timed('quarks_serialize_seconds')
 def serialize_simulation(simulation):
     """Convert simulation to JSON-serializable dict"""
-    # Convert price_history dates to strings if they exist
+    # Store price history as compact parallel arrays (epoch days + closes)
     portfolio_data = simulation.portfolio.copy()
     if 'price_history' in portfolio_data:
-        portfolio_data['price_history'] = {
-            k.strftime("%Y-%m-%d") if isinstance(k, date) else k: v
-            for k, v in portfolio_data['price_history'].items()
-        }
+        days, closes = price_history_arrays(portfolio_data['price_history'])
+        portfolio_data['price_history'] = columnar_series(days, closes, 'close')
 
+    # Logs are persisted separately (portfolio_logs) so they don't bloat the blob
     data = {
         'name': simulation.name,
         'timestamp': simulation.timestamp,
         'portfolio': portfolio_data,
-        'logs': simulation.logs,
         'images': simulation.images,
         'performance_images': simulation.portfolio.get('performance_images', [])
     }
@@ -1531,6 +5706,29 @@ def serialize_simulation(simulation):
 
 
 # --- Database Setup ---
+def migrate_watchlist_items(c):
+    """Move watchlists still stored as a JSON document (either format) into watchlist_items"""
+    c.execute("SELECT id, symbols, created_at FROM watchlists WHERE symbols != ''")
+    for watchlist_id, symbols_str, created_at in c.fetchall():
+        try:
+            data = json.loads(symbols_str)
+        except json.JSONDecodeError:
+            logger.warning(f"Could not parse watchlist data for watchlist {watchlist_id}; leaving it as is")
+            continue
+        if isinstance(data, dict) and 'symbols' in data:
+            # {'symbols': [...], 'details': {symbol: {...}}}
+            symbols, details = data.get('symbols', []), data.get('details', {})
+        else:
+            # Legacy: a bare list of symbols, no prices yet
+            symbols, details = (data if isinstance(data, list) else []), {}
+        c.executemany('''INSERT OR IGNORE INTO watchlist_items (watchlist_id, symbol, added_on, last_price, notes)
+                         VALUES (?, ?, ?, ?, ?)''',
+                      [(watchlist_id, symbol, details.get(symbol, {}).get('added_on', created_at),
+                        details.get(symbol, {}).get('last_price'), details.get(symbol, {}).get('notes', ''))
+                       for symbol in symbols])
+        c.execute("UPDATE watchlists SET symbols='' WHERE id=?", (watchlist_id,))
+
+
 def create_database():
     conn = sqlite3.connect('trading_system.db')
     c = conn.cursor()
@@ -1548,6 +5746,7 @@ def create_database():
                  user_id INTEGER NOT NULL,
                  name TEXT NOT NULL,
                  data TEXT NOT NULL,  
+                 version INTEGER NOT NULL DEFAULT 0,
                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                  FOREIGN KEY(user_id) REFERENCES users(id))''')
 
@@ -1557,9 +5756,86 @@ def create_database():
                  user_id INTEGER NOT NULL,
                  name TEXT NOT NULL,
                  symbols TEXT NOT NULL,  
+                 version INTEGER NOT NULL DEFAULT 0,
                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                  FOREIGN KEY(user_id) REFERENCES users(id))''')
 
+    # Row versions for compare-and-swap writes (older databases predate the column)
+    for table in ('portfolios', 'watchlists'):
+        columns = [row[1] for row in c.execute(f'PRAGMA table_info({table})')]
+        if 'version' not in columns:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+    # One row per watchlist symbol; UNIQUE(watchlist_id, symbol) doubles as the per-watchlist index
+    c.execute('''CREATE TABLE IF NOT EXISTS watchlist_items (
+                 id INTEGER PRIMARY KEY,
+                 watchlist_id INTEGER NOT NULL,
+                 symbol TEXT NOT NULL,
+                 added_on TEXT,
+                 last_price REAL,
+                 notes TEXT,
+                 UNIQUE(watchlist_id, symbol),
+                 FOREIGN KEY(watchlist_id) REFERENCES watchlists(id))''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_watchlist_items_symbol ON watchlist_items(symbol)')
+
+    # One-shot price alerts on watchlist items; threshold is the absolute price level that fires it
+    c.execute('''CREATE TABLE IF NOT EXISTS price_alerts (
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 user_id INTEGER NOT NULL,
+                 watchlist_id INTEGER NOT NULL,
+                 symbol TEXT NOT NULL,
+                 kind TEXT NOT NULL CHECK(kind IN ('ABOVE', 'BELOW', 'CHANGE_PCT')),
+                 value REAL NOT NULL,
+                 threshold REAL NOT NULL,
+                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                 triggered_at TIMESTAMP,
+                 triggered_price REAL,
+                 FOREIGN KEY(watchlist_id) REFERENCES watchlists(id))''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_price_alerts_item ON price_alerts(watchlist_id, symbol)')
+    migrate_watchlist_items(c)
+
+    # Local daily-bar store (days are epoch-day ints) and the ranges it covers
+    c.execute('''CREATE TABLE IF NOT EXISTS daily_bars (
+                 symbol TEXT NOT NULL,
+                 day INTEGER NOT NULL,
+                 open REAL,
+                 high REAL,
+                 low REAL,
+                 close REAL NOT NULL,
+                 volume INTEGER,
+                 PRIMARY KEY(symbol, day)) WITHOUT ROWID''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS bar_coverage (
+                 symbol TEXT PRIMARY KEY,
+                 first_day INTEGER NOT NULL,
+                 last_day INTEGER NOT NULL)''')
+
+    # Bounded per-portfolio log buffer, kept out of the portfolio data blob
+    c.execute('''CREATE TABLE IF NOT EXISTS portfolio_logs (
+                 portfolio_id INTEGER PRIMARY KEY,
+                 logs TEXT NOT NULL,
+                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                 FOREIGN KEY(portfolio_id) REFERENCES portfolios(id))''')
+
+    # Intraday bars aggregated from live quotes (interval in seconds, start in epoch seconds)
+    c.execute('''CREATE TABLE IF NOT EXISTS intraday_bars (
+                 symbol TEXT NOT NULL,
+                 interval INTEGER NOT NULL,
+                 start INTEGER NOT NULL,
+                 open REAL,
+                 high REAL,
+                 low REAL,
+                 close REAL NOT NULL,
+                 volume REAL,
+                 PRIMARY KEY(symbol, interval, start)) WITHOUT ROWID''')
+
+    # Streaming indicator state, restored on restart so live evaluation stays O(1) per tick
+    c.execute('''CREATE TABLE IF NOT EXISTS indicator_snapshots (
+                 key TEXT PRIMARY KEY,
+                 symbol TEXT NOT NULL,
+                 state TEXT NOT NULL,
+                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
     # NEW TABLE for simulation images
     c.execute('''CREATE TABLE IF NOT EXISTS simulation_images (
                  id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -1681,6 +5957,7 @@ class StrategyManager:
 #####################################################
 
 # --- User Authentication ---
+@METRICS.timed('quarks_db_seconds', fn='register_user')
 def register_user(username, password):
     conn = sqlite3.connect('trading_system.db')
     try:
@@ -1689,12 +5966,13 @@ def register_user(username, password):
         conn.commit()
         return True
     except sqlite3.IntegrityError:
-        print("Username already exists")
+        logger.info("Username already exists")
         return False
     finally:
         conn.close()
 
 
+@METRICS.timed('quarks_db_seconds', fn='authenticate_user')
 def authenticate_user(username, password):
     conn = sqlite3.connect('trading_system.db')
     c = conn.cursor()
@@ -1704,17 +5982,30 @@ def authenticate_user(username, password):
     return user[0] if user else None
 
 
-def save_portfolio(user_id, portfolio_obj):
+WRITE_RETRIES = 5
+
+
+class VersionConflict(Exception):
+    """A row changed between load and save (compare-and-swap on its version failed)"""
+
+
+@METRICS.timed('quarks_db_seconds', fn='save_portfolio')
+def _write_portfolio(user_id, portfolio_obj):
+    """Persist a portfolio in one transaction; updates only apply over the version that was loaded"""
     conn = sqlite3.connect('trading_system.db')
-    print("here")
     try:
         # Serialize the portfolio
         json_data = json.dumps(serialize_simulation(portfolio_obj), cls=PortfolioEncoder)
+        version = getattr(portfolio_obj, 'version', 0)
 
         if hasattr(portfolio_obj, 'db_id'):
             # Update existing portfolio
-            conn.execute('''UPDATE portfolios SET name=?, data=? WHERE id=? AND user_id=?''',
-                         (portfolio_obj.name, json_data, portfolio_obj.db_id, user_id))
+            cursor = conn.execute('''UPDATE portfolios SET name=?, data=?, version=version+1
+                                    WHERE id=? AND user_id=? AND version=?''',
+                                  (portfolio_obj.name, json_data, portfolio_obj.db_id, user_id, version))
+            if cursor.rowcount == 0:
+                raise VersionConflict(f"Portfolio {portfolio_obj.db_id} changed since it was loaded")
+            version += 1
         else:
             # Insert new portfolio
             cursor = conn.cursor()
@@ -1729,23 +6020,96 @@ def save_portfolio(user_id, portfolio_obj):
                 conn.execute('''INSERT INTO simulation_images (simulation_id, image_path, image_type)
                               VALUES (?, ?, ?)''', (portfolio_obj.db_id, img_path, img_type))
 
+        # The log buffer lives in its own row so trades don't rewrite it into the blob
+        conn.execute('''INSERT OR REPLACE INTO portfolio_logs (portfolio_id, logs, updated_at)
+                        VALUES (?, ?, CURRENT_TIMESTAMP)''',
+                     (portfolio_obj.db_id, json.dumps(list(portfolio_obj.logs))))
+
         conn.commit()
+        portfolio_obj.version = version
+    finally:
+        conn.close()
+
+
+def save_portfolio(user_id, portfolio_obj):
+    try:
+        _write_portfolio(user_id, portfolio_obj)
         return True
+    except VersionConflict as e:
+        logger.warning(str(e))
+        return False
     except Exception as e:
-        print(f"Error saving portfolio: {str(e)}")
+        logger.error(f"Error saving portfolio: {str(e)}")
         return False
-    finally:
-        conn.close()
+
+
+def _retry_on_conflict(load, write, mutate, retries):
+    """
+    Load -> mutate -> compare-and-swap write, reloading and re-running mutate on conflict.
+
+    Returns:
+        tuple: (object, mutate result); object is None if the row does not exist.
+               A mutate result of False abandons the write.
+    """
+    for attempt in range(retries + 1):
+        obj = load()
+        if obj is None:
+            return None, None
+        result = mutate(obj)
+        if result is False:
+            return obj, result
+        try:
+            write(obj)
+            return obj, result
+        except VersionConflict:
+            METRICS.inc('quarks_version_conflicts_total')
+            if attempt == retries:
+                raise
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+
+
+def update_portfolio(user_id, portfolio_id, mutate, retries=WRITE_RETRIES):
+    """
+    Apply mutate(portfolio) to the stored portfolio with optimistic concurrency.
+
+    Concurrent writers never overwrite each other: if the row changed after it
+    was loaded, the portfolio is reloaded and mutate runs again on the fresh copy.
+
+    Parameters:
+        user_id (int): Owner of the portfolio
+        portfolio_id (int): Portfolio to update
+        mutate (callable): Applied in memory; return False to skip saving
+        retries (int): Reload attempts after a version conflict
+
+    Returns:
+        tuple: (portfolio, mutate result), portfolio None if it does not exist
+
+    Raises:
+        VersionConflict: if every attempt lost the race
+    """
+    return _retry_on_conflict(lambda: load_portfolio(user_id, portfolio_id),
+                              lambda portfolio: _write_portfolio(user_id, portfolio),
+                              mutate, retries)
+
+
+def load_portfolio_logs(cursor, portfolio_id, data=None):
+    """Return the stored log buffer for a portfolio (legacy blobs kept logs inline)"""
+    cursor.execute('SELECT logs FROM portfolio_logs WHERE portfolio_id=?', (portfolio_id,))
+    row = cursor.fetchone()
+    if row:
+        return json.loads(row[0])
+    return (data or {}).get('logs', [])[-SIMULATION_LOG_LIMIT:]
 
 
 # Update your load_portfolio function
+@METRICS.timed('quarks_db_seconds', fn='load_portfolio')
 def load_portfolio(user_id, portfolio_id):
     conn = sqlite3.connect('trading_system.db')
     try:
         c = conn.cursor()
 
         # Load portfolio data
-        c.execute('''SELECT id, name, data FROM portfolios 
+        c.execute('''SELECT id, name, data, version FROM portfolios 
                    WHERE id=? AND user_id=?''',
                   (portfolio_id, user_id))
         result = c.fetchone()
@@ -1753,14 +6117,19 @@ def load_portfolio(user_id, portfolio_id):
         if not result:
             return None
 
-        db_id, name, data_str = result
+        db_id, name, data_str, version = result
         data = json.loads(data_str)
 
         # Reconstruct portfolio
         portfolio = Simulation(name, data['portfolio']['cash'])
         portfolio.db_id = db_id
+        portfolio.version = version
         portfolio.portfolio.update(data['portfolio'])
-        portfolio.logs = data.get('logs', [])
+        if 'price_history' in portfolio.portfolio:
+            # Older blobs stored {'YYYY-MM-DD': price}; keep the arrays in memory
+            days, closes = price_history_arrays(portfolio.portfolio['price_history'])
+            portfolio.portfolio['price_history'] = {'days': days, 'close': closes}
+        portfolio.logs.extend(load_portfolio_logs(c, db_id, data))
         portfolio.images = data.get('images', [])
 
         # Load associated images
@@ -1778,64 +6147,270 @@ def load_portfolio(user_id, portfolio_id):
 
         return portfolio
     except Exception as e:
-        print(f"Error loading portfolio: {str(e)}")
+        logger.error(f"Error loading portfolio: {str(e)}")
         return None
     finally:
         conn.close()
 
 
+MAX_BATCH_ORDERS = 100
+
+
+def execute_orders(user_id, portfolio_id, orders, live=True):
+    """
+    Apply an ordered batch of buys/sells to one portfolio, all or nothing.
+
+    Prices for every order without an explicit price come from one bulk quote
+    call; the trades are applied in memory and the portfolio is saved once
+    (re-applied on a fresh copy if a concurrent write got there first).
+    If any order fails, nothing is saved and the remaining orders are skipped.
+
+    Parameters:
+        user_id (int): Owner of the portfolio
+        portfolio_id (int): Portfolio to trade
+        orders (list): [{'side': 'BUY'|'SELL', 'symbol': str, 'quantity': int, 'price': float (optional)}]
+        live (bool): Use live quotes (otherwise today's close)
+
+    Returns:
+        dict: {'executed': bool, 'results': [per-order result], 'cash': float}
+              or None if the portfolio does not exist
+
+    Raises:
+        VersionConflict: if concurrent writers kept winning the race
+    """
+    if not orders or len(orders) > MAX_BATCH_ORDERS:
+        raise ValueError(f"Provide 1-{MAX_BATCH_ORDERS} orders")
+    parsed = []
+    for i, order in enumerate(orders):
+        side = str(order.get('side', '')).upper()
+        if side not in ('BUY', 'SELL'):
+            raise ValueError(f"Order {i}: side must be BUY or SELL")
+        quantity = int(order.get('quantity', 0))
+        if quantity <= 0:
+            raise ValueError(f"Order {i}: quantity must be positive")
+        price = order.get('price')
+        parsed.append((side, str(order['symbol']).upper(), quantity, float(price) if price else None))
+
+    quotes = get_stock_prices([symbol for _, symbol, _, price in parsed if price is None], live=live)
+
+    def apply(portfolio):
+        # Re-run from scratch on every attempt; a version conflict reloads the portfolio
+        results[:] = []
+        filled = True
+        for i, (side, symbol, quantity, price) in enumerate(parsed):
+            result = {'index': i, 'side': side, 'symbol': symbol, 'quantity': quantity}
+            if not filled:
+                results.append(dict(result, status='skipped'))
+                continue
+            price = price if price is not None else quotes.get(symbol)
+            if price is None:
+                ok = False
+                portfolio._log(f"Failed to fetch price for {symbol}. Transaction aborted.", logging.WARNING)
+            elif side == 'BUY':
+                ok = portfolio.buy_stock(symbol, quantity, price=price)
+            else:
+                ok = portfolio.sell_stock(symbol, quantity, price=price)
+            results.append(dict(result, price=price, status='filled' if ok else 'failed',
+                                message=portfolio.logs[-1] if portfolio.logs else None))
+            filled = filled and ok
+        return filled
+
+    results = []
+    cash = None
+    try:
+        portfolio, executed = update_portfolio(user_id, portfolio_id, apply)
+        if portfolio is None:
+            return None
+        cash = portfolio.portfolio['cash']
+    except VersionConflict:
+        raise
+    except Exception as e:
+        logger.error(f"Error saving portfolio: {str(e)}")
+        executed = False
+    if not executed:
+        cash = None
+        for result in results:
+            if result['status'] == 'filled':
+                result['status'] = 'rolled_back'
+    return {'executed': executed, 'results': results, 'cash': cash}
+
+
 # --- Watchlist Storage ---
-def save_watchlist(user_id, watchlist_obj):
-    """Save watchlist to database (CREATE or UPDATE)"""
+def _sync_watchlist_items(conn, watchlist_obj):
+    """Make the watchlist_items rows match the in-memory watchlist; returns the symbols removed"""
+    symbols = list(watchlist_obj.watchlist)
+    stale = f"watchlist_id=? AND symbol NOT IN ({','.join('?' * len(symbols))})"
+    removed = [row[0] for row in conn.execute(f'SELECT symbol FROM watchlist_items WHERE {stale}',
+                                              [watchlist_obj.db_id] + symbols)]
+    conn.execute(f'DELETE FROM watchlist_items WHERE {stale}', [watchlist_obj.db_id] + symbols)
+    conn.executemany('''INSERT INTO watchlist_items (watchlist_id, symbol, added_on, last_price, notes)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(watchlist_id, symbol) DO UPDATE SET
+                            added_on=excluded.added_on, last_price=excluded.last_price, notes=excluded.notes''',
+                     [(watchlist_obj.db_id, symbol, data.get('added_on'),
+                       data.get('last_price') if data.get('last_price') is not None else get_cached_price(symbol),
+                       data.get('notes', '')) for symbol, data in watchlist_obj.watchlist.items()])
+    return removed
+
+
+@METRICS.timed('quarks_db_seconds', fn='save_watchlist')
+def _write_watchlist(user_id, watchlist_obj):
+    """Persist a watchlist; updates only apply over the version that was loaded"""
     conn = sqlite3.connect('trading_system.db')
     try:
-        # Prepare complete watchlist data including prices and notes
-        watchlist_data = {
-            'symbols': list(watchlist_obj.watchlist.keys()),  # Maintain list of symbols
-            'details': {  # Store all the detailed information
-                symbol: {
-                    'added_on': data['added_on'],
-                    'last_price': data['last_price'],
-                    'notes': data.get('notes', '')
-                }
-                for symbol, data in watchlist_obj.watchlist.items()
-            }
-        }
-        
+        version = watchlist_obj.version
         if watchlist_obj.db_id:
             # UPDATE existing watchlist
-            conn.execute('''UPDATE watchlists 
-                         SET name=?, symbols=?
-                         WHERE id=? AND user_id=?''',
+            cursor = conn.execute('''UPDATE watchlists 
+                         SET name=?, version=version+1
+                         WHERE id=? AND user_id=? AND version=?''',
                        (watchlist_obj.name, 
-                        json.dumps(watchlist_data),  # Serialize complete data
                         watchlist_obj.db_id,
-                        user_id))
+                        user_id,
+                        version))
+            if cursor.rowcount == 0:
+                raise VersionConflict(f"Watchlist {watchlist_obj.db_id} changed since it was loaded")
+            version += 1
         else:
-            # INSERT new watchlist
+            # INSERT new watchlist (symbols live in watchlist_items; the column is legacy)
             cursor = conn.cursor()
             cursor.execute('''INSERT INTO watchlists 
                            (user_id, name, symbols)
-                           VALUES (?, ?, ?)''',
+                           VALUES (?, ?, '')''',
                          (user_id,
-                          watchlist_obj.name,
-                          json.dumps(watchlist_data)))  # Serialize complete data
+                          watchlist_obj.name))
             watchlist_obj.db_id = cursor.lastrowid
-            
+
+        removed = _sync_watchlist_items(conn, watchlist_obj)
         conn.commit()
+        watchlist_obj.version = version
+    finally:
+        conn.close()
+    PRICE_ALERTS.remove_item_alerts(watchlist_obj.db_id, removed)
+
+
+def save_watchlist(user_id, watchlist_obj):
+    """Save watchlist to database (CREATE or UPDATE)"""
+    try:
+        _write_watchlist(user_id, watchlist_obj)
         return True
+    except VersionConflict as e:
+        logger.warning(str(e))
+        return False
     except Exception as e:
-        print(f"Error saving watchlist: {e}")
+        logger.error(f"Error saving watchlist: {e}")
         return False
+
+
+def update_watchlist(user_id, watchlist_id, mutate, retries=WRITE_RETRIES):
+    """
+    Apply mutate(watchlist) to the stored watchlist with optimistic concurrency.
+
+    Returns:
+        tuple: (watchlist, mutate result), watchlist None if it does not exist
+
+    Raises:
+        VersionConflict: if every attempt lost the race
+    """
+    return _retry_on_conflict(lambda: load_watchlist(user_id, watchlist_id),
+                              lambda watchlist: _write_watchlist(user_id, watchlist),
+                              mutate, retries)
+
+
+def _touch_watchlist(conn, user_id, watchlist_id):
+    """Check ownership and bump the row version so stale full saves can't undo a single-row change"""
+    cursor = conn.execute('UPDATE watchlists SET version=version+1 WHERE id=? AND user_id=?',
+                          (watchlist_id, user_id))
+    return cursor.rowcount > 0
+
+
+@METRICS.timed('quarks_db_seconds', fn='add_watchlist_item')
+def add_watchlist_item(user_id, watchlist_id, symbol, notes="added!"):
+    """
+    Add one symbol to a stored watchlist with a single-row insert.
+
+    Never waits on the network: the initial price comes from the quote cache or
+    is filled in the background by WATCHLIST_PRICES.
+
+    Returns:
+        bool: True if added, False if already present; None if the watchlist does not exist
+    """
+    price = get_cached_price(symbol)
+    conn = sqlite3.connect('trading_system.db')
+    try:
+        if not _touch_watchlist(conn, user_id, watchlist_id):
+            return None
+        cursor = conn.execute('''INSERT OR IGNORE INTO watchlist_items
+                                 (watchlist_id, symbol, added_on, last_price, notes) VALUES (?, ?, ?, ?, ?)''',
+                              (watchlist_id, symbol, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), price, notes))
+        if cursor.rowcount == 0:
+            logger.info(f"{symbol} is already in the watchlist.")
+            return False
+        conn.commit()
     finally:
         conn.close()
-        
+    if price is None:
+        WATCHLIST_PRICES.schedule(symbol)
+    logger.info(f"Added {symbol} to watchlist" + (f" at {price:.2f}." if price is not None else "."))
+    return True
+
+
+@METRICS.timed('quarks_db_seconds', fn='remove_watchlist_item')
+def remove_watchlist_item(user_id, watchlist_id, symbol):
+    """
+    Remove one symbol from a stored watchlist with a single-row delete.
+
+    Returns:
+        bool: True if removed, False if it was not there; None if the watchlist does not exist
+    """
+    conn = sqlite3.connect('trading_system.db')
+    try:
+        if not _touch_watchlist(conn, user_id, watchlist_id):
+            return None
+        cursor = conn.execute('DELETE FROM watchlist_items WHERE watchlist_id=? AND symbol=?',
+                              (watchlist_id, symbol))
+        if cursor.rowcount == 0:
+            logger.info(f"{symbol} is not in the watchlist.")
+            return False
+        conn.commit()
+    finally:
+        conn.close()
+    PRICE_ALERTS.remove_item_alerts(watchlist_id, [symbol])
+    logger.info(f"Removed {symbol} from watchlist.")
+    return True
+
+
+def watchlists_containing(symbol):
+    """Return [(watchlist_id, user_id)] for every watchlist holding symbol (served by the symbol index)"""
+    conn = sqlite3.connect('trading_system.db')
+    try:
+        return conn.execute('''SELECT w.id, w.user_id FROM watchlist_items i
+                               JOIN watchlists w ON w.id = i.watchlist_id
+                               WHERE i.symbol=? ORDER BY w.id''', (symbol,)).fetchall()
+    finally:
+        conn.close()
+
+
+def _load_watchlist_items(cursor, watchlist_ids):
+    """Return {watchlist_id: {symbol: details}} in insertion order"""
+    items = {watchlist_id: {} for watchlist_id in watchlist_ids}
+    if not items:
+        return items
+    cursor.execute(f'''SELECT watchlist_id, symbol, added_on, last_price, notes FROM watchlist_items
+                       WHERE watchlist_id IN ({','.join('?' * len(items))}) ORDER BY id''',
+                   list(items))
+    for watchlist_id, symbol, added_on, last_price, notes in cursor.fetchall():
+        items[watchlist_id][symbol] = {'added_on': added_on, 'last_price': last_price, 'notes': notes or ''}
+    return items
+
+
+@METRICS.timed('quarks_db_seconds', fn='load_watchlist')
 def load_watchlist(user_id, watchlist_id):
     """Load watchlist from database"""
     conn = sqlite3.connect('trading_system.db')
     try:
         c = conn.cursor()
-        c.execute('''SELECT id, name, symbols, created_at 
+        c.execute('''SELECT id, name, created_at, version 
                    FROM watchlists 
                    WHERE id=? AND user_id=?''',
                 (watchlist_id, user_id))
@@ -1844,64 +6419,42 @@ def load_watchlist(user_id, watchlist_id):
         if not row:
             return None
             
-        db_id, name, symbols_str, created_at = row
+        db_id, name, created_at, version = row
         watchlist = Watchlist(name)
         watchlist.db_id = db_id
+        watchlist.version = version
         watchlist.created_at = created_at
-        
-        try:
-            # Parse the serialized data
-            data = json.loads(symbols_str) if symbols_str else {}
-            
-            # Handle both old format (just list) and new format (with details)
-            if isinstance(data, dict) and 'symbols' in data:
-                # New format with details
-                symbols = data.get('symbols', [])
-                details = data.get('details', {})
-                
-                for symbol in symbols:
-                    if symbol in details:
-                        watchlist.watchlist[symbol] = details[symbol]
-                    else:
-                        # Fallback for incomplete data
-                        watchlist.watchlist[symbol] = {
-                            'added_on': created_at,
-                            'last_price': get_stock_price(symbol),
-                            'notes': ""
-                        }
-            else:
-                # Old format (just list of symbols)
-                symbols = data if isinstance(data, list) else []
-                for symbol in symbols:
-                    watchlist.watchlist[symbol] = {
-                        'added_on': created_at,
-                        'last_price': get_stock_price(symbol),
-                        'notes': ""
-                    }
-                    
-        except json.JSONDecodeError:
-            # Handle case where data couldn't be parsed
-            print(f"Warning: Could not parse watchlist data for {name}")
-            watchlist.watchlist = {}
-            
+        watchlist.watchlist = _load_watchlist_items(c, [db_id])[db_id]
+        for symbol, details in watchlist.watchlist.items():
+            if details['last_price'] is None:
+                # Migrated legacy rows carry no price; fill them in the background
+                WATCHLIST_PRICES.schedule(symbol)
         return watchlist
     except Exception as e:
-        print(f"Error loading watchlist: {e}")
+        logger.error(f"Error loading watchlist: {e}")
         return None
     finally:
         conn.close()
         
-def get_user_portfolios(user_id):
-    """Get ALL portfolios for a user in a nested structure"""
+def get_user_portfolios(user_id, valuate=False):
+    """
+    Get ALL portfolios for a user in a nested structure.
+
+    With valuate=True every portfolio is also marked to market; quotes for the
+    union of all holdings are fetched once and valued in a single pass.
+    """
     conn = sqlite3.connect('trading_system.db')
     try:
-        c = conn.cursor()
-        c.execute('''SELECT id, name, data, created_at FROM portfolios
-                   WHERE user_id=? ORDER BY created_at DESC''',
-                  (user_id,))
+        # Only the SQLite read is timed as DB latency; quotes are timed upstream
+        with METRICS.timer('quarks_db_seconds', fn='get_user_portfolios'):
+            c = conn.cursor()
+            c.execute('''SELECT id, name, data, created_at FROM portfolios
+                       WHERE user_id=? ORDER BY created_at DESC''',
+                      (user_id,))
+            rows = c.fetchall()
 
         portfolios = []
-        for row in c.fetchall():
+        for row in rows:
             try:
                 portfolio_data = json.loads(row[2])
 
@@ -1919,7 +6472,7 @@ def get_user_portfolios(user_id):
                 portfolios.append(portfolio)
 
             except (json.JSONDecodeError, KeyError) as e:
-                print(f"Error processing portfolio {row[0]}: {str(e)}")
+                logger.error(f"Error processing portfolio {row[0]}: {str(e)}")
                 portfolios.append({
                     'id': row[0],
                     'name': row[1],
@@ -1928,6 +6481,14 @@ def get_user_portfolios(user_id):
                     'error': f"Could not load portfolio data: {str(e)}"
                 })
 
+        if valuate:
+            valid = [p for p in portfolios if 'data' in p]
+            snapshots = [p['data'].get('portfolio', {}) for p in valid]
+            symbols = [s for snap in snapshots for s in snap.get('holdings', {})]
+            prices = get_stock_prices(symbols)
+            for p, valuation in zip(valid, value_portfolios(snapshots, prices)):
+                p['valuation'] = valuation
+
         return {
             'user_id': user_id,
             'count': len(portfolios),
@@ -1941,39 +6502,31 @@ def get_user_watchlists(user_id):
     """Get ALL watchlists for a user with detailed information"""
     conn = sqlite3.connect('trading_system.db')
     try:
-        c = conn.cursor()
-        c.execute('''SELECT id, name, symbols, created_at 
-                   FROM watchlists
-                   WHERE user_id=? 
-                   ORDER BY created_at DESC''',
-                  (user_id,))
+        with METRICS.timer('quarks_db_seconds', fn='get_user_watchlists'):
+            c = conn.cursor()
+            c.execute('''SELECT id, name, created_at 
+                       FROM watchlists
+                       WHERE user_id=? 
+                       ORDER BY created_at DESC''',
+                      (user_id,))
+            rows = c.fetchall()
+            items = _load_watchlist_items(c, [row[0] for row in rows])
+        prices = get_stock_prices([symbol for details in items.values() for symbol in details])
 
         watchlists = []
-        for row in c.fetchall():
+        for db_id, name, created_at in rows:
             try:
-                db_id, name, data_str, created_at = row
-                data = json.loads(data_str) if data_str else {}
-
-                # Handle both old (array) and new (object with symbols/details) formats
-                if isinstance(data, dict) and 'symbols' in data:
-                    # New format
-                    symbols = data['symbols']
-                    details = data.get('details', {})
-                else:
-                    # Old format (just array of symbols)
-                    symbols = data if isinstance(data, list) else []
-                    details = {}
+                details = items[db_id]
 
                 # Create summary for each watchlist
                 watchlist_summary = []
-                for symbol in symbols:
-                    symbol_data = details.get(symbol, {})
-                    current_price = get_stock_price(symbol)
-                    initial_price = symbol_data.get('last_price', current_price)
+                for symbol, symbol_data in details.items():
+                    current_price = prices.get(symbol)
+                    initial_price = symbol_data.get('last_price') or current_price
                     
                     watchlist_summary.append({
                         'Symbol': symbol,
-                        'Added On': symbol_data.get('added_on', created_at),
+                        'Added On': symbol_data.get('added_on') or created_at,
                         'Initial Price': initial_price,
                         'Current Price': current_price if current_price else "N/A",
                         'Change': current_price - initial_price 
@@ -1986,16 +6539,16 @@ def get_user_watchlists(user_id):
                     'id': db_id,
                     'name': name,
                     'created_at': created_at,
-                    'symbol_count': len(symbols),
+                    'symbol_count': len(details),
                     'watchlist_summary': watchlist_summary
                 })
 
             except Exception as e:
-                print(f"Error processing watchlist {row[0]}: {str(e)}")
+                logger.error(f"Error processing watchlist {db_id}: {str(e)}")
                 watchlists.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'created_at': row[3],
+                    'id': db_id,
+                    'name': name,
+                    'created_at': created_at,
                     'error': str(e)
                 })
 
@@ -2007,6 +6560,7 @@ def get_user_watchlists(user_id):
     finally:
         conn.close()
         
+@METRICS.timed('quarks_db_seconds', fn='get_portfolio_details')
 def get_portfolio_details(portfolio_id):
     """Get full details of a specific portfolio with additional metadata"""
     conn = sqlite3.connect('trading_system.db')
@@ -2042,7 +6596,7 @@ def get_portfolio_details(portfolio_id):
                 'holdings': data['portfolio']['holdings'],
                 'transactions': data['portfolio']['transactions'],
                 'performance_images': data['portfolio'].get('performance_images', []),
-                'logs': data.get('logs', []),
+                'logs': load_portfolio_logs(c, portfolio_id, data),
                 'return': data['portfolio'].get('return', 0)
             },
             'images': images,
@@ -2058,80 +6612,61 @@ def get_watchlist_details(watchlist_id):
     """Get detailed watchlist information"""
     conn = sqlite3.connect('trading_system.db')
     try:
-        c = conn.cursor()
-        c.execute('''SELECT id, user_id, name, symbols, created_at 
-                   FROM watchlists WHERE id=?''',
-                  (watchlist_id,))
-        result = c.fetchone()
-        if not result:
-            return None
-
-        db_id, user_id, name, data_str, created_at = result
-
-        try:
-            data = json.loads(data_str) if data_str else {}
+        with METRICS.timer('quarks_db_seconds', fn='get_watchlist_details'):
+            c = conn.cursor()
+            c.execute('''SELECT id, user_id, name, created_at 
+                       FROM watchlists WHERE id=?''',
+                      (watchlist_id,))
+            result = c.fetchone()
+            if not result:
+                return None
+
+            db_id, user_id, name, created_at = result
+            details = _load_watchlist_items(c, [db_id])[db_id]
+        prices = get_stock_prices(list(details))
+
+        watchlist_data = []
+        for symbol, symbol_data in details.items():
+            current_price = prices.get(symbol)
+            initial_price = symbol_data.get('last_price') or current_price
             
-            # Handle both old and new formats
-            if isinstance(data, dict) and 'symbols' in data:
-                # New format
-                symbols = data['symbols']
-                details = data.get('details', {})
-            else:
-                # Old format
-                symbols = data if isinstance(data, list) else []
-                details = {}
-
-            watchlist_data = []
-            for symbol in symbols:
-                symbol_data = details.get(symbol, {})
-                current_price = get_stock_price(symbol)
-                initial_price = symbol_data.get('last_price', current_price)
-                
-                watchlist_data.append({
-                    'Symbol': symbol,
-                    'Added On': symbol_data.get('added_on', created_at),
-                    'Initial Price': initial_price,
-                    'Current Price': current_price if current_price else "N/A",
-                    'Change': current_price - initial_price 
-                             if current_price and initial_price and isinstance(initial_price, (int, float))
-                             else "N/A",
-                    'Change_Percent': ((current_price - initial_price) / initial_price * 100) 
-                                     if current_price and initial_price and initial_price != 0
-                                     else "N/A",
-                    'Notes': symbol_data.get('notes', ''),
-                    'Current_Time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
+            watchlist_data.append({
+                'Symbol': symbol,
+                'Added On': symbol_data.get('added_on') or created_at,
+                'Initial Price': initial_price,
+                'Current Price': current_price if current_price else "N/A",
+                'Change': current_price - initial_price 
+                         if current_price and initial_price and isinstance(initial_price, (int, float))
+                         else "N/A",
+                'Change_Percent': ((current_price - initial_price) / initial_price * 100) 
+                                 if current_price and initial_price and initial_price != 0
+                                 else "N/A",
+                'Notes': symbol_data.get('notes', ''),
+                'Current_Time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
 
-            return {
-                'id': db_id,
-                'user_id': user_id,
-                'name': name,
-                'created_at': created_at,
-                'watchlist_summary': watchlist_data,
-                'symbol_count': len(symbols),
-                'total_change': sum(
-                    item['Change'] for item in watchlist_data 
-                    if isinstance(item['Change'], (int, float))
-                ),
-                'metadata': {
-                    'format': 'enhanced' if isinstance(data, dict) and 'symbols' in data else 'legacy'
-                }
-            }
-        except json.JSONDecodeError as e:
-            return {
-                'id': db_id,
-                'user_id': user_id,
-                'name': name,
-                'created_at': created_at,
-                'error': 'Could not parse watchlist data',
-                'raw_data': data_str
+        return {
+            'id': db_id,
+            'user_id': user_id,
+            'name': name,
+            'created_at': created_at,
+            'watchlist_summary': watchlist_data,
+            'symbol_count': len(details),
+            'total_change': sum(
+                item['Change'] for item in watchlist_data 
+                if isinstance(item['Change'], (int, float))
+            ),
+            'metadata': {
+                'format': 'enhanced'
             }
+        }
     except Exception as e:
-        print(f"Error getting watchlist details: {str(e)}")
+        logger.error(f"Error getting watchlist details: {str(e)}")
         return None
     finally:
         conn.close()
         
+@METRICS.timed('quarks_db_seconds', fn='get_portfolio_images')
 def get_portfolio_images(portfolio_id):
     """Get all images associated with a portfolio"""
     conn = sqlite3.connect('trading_system.db')
@@ -31,11 +31,18 @@ type Transaction = {
   pl?: number;
 };
 
+// Columnar daily series: `days` are offsets from the Unix epoch (1970-01-01)
+type PriceHistory = {
+  epoch: string;
+  days: number[];
+  close: number[];
+};
+
 type BacktestResult = {
   return: number;
   transactions: Transaction[];
   graph_path: string;
-  price_history: Record<string, number>;
+  price_history: PriceHistory;
 };
 
 type BacktestResultCardProps = {
@@ -82,8 +89,10 @@ export default function BacktestResultCard({ result, strategyType = 'BOLLINGER'
     .reduce((sum, t) => sum + (t.pl || 0), 0);
 
   // Get dates and prices as arrays
-  const dates = Object.keys(result.price_history);
-  const prices = Object.values(result.price_history);
+  const dates = result.price_history.days.map(day =>
+    new Date(day * 86400000).toISOString().slice(0, 10)
+  );
+  const prices = result.price_history.close;
   
   // Get the symbol from the first transaction
   const symbol = result.transactions.length > 0 ? result.transactions[0].symbol : 'Stock';